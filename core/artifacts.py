@@ -0,0 +1,131 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from .ingest import read_inputs, INPUTS_FILE_NAME
+
+# Name of the folder holding the derived artifacts of a task, and of their manifest, in a task directory
+ARTIFACTS_DIRECTORY_NAME = 'artifacts'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+# One lock per manifest, artifacts of a task are built from the GUI thread and from worker threads
+_manifest_locks = {}
+_manifest_locks_lock = threading.Lock()
+
+
+def file_identity(path):
+    """
+    Identify a file by its path, size and modification time, for files too large to hash when a task is opened.
+    """
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    Return a hash of the content of a file, read a block at a time.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def task_inputs(task):
+    """
+    Identify the rows of a task, the input of the artifacts derived from its data: the inputs listed in
+    inputs.json, which change when rows are appended, or the original file for a task reading its field from it.
+    Labels are not part of it, saving labels does not invalidate any artifact.
+    """
+    if task.field_in_source:
+        return {'source': file_identity(task.source_file_path)}
+    inputs_path = os.path.join(os.path.dirname(task.file_path), INPUTS_FILE_NAME)
+    return {'inputs': read_inputs(inputs_path, task.file_path, task.label_column_name)}
+
+
+class ArtifactStore:
+    """
+    The artifacts derived from a task's data, like the row offsets of its original file or the scores of its rows,
+    stored in the artifacts folder of the task directory under a key hashed from everything they are computed from:
+    their inputs, parameters and the version of the code computing them. manifest.json maps the name of each
+    artifact to its key, file and inputs, so an artifact whose inputs did not change is reused as is, after a crash
+    or an upgrade too, and a changed input tells which artifacts have to be computed again.
+    Artifacts are written to a temporary file and renamed into place before the manifest refers to them, the
+    manifest is replaced atomically. Only the latest artifact of each name is kept.
+    """
+
+    def __init__(self, task_directory):
+        self.directory = os.path.join(task_directory, ARTIFACTS_DIRECTORY_NAME)
+        self.manifest_path = os.path.join(task_directory, MANIFEST_FILE_NAME)
+        with _manifest_locks_lock:
+            self.lock = _manifest_locks.setdefault(os.path.abspath(self.manifest_path), threading.Lock())
+
+    @staticmethod
+    def key(name, inputs):
+        data = json.dumps({'name': name, 'inputs': inputs}, sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def path(self, name, key, extension=''):
+        return os.path.join(self.directory, f'{name}-{key[:16]}{extension}')
+
+    def manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, name, inputs):
+        """
+        Return the path of the artifact with the given name computed from the given inputs, or None if there is
+        none.
+        """
+        entry = self.manifest().get(name)
+        if entry is None or entry['key'] != self.key(name, inputs):
+            return None
+        path = os.path.join(self.directory, entry['file'])
+        return path if os.path.exists(path) else None
+
+    def build(self, name, inputs, write, extension=''):
+        """
+        Return the path of the artifact with the given name computed from the given inputs, calling write with a
+        temporary path to compute it only if it is not in the store.
+        """
+        path = self.lookup(name, inputs)
+        if path is not None:
+            return path
+        return self.put(name, inputs, write, extension)
+
+    def put(self, name, inputs, write, extension=''):
+        """
+        Compute an artifact by calling write with a temporary path, e.g. to store an artifact updated
+        incrementally, and record it in the manifest. Returns its path.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        key = self.key(name, inputs)
+        path = self.path(name, key, extension)
+        temporary_path = f'{path}.tmp{extension}'
+        if os.path.exists(temporary_path):
+            # Left by an interrupted build
+            os.remove(temporary_path)
+        write(temporary_path)
+        os.replace(temporary_path, path)
+        with self.lock:
+            manifest = self.manifest()
+            old_entry = manifest.get(name)
+            manifest[name] = {'key': key, 'file': os.path.basename(path), 'inputs': inputs,
+                              'created_at': datetime.datetime.now().isoformat(timespec='seconds')}
+            temporary_manifest_path = f'{self.manifest_path}.tmp'
+            with open(temporary_manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(temporary_manifest_path, self.manifest_path)
+        if old_entry is not None and old_entry['file'] != os.path.basename(path):
+            try:
+                os.remove(os.path.join(self.directory, old_entry['file']))
+            except OSError:
+                # Missing, or still mapped by another window on Windows, it is left behind
+                pass
+        return path
@@ -0,0 +1,202 @@
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+from .artifacts import file_digest
+from .phrase_matcher import PhraseMatcher
+from .synonym_index import score_stacked, make_vectorizer, vectorize
+
+# Bumped when scores computed by older code must not be reused
+SCORING_VERSION = 1
+
+# State of a worker process, set once by _init_worker
+_worker = {}
+
+
+def write_shared_texts(texts, directory, max_chars=None):
+    """
+    Write the texts as UTF-8 into directory/texts.bin with their byte offsets in directory/offsets.npy, so worker
+    processes can memory-map them instead of receiving them pickled. Texts are cut to max_chars characters if given.
+    Returns the number of texts.
+    """
+    offsets = [0]
+    with open(os.path.join(directory, 'texts.bin'), 'wb') as f:
+        for text in texts:
+            data = str(text)[:max_chars].encode('utf-8')
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(os.path.join(directory, 'offsets.npy'), np.asarray(offsets, dtype=np.uint64))
+    return len(offsets) - 1
+
+
+def write_shared_synonyms(synonym_index, directory):
+    """
+    Write the stacked synonym matrix of the index into directory as .npy files, with what the workers need to
+    rebuild the index's vectorizer and phrase matcher. Returns the class names, in the column order of the scores.
+    """
+    class_names = synonym_index.class_names
+    matrix, row_columns = synonym_index.stacked(class_names)
+    for name, array in [('data', matrix.data), ('indices', matrix.indices), ('indptr', matrix.indptr),
+                        ('row_columns', row_columns)]:
+        np.save(os.path.join(directory, f'synonyms_{name}.npy'), array)
+    if synonym_index.idf is not None:
+        np.save(os.path.join(directory, 'idf.npy'), synonym_index.idf)
+    with open(os.path.join(directory, 'synonyms.json'), 'w') as f:
+        json.dump({'class_names': class_names, 'n_features': synonym_index.n_features,
+                   'class_synonyms': synonym_index.class_synonyms}, f)
+    return class_names
+
+
+def _init_worker(directory, output_path):
+    with open(os.path.join(directory, 'synonyms.json')) as f:
+        meta = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+    n_features = meta['n_features']
+    _worker['matrix'] = sp.csr_matrix((load('synonyms_data'), load('synonyms_indices'), load('synonyms_indptr')),
+                                      shape=(len(load('synonyms_indptr')) - 1, n_features), copy=False)
+    _worker['row_columns'] = load('synonyms_row_columns')
+    _worker['class_names'] = meta['class_names']
+    _worker['idf'] = load('idf') if os.path.exists(os.path.join(directory, 'idf.npy')) else None
+    _worker['vectorizer'] = make_vectorizer(n_features, _worker['idf'])
+    _worker['matcher'] = PhraseMatcher(meta['class_synonyms'])
+    _worker['texts'] = np.memmap(os.path.join(directory, 'texts.bin'), dtype=np.uint8, mode='r') \
+        if os.path.getsize(os.path.join(directory, 'texts.bin')) else np.empty(0, dtype=np.uint8)
+    _worker['offsets'] = load('offsets')
+    _worker['output'] = np.load(output_path, mmap_mode='r+')
+
+
+def _score_range(start, stop):
+    """
+    Score the texts start to stop into the output array. Texts with exact synonym matches are scored by them, the
+    others by vector similarity, like SynonymIndex.suggest without pruning.
+    """
+    texts_buffer = _worker['texts']
+    offsets = _worker['offsets']
+    texts = [bytes(texts_buffer[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(start, stop)]
+    class_names = _worker['class_names']
+    scores = score_stacked(vectorize(_worker['vectorizer'], texts, _worker['idf']), _worker['matrix'], _worker['row_columns'],
+                           len(class_names))
+
+    columns = {class_name: column for column, class_name in enumerate(class_names)}
+    for row, text in enumerate(texts):
+        matches = _worker['matcher'].find(text)
+        if matches:
+            scores[row] = 0
+            for class_name, score in PhraseMatcher.class_scores(matches, text).items():
+                scores[row, columns[class_name]] = score
+
+    output = _worker['output']
+    output[start:stop] = scores
+    output.flush()
+    return stop - start
+
+
+def score_rows(synonym_index, texts, output_path, processes=None, chunk_rows=20000, progress=None, max_chars=None):
+    """
+    Score many texts against every class of the synonym index, in parallel over a pool of processes.
+    The texts and the synonym matrix are written once to memory-mapped files that every worker attaches to, and
+    each worker writes its rows straight into output_path, a float32 .npy array of shape (texts, classes)
+    allocated up front. processes defaults to the number of cores, 1 scores in this process.
+    progress, if given, is called with the number of rows scored so far. Only the first max_chars characters of
+    each text are scored if given.
+    Returns the class names of the score columns.
+    """
+    output_directory = os.path.dirname(os.path.abspath(output_path))
+    directory = tempfile.mkdtemp(prefix='bulk_scoring_', dir=output_directory)
+    try:
+        row_count = write_shared_texts(texts, directory, max_chars)
+        return _score_shared_texts(directory, row_count, synonym_index, output_path, processes, chunk_rows, progress)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def score_rows_cached(store, synonym_index, texts, processes=None, chunk_rows=20000, progress=None, max_chars=None):
+    """
+    Score texts like score_rows, into the suggestion_scores artifact of a task's ArtifactStore. The artifact is
+    keyed by a hash of the texts as scored and the fingerprint of the synonym index, so the same texts scored
+    again with the same synonyms are not scored again.
+    Returns the class names of the score columns and the path of the scores.
+    """
+    os.makedirs(store.directory, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix='bulk_scoring_', dir=store.directory)
+    try:
+        row_count = write_shared_texts(texts, directory, max_chars)
+        inputs = {'texts': file_digest(os.path.join(directory, 'texts.bin')),
+                  'offsets': file_digest(os.path.join(directory, 'offsets.npy')),
+                  'synonyms': synonym_index.fingerprint, 'version': SCORING_VERSION}
+        if store.lookup('suggestion_scores', inputs) is not None and progress is not None:
+            progress(row_count)
+        path = store.build('suggestion_scores', inputs,
+                           lambda path: _score_shared_texts(directory, row_count, synonym_index, path, processes,
+                                                            chunk_rows, progress), '.npy')
+        return synonym_index.class_names, path
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _score_shared_texts(directory, row_count, synonym_index, output_path, processes, chunk_rows, progress):
+    class_names = write_shared_synonyms(synonym_index, directory)
+    output = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32,
+                                       shape=(row_count, len(class_names)))
+    del output
+
+    ranges = [(start, min(start + chunk_rows, row_count)) for start in range(0, row_count, chunk_rows)]
+    processes = min(processes or os.cpu_count() or 1, max(len(ranges), 1))
+    done = 0
+    if processes == 1:
+        _init_worker(directory, output_path)
+        try:
+            for start, stop in ranges:
+                done += _score_range(start, stop)
+                if progress is not None:
+                    progress(done)
+        finally:
+            _worker.clear()
+    else:
+        # Workers are spawned rather than forked, forking a process running Qt threads is not safe
+        with concurrent.futures.ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=_init_worker,
+                                                    initargs=(directory, output_path)) as executor:
+            futures = [executor.submit(_score_range, start, stop) for start, stop in ranges]
+            for future in concurrent.futures.as_completed(futures):
+                done += future.result()
+                if progress is not None:
+                    progress(done)
+    return class_names
+
+
+def auto_label(scores, class_names, labels, threshold, single_class=True):
+    """
+    Pick the classes scoring at least threshold (and above 0) for each row of a score array. Single class tasks take
+    the best class only. Returns the positions of the rows with at least one class and their lists of label indices.
+    """
+    label_indices = [i for i, label in enumerate(labels) if label in class_names]
+    label_columns = [class_names.index(labels[i]) for i in label_indices]
+    positions = []
+    classes = []
+    if not label_columns:
+        return np.asarray(positions, dtype=np.int64), classes
+    block_rows = 100000
+    for start in range(0, len(scores), block_rows):
+        block = np.asarray(scores[start:start + block_rows])[:, label_columns]
+        confident = (block >= threshold) & (block > 0)
+        if single_class:
+            best = block.argmax(axis=1)
+            for row in np.flatnonzero(confident[np.arange(len(block)), best]):
+                positions.append(start + row)
+                classes.append([label_indices[best[row]]])
+        else:
+            rows, columns = np.nonzero(confident)
+            unique_rows, first = np.unique(rows, return_index=True)
+            for row, row_columns in zip(unique_rows, np.split(columns, first[1:])):
+                positions.append(start + row)
+                classes.append([label_indices[column] for column in row_columns])
+    return np.asarray(positions, dtype=np.int64), classes
@@ -0,0 +1,108 @@
+import collections
+
+from .phrase_matcher import tokenize
+
+# Length of the longest prefix kept in the prefix index, longer query words are looked up by trigram
+MAX_PREFIX_LENGTH = 3
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class ClassPaletteIndex:
+    """
+    Index of the class names and synonyms of a task for the type-to-filter class palette.
+    Every word of a class name or synonym is indexed by its prefixes of up to MAX_PREFIX_LENGTH characters and by
+    its trigrams, so a query only visits the classes sharing a prefix or trigram with it and filtering stays fast
+    with hundreds of classes.
+    """
+
+    def __init__(self, labels, class_synonyms=None):
+        class_synonyms = class_synonyms or {}
+        self.labels = list(labels)
+        self.prefix_index = collections.defaultdict(set)
+        self.trigram_index = collections.defaultdict(set)
+        self.name_words = []
+        self.synonym_words = []
+        self.names = []
+
+        for i, label in enumerate(self.labels):
+            name_words = tokenize(label)[0]
+            synonym_words = set()
+            for term in self._terms(class_synonyms.get(label)):
+                synonym_words.update(tokenize(term)[0])
+            self.names.append(label.lower())
+            self.name_words.append(name_words)
+            self.synonym_words.append(synonym_words)
+            for word in set(name_words) | synonym_words:
+                for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                    self.prefix_index[word[:length]].add(i)
+                for trigram in trigrams(word):
+                    self.trigram_index[trigram].add(i)
+
+    @staticmethod
+    def _terms(synonyms):
+        if synonyms is None:
+            return []
+        if not isinstance(synonyms, dict):
+            return [str(synonym) for synonym in synonyms]
+        terms = []
+        for subcategory, sub_synonyms in synonyms.items():
+            terms.append(str(subcategory))
+            terms.extend(str(synonym) for synonym in sub_synonyms)
+        return terms
+
+    def _word_candidates(self, word):
+        """
+        Return a dict mapping each class matching a query word to how well it matches: 0 for a prefix of the class
+        name, 1 for a prefix of a word of the name, 2 for a prefix of a synonym word, and between 2 and 3 for
+        classes sharing at least half of the word's trigrams.
+        """
+        if len(word) <= MAX_PREFIX_LENGTH:
+            candidates = self.prefix_index.get(word, ())
+        else:
+            candidates = self.prefix_index.get(word[:MAX_PREFIX_LENGTH], set())
+        matches = {}
+        for i in candidates:
+            if self.names[i].startswith(word):
+                matches[i] = 0
+            elif any(name_word.startswith(word) for name_word in self.name_words[i]):
+                matches[i] = 1
+            elif any(synonym_word.startswith(word) for synonym_word in self.synonym_words[i]):
+                matches[i] = 2
+
+        word_trigrams = trigrams(word)
+        if len(word) > MAX_PREFIX_LENGTH and word_trigrams:
+            shared = collections.Counter()
+            for trigram in word_trigrams:
+                shared.update(self.trigram_index.get(trigram, ()))
+            for i, count in shared.items():
+                overlap = count / len(word_trigrams)
+                if i not in matches and overlap >= 0.5:
+                    matches[i] = 3 - overlap
+        return matches
+
+    def search(self, query, scores=None, limit=10):
+        """
+        Return the indices of the classes matching the query, best first. Every word of the query has to match.
+        Classes matching equally well are ranked by their scores, a dict mapping class name to the current
+        suggestion score. An empty query ranks every class by score.
+        """
+        scores = scores or {}
+        words = tokenize(query)[0]
+        if not words:
+            ranked = sorted(range(len(self.labels)), key=lambda i: -scores.get(self.labels[i], 0.0))
+            return ranked[:limit]
+
+        matches = None
+        for word in words:
+            word_matches = self._word_candidates(word)
+            if matches is None:
+                matches = word_matches
+            else:
+                matches = {i: max(quality, word_matches[i]) for i, quality in matches.items() if i in word_matches}
+            if not matches:
+                return []
+        ranked = sorted(matches, key=lambda i: (matches[i], -scores.get(self.labels[i], 0.0), i))
+        return ranked[:limit]
@@ -0,0 +1,166 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .artifacts import ArtifactStore
+from .ingest import read_chunks, read_columns, read_inputs, row_hashes, INPUTS_FILE_NAME
+from .label_store import decode_labels, label_names
+from .persistence import LabelJournal
+from .source_rows import SourceRows, row_offsets_path
+
+
+class LabelColumn:
+    """
+    Reads the raw label values of a task in row order, a chunk of data.csv at a time, with the labels saved to the
+    journal since data.csv was last written applied over them. take returns the labels of the next rows, so the
+    labels can be joined to rows read in chunks of any other size.
+    """
+
+    def __init__(self, data_path, label_column_name, journal_labels=None, chunk_rows=100000):
+        self.reader = pd.read_csv(data_path, usecols=[label_column_name], dtype=str, chunksize=chunk_rows)
+        self.label_column_name = label_column_name
+        journal_labels = journal_labels or {}
+        self.journal_rows = np.array(sorted(journal_labels), dtype=np.int64)
+        self.journal_values = [journal_labels[row] for row in self.journal_rows.tolist()]
+        self.buffer = np.empty(0, dtype=object)
+        # Row id of the first label in the buffer
+        self.row = 0
+
+    def _read(self):
+        chunk = next(self.reader, None)
+        if chunk is None:
+            return False
+        values = chunk[self.label_column_name].to_numpy(dtype=object, na_value=None)
+        start = self.row + len(self.buffer)
+        first, last = np.searchsorted(self.journal_rows, [start, start + len(values)])
+        for i in range(first, last):
+            values[self.journal_rows[i] - start] = self.journal_values[i]
+        self.buffer = np.concatenate([self.buffer, values])
+        return True
+
+    def take(self, count):
+        while len(self.buffer) < count:
+            if not self._read():
+                raise ValueError(f"The task has {self.row + len(self.buffer)} rows, its original files have more")
+        values, self.buffer = self.buffer[:count], self.buffer[count:]
+        self.row += count
+        return values
+
+    def remaining(self):
+        while self._read():
+            pass
+        return len(self.buffer)
+
+    def close(self):
+        self.reader.close()
+
+
+def _journal_labels(task_directory):
+    journal_path = os.path.join(task_directory, 'labels.journal')
+    return LabelJournal(journal_path).replay() if os.path.exists(journal_path) else {}
+
+
+def export_labels(task, output_path, only_labelled=False, chunk_rows=100000):
+    """
+    Write the rows of a task as they are in data.csv to output_path, the copied columns and the label values, with
+    the labels saved to the journal since data.csv was last written applied over them. data.csv of a task reading
+    its field from the original file only holds the labels, the field is read from that file row by row. Returns
+    the number of rows written.
+    """
+    task_directory = os.path.dirname(task.file_path)
+    journal = pd.Series(_journal_labels(task_directory), dtype=object)
+    source_rows = None
+    with open(task.file_path, newline='') as f:
+        columns = next(csv.reader(f))
+    if task.field_in_source:
+        source_rows = SourceRows(task.source_file_path,
+                                 row_offsets_path(ArtifactStore(task_directory), task.source_file_path))
+        columns = [task.field_to_label, task.label_column_name]
+    written = 0
+    try:
+        with open(output_path, 'w', newline='') as f, \
+                pd.read_csv(task.file_path, dtype=str, chunksize=chunk_rows) as reader:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+            for chunk in reader:
+                # Row ids continue from chunk to chunk
+                rows = journal.index[journal.index.isin(chunk.index)]
+                if len(rows):
+                    chunk[task.label_column_name] = chunk[task.label_column_name].astype(object)
+                    chunk.loc[rows, task.label_column_name] = journal[rows].to_numpy()
+                if source_rows is not None:
+                    if len(chunk) and chunk.index[-1] >= len(source_rows):
+                        raise ValueError(f"The task has more rows than its original file {task.source_file_path}")
+                    field = [source_rows.value(row, task.field_to_label) for row in chunk.index]
+                    chunk = pd.DataFrame({task.field_to_label: field, task.label_column_name: chunk[
+                        task.label_column_name].to_numpy()}, index=chunk.index)
+                if only_labelled:
+                    chunk = chunk[chunk[task.label_column_name].notna()]
+                chunk.to_csv(f, header=False, index=False)
+                written += len(chunk)
+    finally:
+        if source_rows is not None:
+            source_rows.close()
+    return written
+
+
+def export_joined(task, output_path, only_labelled=False, chunk_rows=100000):
+    """
+    Write every column of the original inputs of a task to output_path, with the labels of the task named after
+    their classes as a JSON list, e.g. '["fruit", "vehicle/car"]'. The inputs listed in inputs.json are streamed in
+    row id order and joined with the label column of data.csv by position, chunk by chunk, so memory use does not
+    grow with the size of the inputs. Rows skipped as duplicates when appended are skipped again, by replaying
+    the row hashes of append_rows. Returns the number of rows written.
+    """
+    task_directory = os.path.dirname(task.file_path)
+    labels = task.get_labels_list()
+    inputs = read_inputs(os.path.join(task_directory, INPUTS_FILE_NAME), task.file_path, task.label_column_name)
+    for entry in inputs:
+        # Tasks created before the inputs were listed have a single input, their original file
+        entry['path'] = entry['path'] or task.source_file_path
+        if entry['path'] is None or not os.path.exists(entry['path']):
+            raise FileNotFoundError(f"The original file {entry['path']} of the task is missing")
+
+    with open(task.file_path, newline='') as f:
+        task_columns = [column for column in next(csv.reader(f)) if column != task.label_column_name]
+    # Only appended inputs with duplicates need the hashes of every row before them
+    replay_duplicates = any(entry.get('duplicates') for entry in inputs)
+    known = np.empty(0, dtype=np.uint64)
+
+    label_column = LabelColumn(task.file_path, task.label_column_name, _journal_labels(task_directory), chunk_rows)
+    columns = [column for column in read_columns(inputs[0]['path']).columns if column != task.label_column_name]
+    # Each distinct label value is decoded once
+    names = {None: None}
+    written = 0
+    try:
+        with open(output_path, 'w', newline='') as f:
+            pd.DataFrame(columns=columns + [task.label_column_name]).to_csv(f, index=False)
+            for entry in inputs:
+                deduplicated = bool(entry.get('duplicates'))
+                for chunk in read_chunks(entry['path'], chunk_rows=chunk_rows):
+                    if replay_duplicates:
+                        hashes = row_hashes(chunk.reindex(columns=task_columns), task_columns)
+                        if deduplicated:
+                            _, first = np.unique(hashes, return_index=True)
+                            first = np.sort(first)
+                            kept = first[~np.isin(hashes[first], known)]
+                            chunk, hashes = chunk.iloc[kept], hashes[kept]
+                        known = np.union1d(known, hashes)
+                    values = label_column.take(len(chunk))
+                    for value in values:
+                        if value not in names:
+                            names[value] = json.dumps(label_names(decode_labels(value), labels))
+                    chunk = chunk.reindex(columns=columns).assign(
+                        **{task.label_column_name: [names[value] for value in values]})
+                    if only_labelled:
+                        chunk = chunk[[value is not None for value in values]]
+                    chunk.to_csv(f, header=False, index=False)
+                    written += len(chunk)
+        extra = label_column.remaining()
+    finally:
+        label_column.close()
+    if extra:
+        raise ValueError(f"The task has {extra} more rows than its original files")
+    return written
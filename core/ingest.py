@@ -0,0 +1,208 @@
+import csv
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Name of the list of the inputs of a task and of the rows each of them holds, in a task directory
+INPUTS_FILE_NAME = 'inputs.json'
+# Name of the sorted content hashes of the rows of a task, used to skip duplicates when rows are appended
+ROW_HASHES_FILE_NAME = 'row_hashes.npy'
+
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd', '.zstd': 'zstd'}
+JSON_LINES_EXTENSIONS = {'.jsonl', '.ndjson', '.json'}
+
+
+def expand_inputs(pattern):
+    """
+    Return the files matching a path or a glob pattern of shards, sorted so the rows of the task keep the same
+    order, and with it the same row ids, every time the pattern is expanded.
+    """
+    if not glob.has_magic(pattern):
+        if not os.path.exists(pattern):
+            raise FileNotFoundError(f"No such file or directory: '{pattern}'")
+        return [pattern]
+    paths = sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    if not paths:
+        raise FileNotFoundError(f"No file matches '{pattern}'")
+    return paths
+
+
+def input_format(path):
+    """
+    Return the compression ('gzip', 'bz2', 'zstd' or None) and the format ('csv' or 'jsonl') of an input file,
+    from its extensions.
+    """
+    root, extension = os.path.splitext(path.lower())
+    compression = COMPRESSION_EXTENSIONS.get(extension)
+    if compression is not None:
+        root, extension = os.path.splitext(root)
+    return compression, 'jsonl' if extension in JSON_LINES_EXTENSIONS else 'csv'
+
+
+def is_plain_csv(paths):
+    # A single uncompressed CSV file, which rows can be read from in place
+    return len(paths) == 1 and input_format(paths[0]) == (None, 'csv')
+
+
+def read_chunks(path, columns=None, chunk_rows=100000):
+    """
+    Stream an input file as DataFrames of up to chunk_rows rows, decompressing it on the fly. Values are read as
+    strings. Only the given columns are kept if given, rows of a JSON lines file missing one of them get NaN.
+    """
+    compression, file_format = input_format(path)
+    try:
+        if file_format == 'csv':
+            reader = pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_rows, compression=compression)
+        else:
+            reader = pd.read_json(path, lines=True, dtype=False, chunksize=chunk_rows, compression=compression)
+        with reader:
+            for chunk in reader:
+                if file_format == 'jsonl' and columns is not None:
+                    chunk = chunk.reindex(columns=columns)
+                yield chunk
+    except ImportError as e:
+        raise ImportError(f"Reading {path} needs an optional package: {e}") from e
+
+
+def read_columns(pattern, preview_rows=1000):
+    """
+    Return the first rows of the first input matching a pattern, enough to list the columns without reading the
+    whole input.
+    """
+    path = expand_inputs(pattern)[0]
+    for chunk in read_chunks(path, chunk_rows=preview_rows):
+        return chunk
+    return pd.DataFrame()
+
+
+def ingest(pattern, output_path, columns, label_column_name, inputs_path=None, hashes_path=None, chunk_rows=100000):
+    """
+    Stream the given columns of every input matching a pattern into a single CSV file at output_path, with an empty
+    label column, chunk by chunk so memory use does not grow with the size of the inputs. The position of a row in
+    output_path is its global row id, the inputs are read in the order of expand_inputs.
+    If inputs_path is given the inputs are listed there with the row id of their first row and their number of
+    rows, and if hashes_path is given the row hashes used by append_rows are saved there. Returns the number of
+    rows.
+    """
+    rows = 0
+    inputs = []
+    hashes = []
+    with open(output_path, 'w', newline='') as f:
+        pd.DataFrame(columns=list(columns) + [label_column_name]).to_csv(f, index=False)
+        for path in expand_inputs(pattern):
+            first_row = rows
+            for chunk in read_chunks(path, list(columns), chunk_rows):
+                chunk = chunk[list(columns)].assign(**{label_column_name: None})
+                chunk.to_csv(f, header=False, index=False)
+                rows += len(chunk)
+                if hashes_path is not None:
+                    hashes.append(row_hashes(chunk, columns))
+            inputs.append({'path': os.path.abspath(path), 'first_row': first_row, 'rows': rows - first_row})
+    if hashes_path is not None:
+        save_row_hashes(hashes_path, np.unique(np.concatenate(hashes)) if hashes else np.empty(0, dtype=np.uint64))
+    if inputs_path is not None:
+        with open(inputs_path, 'w') as f:
+            json.dump(inputs, f, indent=2)
+    return rows
+
+
+def row_hashes(df, columns):
+    """
+    Return a 64-bit hash of the content of each row of a DataFrame over the given columns, missing values hash like
+    empty strings. The hash only depends on the values, so it stays valid across sessions and library versions.
+    """
+    values = df[list(columns)].fillna('').astype(str)
+    return np.fromiter((int.from_bytes(hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=8).digest(),
+                                       'little') for row in values.itertuples(index=False, name=None)),
+                       dtype=np.uint64, count=len(values))
+
+
+def save_row_hashes(path, hashes):
+    # Written to a temporary file first, so an interrupted save leaves the previous hashes in place
+    temporary_path = f'{path}.tmp.npy'
+    np.save(temporary_path, hashes)
+    os.replace(temporary_path, path)
+
+
+def load_row_hashes(path, data_path, columns, chunk_rows=100000):
+    """
+    Load the sorted row hashes saved at path, or hash the rows of data_path, read chunk by chunk, if there are none
+    yet.
+    """
+    if os.path.exists(path):
+        return np.load(path)
+    hashes = [row_hashes(chunk, columns)
+              for chunk in pd.read_csv(data_path, usecols=list(columns), dtype=str, chunksize=chunk_rows)]
+    return np.unique(np.concatenate(hashes)) if hashes else np.empty(0, dtype=np.uint64)
+
+
+def read_inputs(inputs_path, data_path, label_column_name, chunk_rows=100000):
+    """
+    Return the inputs listed at inputs_path, or a single entry for the rows of data_path for tasks created before
+    the inputs were listed.
+    """
+    if os.path.exists(inputs_path):
+        with open(inputs_path) as f:
+            return json.load(f)
+    rows = sum(len(chunk) for chunk in pd.read_csv(data_path, usecols=[label_column_name], chunksize=chunk_rows))
+    return [{'path': None, 'first_row': 0, 'rows': rows}]
+
+
+def append_rows(pattern, data_path, label_column_name, hashes_path, inputs_path, on_chunk=None, chunk_rows=100000):
+    """
+    Append the rows of every input matching a pattern to the CSV file of a task, without rewriting it. Rows whose
+    content, over the columns of the task, is already in the task or earlier in the inputs are skipped, against the
+    row hashes saved at hashes_path, which are updated. The appended rows are unlabelled and get the next row ids,
+    the inputs are added to the list at inputs_path.
+    on_chunk, if given, is called with each DataFrame of appended rows. Returns the number of rows appended and the
+    number of duplicates skipped.
+    """
+    with open(data_path, newline='') as f:
+        header = next(csv.reader(f))
+    columns = [column for column in header if column != label_column_name]
+    if not columns:
+        # Tasks reading their field from the original file only hold their labels
+        raise ValueError(f"{data_path} only holds labels, rows cannot be appended to it")
+    known = load_row_hashes(hashes_path, data_path, columns, chunk_rows)
+    inputs = read_inputs(inputs_path, data_path, label_column_name, chunk_rows)
+    next_row = inputs[-1]['first_row'] + inputs[-1]['rows'] if inputs else 0
+    appended = 0
+    duplicates = 0
+    with open(data_path, 'rb+') as f:
+        # The file is extended in place, it has to end with a line break for the new rows to start on their own line
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    with open(data_path, 'a', newline='') as f:
+        for path in expand_inputs(pattern):
+            input_appended = 0
+            input_duplicates = 0
+            for chunk in read_chunks(path, columns, chunk_rows):
+                chunk = chunk[columns]
+                hashes = row_hashes(chunk, columns)
+                # Keep the first occurrence of each row of the chunk, then drop those already in the task
+                _, first = np.unique(hashes, return_index=True)
+                first = np.sort(first)
+                new = first[~np.isin(hashes[first], known)]
+                input_duplicates += len(chunk) - len(new)
+                chunk = chunk.iloc[new].assign(**{label_column_name: None})[header]
+                chunk.to_csv(f, header=False, index=False)
+                known = np.union1d(known, hashes[new])
+                input_appended += len(chunk)
+                if on_chunk is not None and len(chunk):
+                    on_chunk(chunk)
+            inputs.append({'path': os.path.abspath(path), 'first_row': next_row, 'rows': input_appended,
+                           'duplicates': input_duplicates})
+            next_row += input_appended
+            appended += input_appended
+            duplicates += input_duplicates
+    save_row_hashes(hashes_path, known)
+    with open(inputs_path, 'w') as f:
+        json.dump(inputs, f, indent=2)
+    return appended, duplicates
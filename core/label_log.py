@@ -0,0 +1,173 @@
+import collections
+import datetime
+import json
+import os
+import queue
+import threading
+
+class LabelOperation(collections.namedtuple('LabelOperation', ['index', 'old', 'new', 'batch'], defaults=[False])):
+    """
+    A label change, old and new are lists of class indices or None for an unlabelled row. A batch changes several
+    rows at once, e.g. a committed grid page or an auto-labelling, and is undone as a whole: index, old and new then
+    hold one entry per row.
+    """
+    __slots__ = ()
+
+    def rows(self):
+        """
+        Return the (index, old, new) of each row changed.
+        """
+        if self.batch:
+            return list(zip(self.index, self.old, self.new))
+        return [(self.index, self.old, self.new)]
+
+    @property
+    def first_index(self):
+        return self.index[0] if self.batch else self.index
+
+    def inverse(self):
+        return LabelOperation(self.index, self.new, self.old, self.batch)
+
+
+def _read_tail(file_path, max_lines, chunk_size=64 * 1024):
+    """
+    Read the last max_lines lines of a file by seeking backwards from its end, without reading the whole file.
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= max_lines:
+            read_size = min(chunk_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = [line for line in data.split(b'\n') if line.strip()]
+    return lines[-max_lines:]
+
+
+class LabelLog:
+    """
+    Append-only log of label changes used for undo and redo.
+    The most recent operations are kept in a bounded in-memory ring, every operation is also appended to a
+    JSON lines file so the history survives a crash. Undo and redo are O(1) and never touch the DataFrame.
+    With background, the file is written by a thread of its own, so recording a change never waits on the disk.
+    """
+
+    def __init__(self, file_path=None, capacity=1000, background=False):
+        self.file_path = file_path
+        self.operations = collections.deque(maxlen=capacity)
+        self.redo_stack = collections.deque(maxlen=capacity)
+        self.log_file = None
+        # Sequence number the next recorded operation will get, older operations fall out of the ring
+        self.count = 0
+
+        if file_path is not None:
+            if os.path.exists(file_path):
+                # One extra line in case the last one was only partially written
+                for line in _read_tail(file_path, capacity + 1):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A partially written last line after a crash
+                        continue
+                    self.operations.append(LabelOperation(record['index'], record['old'], record['new'],
+                                                          record.get('batch', False)))
+                self.count = len(self.operations)
+            self.log_file = open(file_path, 'a')
+        self.write_queue = None
+        if background and self.log_file is not None:
+            self.write_queue = queue.SimpleQueue()
+            self.writer = threading.Thread(target=self._write_lines, name='LabelLogWriter', daemon=True)
+            self.writer.start()
+
+    def record(self, index, old, new):
+        """
+        Record a label change made by the annotator. Recording a new change discards the redo history.
+        """
+        return self._record(LabelOperation(int(index), old, new))
+
+    def record_many(self, indices, olds, news):
+        """
+        Record the label changes of several rows as a single operation, undone and redone as a whole.
+        """
+        return self._record(LabelOperation([int(index) for index in indices], list(olds), list(news), True))
+
+    def _record(self, operation):
+        self.operations.append(operation)
+        self.count += 1
+        self.redo_stack.clear()
+        self._append(operation)
+        return operation
+
+    def undo(self):
+        """
+        Return the most recent operation to revert, or None if there is nothing to undo.
+        """
+        if not self.operations:
+            return None
+        operation = self.operations.pop()
+        self.count -= 1
+        self.redo_stack.append(operation)
+        self._append(operation.inverse())
+        return operation
+
+    def redo(self):
+        """
+        Return the most recently undone operation to apply again, or None if there is nothing to redo.
+        """
+        if not self.redo_stack:
+            return None
+        operation = self.redo_stack.pop()
+        self.operations.append(operation)
+        self.count += 1
+        self._append(operation)
+        return operation
+
+    def get(self, sequence):
+        """
+        Return the operation with the given sequence number, or None if it is no longer held in the ring.
+        """
+        position = sequence - (self.count - len(self.operations))
+        if sequence >= self.count or position < 0:
+            return None
+        return self.operations[position]
+
+    def _append(self, operation):
+        if self.log_file is None:
+            return
+        record = {'index': operation.index, 'old': operation.old, 'new': operation.new,
+                  'time': datetime.datetime.now().isoformat()}
+        if operation.batch:
+            record['batch'] = True
+        line = json.dumps(record) + '\n'
+        if self.write_queue is not None:
+            self.write_queue.put(line)
+            return
+        self.log_file.write(line)
+        self.log_file.flush()
+
+    def _write_lines(self):
+        """
+        Write the queued lines until None is queued, the lines queued while writing are written and flushed together.
+        """
+        while True:
+            lines = [self.write_queue.get()]
+            while True:
+                try:
+                    lines.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.log_file.writelines(line for line in lines if line is not None)
+            self.log_file.flush()
+            if None in lines:
+                return
+
+    def close(self):
+        if self.write_queue is not None:
+            self.write_queue.put(None)
+            self.writer.join()
+            self.write_queue = None
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
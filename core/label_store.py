@@ -0,0 +1,280 @@
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Name of the memory report of the last opening of a task, in its directory
+MEMORY_REPORT_FILE_NAME = 'memory_report.json'
+
+
+def encode_labels(classes):
+    """
+    Encode a list of class indices into the string format stored in the label column, e.g. "[0, 2]".
+    A class labelled with one of its subcategories is stored as a [class index, subcategory] pair, e.g.
+    '[0, [2, "car"]]'.
+    """
+    return json.dumps([[int(c[0]), str(c[1])] if isinstance(c, (list, tuple)) else int(c) for c in classes])
+
+
+def decode_labels(value):
+    """
+    Decode a value from the label column back into a list of class indices.
+    Returns None for rows that have not been labelled yet.
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return json.loads(value)
+
+
+def split_labels(classes):
+    """
+    Split decoded labels into the list of class indices and a dict mapping class index to subcategory.
+    """
+    indices = []
+    subcategories = {}
+    for c in classes or []:
+        if isinstance(c, (list, tuple)):
+            indices.append(int(c[0]))
+            subcategories[int(c[0])] = c[1]
+        else:
+            indices.append(int(c))
+    return indices, subcategories
+
+
+def join_labels(indices, subcategories):
+    """
+    Inverse of split_labels.
+    """
+    return [[i, subcategories[i]] if i in subcategories else i for i in indices]
+
+
+def label_names(classes, labels):
+    """
+    Return the names of decoded labels, a class labelled with a subcategory is named "class/subcategory".
+    """
+    indices, subcategories = split_labels(classes)
+    return [f"{labels[i]}/{subcategories[i]}" if i in subcategories else labels[i] for i in indices]
+
+
+def compact_columns(df, exclude=(), max_ratio=0.5):
+    """
+    Convert the string columns of df with few distinct values, like a country or a category shown as context, to
+    categoricals in place, so each distinct value is held once. Columns in exclude, like the labelled field, are
+    left as they are.
+    """
+    for column in df.columns:
+        if column in exclude or not pd.api.types.is_string_dtype(df[column]):
+            continue
+        if len(df) and df[column].nunique() / len(df) < max_ratio:
+            df[column] = df[column].astype('category')
+
+
+def memory_report(label_store):
+    """
+    Return the bytes held in memory by each column of the task, by its labels, and the estimate of the bytes the
+    labels would take as strings.
+    """
+    columns = label_store.df.memory_usage(index=False, deep=True)
+    report = {'rows': len(label_store.df),
+              'columns': {column: int(size) for column, size in columns.items()},
+              'index': int(label_store.df.index.memory_usage(deep=True)),
+              'label_dtype': np.dtype(label_store.dtype).name}
+    report.update(label_store.memory_usage())
+    report['total'] = sum(report['columns'].values()) + report['index'] + report['labels']
+    return report
+
+
+def save_memory_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def mask_dtype(class_count):
+    """
+    Return the narrowest unsigned integer type with a bit for each of class_count classes, uint64 at most.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if class_count <= np.iinfo(dtype).bits:
+            return dtype
+    return np.uint64
+
+
+class LabelStore:
+    """
+    Holds the labels of a task in memory and keeps track of the rows changed since the last save.
+    Each row's label is a bitmask of its classes, in the narrowest unsigned integer type with a bit per class, with
+    a flag telling unlabelled rows apart. Labels a bitmask does not represent exactly (classes with a subcategory,
+    beyond the width of the mask or not in ascending order) are kept decoded in a dict by row position. The label
+    column is taken out of the DataFrame and its "[0, 2]" strings are only built again by snapshot, for saving.
+    """
+
+    def __init__(self, df, label_column_name, class_count=64):
+        self.df = df
+        self.label_column_name = label_column_name
+        self.dtype = mask_dtype(class_count)
+        self.bits = np.iinfo(self.dtype).bits
+        self.masks = np.zeros(len(df), dtype=self.dtype)
+        self.labelled = np.zeros(len(df), dtype=bool)
+        self.extra = {}
+
+        # Where the label column goes back when saving, at the end for a task without one yet
+        self.label_position = len(df.columns)
+        if label_column_name in df.columns:
+            self.label_position = df.columns.get_loc(label_column_name)
+            # Each distinct label is decoded once
+            codes, values = pd.factorize(df[label_column_name].to_numpy(dtype=object))
+            decoded = [decode_labels(value) for value in values]
+            unique_masks = np.array([self._mask(classes) or 0 for classes in decoded] or [0], dtype=self.dtype)
+            exact = np.array([self._mask(classes) is not None for classes in decoded] or [True])
+            self.labelled = codes >= 0
+            self.masks[self.labelled] = unique_masks[codes[self.labelled]]
+            for position in np.flatnonzero(self.labelled & ~exact[np.maximum(codes, 0)]):
+                self.extra[int(position)] = decoded[codes[position]]
+            df.drop(columns=[label_column_name], inplace=True)
+
+        # Index labels of the rows changed since the last save
+        self.dirty = set()
+
+    def _mask(self, classes):
+        """
+        Return the bitmask of a list of class indices, or None if it does not represent them exactly.
+        """
+        mask = 0
+        previous = -1
+        for c in classes:
+            if isinstance(c, (list, tuple)) or not previous < c < self.bits:
+                return None
+            mask |= 1 << int(c)
+            previous = c
+        return mask
+
+    def _classes(self, mask):
+        mask = int(mask)
+        return [i for i in range(self.bits) if mask >> i & 1]
+
+    def _store(self, position, classes):
+        if classes is None:
+            self.labelled[position] = False
+            self.masks[position] = 0
+            self.extra.pop(position, None)
+            return
+        self.labelled[position] = True
+        mask = self._mask(classes)
+        if mask is None:
+            self.masks[position] = 0
+            # Decoded from its encoding, so pairs are lists as when read from data.csv
+            self.extra[position] = decode_labels(encode_labels(classes))
+        else:
+            self.masks[position] = mask
+            self.extra.pop(position, None)
+
+    def get(self, index):
+        """
+        Return the class indices stored for the row with the given index label, or None if it is unlabelled.
+        """
+        position = self.df.index.get_loc(index)
+        if not self.labelled[position]:
+            return None
+        if position in self.extra:
+            return decode_labels(encode_labels(self.extra[position]))
+        return self._classes(self.masks[position])
+
+    def set(self, index, classes):
+        """
+        Store the class indices for a single row, None marks the row as unlabelled again.
+        """
+        self._store(self.df.index.get_loc(index), classes)
+        self.dirty.add(index)
+
+    def set_many(self, indices, classes_list):
+        """
+        Store the class indices for many rows.
+        """
+        indices = list(indices)
+        if not indices:
+            return
+        for position, classes in zip(self.df.index.get_indexer(indices), classes_list):
+            self._store(int(position), classes)
+        self.dirty.update(indices)
+
+    def unlabelled_positions(self):
+        """
+        Return the integer positions of all rows without a label, in file order.
+        """
+        return np.flatnonzero(~self.labelled)
+
+    def unlabelled(self, positions):
+        """
+        Return whether each of the rows at the given integer positions is unlabelled.
+        """
+        return ~self.labelled[positions]
+
+    def labelled_count(self):
+        return int(self.labelled.sum())
+
+    def take_dirty_labels(self):
+        """
+        Return a dict mapping the index of each dirty row to its raw label value (None when unlabelled),
+        and reset the dirty set.
+        """
+        return {index: self.raw_value(index) for index in self.take_dirty()}
+
+    def raw_value(self, index):
+        classes = self.get(index)
+        return None if classes is None else encode_labels(classes)
+
+    def apply_labels(self, labels):
+        """
+        Apply raw label values, e.g. replayed from a journal, without marking the rows dirty.
+        """
+        if not labels:
+            return
+        for position, value in zip(self.df.index.get_indexer(list(labels.keys())), labels.values()):
+            self._store(int(position), decode_labels(value))
+
+    def label_column(self):
+        """
+        Return the label column in the format written to data.csv, an object array with None for unlabelled rows.
+        Each distinct bitmask is encoded once.
+        """
+        column = np.full(len(self.masks), None, dtype=object)
+        rows = np.flatnonzero(self.labelled)
+        masks, inverse = np.unique(self.masks[rows], return_inverse=True)
+        encoded = np.empty(len(masks), dtype=object)
+        encoded[:] = [encode_labels(self._classes(mask)) for mask in masks]
+        column[rows] = encoded[inverse]
+        for position, classes in self.extra.items():
+            column[position] = encode_labels(classes)
+        return column
+
+    def snapshot(self):
+        """
+        Return a frame for saving that shares the immutable columns and holds the encoded label column, so it can
+        be written from another thread while labelling continues.
+        """
+        snapshot = self.df.copy(deep=False)
+        snapshot.insert(min(self.label_position, len(snapshot.columns)), self.label_column_name,
+                        self.label_column())
+        return snapshot
+
+    def take_dirty(self):
+        """
+        Return the set of dirty index labels and reset it.
+        """
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def memory_usage(self):
+        """
+        Return the bytes held by the labels, and an estimate of the bytes the same labels take as a column of
+        strings.
+        """
+        labels = self.masks.nbytes + self.labelled.nbytes + sum(sys.getsizeof(classes) for classes in
+                                                                self.extra.values())
+        rows = np.flatnonzero(self.labelled)
+        masks, counts = np.unique(self.masks[rows], return_counts=True)
+        as_strings = len(self.masks) * 8 + sum(
+            int(count) * sys.getsizeof(encode_labels(self._classes(mask))) for mask, count in zip(masks, counts))
+        as_strings += sum(sys.getsizeof(encode_labels(classes)) for classes in self.extra.values())
+        return {'labels': int(labels), 'labels_as_strings': int(as_strings)}
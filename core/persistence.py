@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+
+
+def fsync_directory(directory):
+    """
+    Flush a directory entry to disk so a rename inside it survives a crash. Not supported on Windows.
+    """
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_csv(df, file_path):
+    """
+    Write a DataFrame to CSV through a temporary file in the same directory, fsync it and rename it over the
+    target, so a crash mid-write leaves either the old or the new file but never a truncated one.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    fsync_directory(directory)
+
+
+class LabelJournal:
+    """
+    Append-only journal of label values, one JSON line per flush holding the [index, value] pairs of the rows
+    changed since the previous flush. Each flush is fsynced, so it is a cheap durable save proportional to the
+    number of changed rows. Replaying the journal over data.csv gives the latest labels.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        # Number of row records in the journal, used to decide when to compact it into data.csv
+        self.entries = 0
+
+    def append(self, labels):
+        """
+        Append a dict mapping row index to its label value and flush it to disk.
+        """
+        if not labels:
+            return
+        record = json.dumps([[int(index), value] for index, value in labels.items()])
+        with open(self.file_path, 'a') as f:
+            f.write(record + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries += len(labels)
+
+    def replay(self):
+        """
+        Return a dict mapping row index to the latest label value recorded in the journal.
+        """
+        labels = {}
+        self.entries = 0
+        if not os.path.exists(self.file_path):
+            return labels
+        with open(self.file_path) as f:
+            for line in f:
+                try:
+                    pairs = json.loads(line)
+                except ValueError:
+                    # A partially written last line after a crash
+                    continue
+                for index, value in pairs:
+                    labels[index] = value
+                self.entries += len(pairs)
+        return labels
+
+    def read_range(self, start=0, end=None):
+        """
+        Return a dict mapping row index to the latest label value recorded between the byte offsets start and end (the
+        end of the journal by default), and the offset after the last complete line read. A line still being written
+        is left for the next read.
+        """
+        labels = {}
+        if not os.path.exists(self.file_path):
+            return labels, 0
+        with open(self.file_path, 'rb') as f:
+            f.seek(start)
+            data = f.read() if end is None else f.read(max(end - start, 0))
+        complete = data.rfind(b'\n') + 1
+        for line in data[:complete].splitlines():
+            try:
+                pairs = json.loads(line)
+            except ValueError:
+                continue
+            for index, value in pairs:
+                labels[index] = value
+        return labels, start + complete
+
+    def truncate(self):
+        """
+        Empty the journal once its contents have been written into data.csv.
+        """
+        with open(self.file_path, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries = 0
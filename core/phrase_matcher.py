@@ -0,0 +1,119 @@
+import collections
+import re
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# An exact occurrence of a synonym in a text, start and end are character offsets into the text
+PhraseMatch = collections.namedtuple('PhraseMatch', ['start', 'end', 'class_name', 'subcategory', 'phrase'])
+
+
+def tokenize(text):
+    """
+    Split a text into lowercase word tokens. Returns the tokens and their (start, end) character offsets.
+    """
+    tokens = []
+    spans = []
+    for match in TOKEN_PATTERN.finditer(str(text)):
+        tokens.append(match.group().lower())
+        spans.append(match.span())
+    return tokens, spans
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over the word tokens of every synonym in synonyms.json.
+    find returns every exact occurrence of a synonym in a single scan of the text, matching whole words only and
+    ignoring case and punctuation, so 'Car' matches 'car.' but not 'cart'.
+    """
+
+    def __init__(self, class_synonyms):
+        # goto[state] maps a token to the next state, state 0 is the root
+        self.goto = [{}]
+        self.fail = [0]
+        # outputs[state] lists the patterns ending at state, including those of its fail states
+        self.outputs = [[]]
+        # Each pattern is (class name, subcategory, phrase, number of tokens)
+        self.patterns = []
+
+        for class_name, synonyms in class_synonyms.items():
+            if not isinstance(synonyms, dict):
+                synonyms = {None: synonyms}
+            for subcategory, phrases in synonyms.items():
+                for phrase in phrases:
+                    self._add_pattern(class_name, subcategory, str(phrase))
+        self._build_fail_links()
+
+    def _add_pattern(self, class_name, subcategory, phrase):
+        tokens, _ = tokenize(phrase)
+        if not tokens:
+            return
+        state = 0
+        for token in tokens:
+            next_state = self.goto[state].get(token)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][token] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append(len(self.patterns))
+        self.patterns.append((class_name, subcategory, phrase, len(tokens)))
+
+    def _build_fail_links(self):
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and token not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(token, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def find(self, text):
+        """
+        Return the PhraseMatch of every synonym occurring in the text, ordered by end position.
+        """
+        tokens, spans = tokenize(text)
+        matches = []
+        state = 0
+        for position, token in enumerate(tokens):
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+            for pattern_id in self.outputs[state]:
+                class_name, subcategory, phrase, length = self.patterns[pattern_id]
+                start = spans[position - length + 1][0]
+                matches.append(PhraseMatch(start, spans[position][1], class_name, subcategory, phrase))
+        return matches
+
+    @staticmethod
+    def class_scores(matches, text):
+        """
+        Score the classes with an exact match by the share of the text's characters their matches cover.
+        Returns a dict mapping class name to a score in (0, 1].
+        """
+        return _coverage(matches, text, lambda match: match.class_name)
+
+    @staticmethod
+    def subcategory_scores(matches, text):
+        """
+        Score the named subcategories with an exact match like class_scores.
+        Returns a dict mapping class name to a dict of subcategory scores.
+        """
+        scores = collections.defaultdict(dict)
+        named = [match for match in matches if match.subcategory is not None]
+        for (class_name, subcategory), score in _coverage(
+                named, text, lambda match: (match.class_name, match.subcategory)).items():
+            scores[class_name][subcategory] = score
+        return dict(scores)
+
+
+def _coverage(matches, text, key):
+    covered = collections.defaultdict(set)
+    for match in matches:
+        covered[key(match)].update(range(match.start, match.end))
+    length = max(len(str(text).strip()), 1)
+    return {name: min(len(characters) / length, 1.0) for name, characters in covered.items()}
@@ -0,0 +1,178 @@
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import sys
+import threading
+
+# Name of the folder holding the profiles recorded with --profile, in a task directory
+PROFILES_DIRECTORY_NAME = 'profiles'
+
+
+def _function_name(code):
+    # Qualified names of code objects are only available from Python 3.11
+    return getattr(code, 'co_qualname', code.co_name)
+
+
+def _function_key(code):
+    return code.co_filename, code.co_firstlineno, _function_name(code)
+
+
+def _format_function(key):
+    filename, line, name = key
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+class ThreadSampler:
+    """
+    Samples the stacks of the worker threads every interval seconds, counting for each function the samples it was
+    on the stack in (its cumulative time) and at the top of the stack in (its own time). cProfile only sees the thread
+    it was enabled in and QThreads are not started by the threading module, so the workers are sampled instead. The
+    threads are named after the class whose run method is at the bottom of their stack, e.g. SaveTaskThread.run.
+    """
+
+    def __init__(self, interval=0.005, ignore=()):
+        self.interval = interval
+        self.ignore = set(ignore)
+        self.cumulative = {}
+        self.own = {}
+        self.threads = {}
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='ThreadSampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _run(self):
+        ignore = self.ignore | {threading.get_ident()}
+        while not self.stopped.wait(self.interval):
+            self.sample(ignore)
+
+    def sample(self, ignore=()):
+        frames = sys._current_frames()
+        with self.lock:
+            self.samples += 1
+            for thread_id, frame in frames.items():
+                if thread_id in ignore:
+                    continue
+                own = _function_key(frame.f_code)
+                self.own[own] = self.own.get(own, 0) + 1
+                seen = set()
+                while frame is not None:
+                    key = _function_key(frame.f_code)
+                    bottom = _function_name(frame.f_code)
+                    # A recursive function is counted once per sample
+                    if key not in seen:
+                        seen.add(key)
+                        self.cumulative[key] = self.cumulative.get(key, 0) + 1
+                    frame = frame.f_back
+                self.threads[bottom] = self.threads.get(bottom, 0) + 1
+
+    def summary(self, limit=30):
+        with self.lock:
+            threads = sorted(self.threads.items(), key=lambda item: item[1], reverse=True)
+            functions = sorted(self.cumulative.items(), key=lambda item: item[1], reverse=True)[:limit]
+            own = dict(self.own)
+        lines = [f"Worker threads, sampled every {self.interval * 1000:g} ms",
+                 f"{'seconds':>10}  thread"]
+        lines += [f"{count * self.interval:10.3f}  {name}" for name, count in threads]
+        lines += ['', f"Top {limit} functions by cumulative time",
+                  f"{'cumtime':>10}{'tottime':>10}  function"]
+        lines += [f"{count * self.interval:10.3f}{own.get(key, 0) * self.interval:10.3f}  {_format_function(key)}"
+                  for key, count in functions]
+        return '\n'.join(lines) + '\n'
+
+
+class SessionProfiler:
+    """
+    Records a profile of a session of the application, started with the --profile flag: cProfile on the GUI thread,
+    where every key press and redraw runs, and a ThreadSampler on the worker threads. save writes what was recorded
+    so far to the profiles folder of a task directory, the GUI thread's profile as a .prof file for pstats or
+    snakeviz, and a summary of the top functions by cumulative time of both.
+    Has to be started, saved and stopped from the GUI thread.
+    """
+
+    def __init__(self, sample_interval=0.005, limit=30):
+        self.profile = cProfile.Profile()
+        self.sampler = ThreadSampler(sample_interval, ignore=[threading.get_ident()])
+        self.limit = limit
+        self.started_at = None
+        self.running = False
+
+    def start(self):
+        self.started_at = datetime.datetime.now()
+        self.sampler.start()
+        self.profile.enable()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.profile.disable()
+            self.sampler.stop()
+            self.running = False
+
+    def save(self, task_directory):
+        """
+        Write the profile recorded since the start of the session to the profiles folder of task_directory. Returns
+        the paths of the .prof file and of the summary.
+        """
+        directory = os.path.join(task_directory, PROFILES_DIRECTORY_NAME)
+        os.makedirs(directory, exist_ok=True)
+        name = datetime.datetime.now().strftime('profile-%Y%m%d-%H%M%S')
+        profile_path = os.path.join(directory, f'{name}.prof')
+        summary_path = os.path.join(directory, f'{name}.txt')
+        # Collecting the stats disables the profile
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(profile_path)
+            stream = io.StringIO()
+            pstats.Stats(profile_path, stream=stream).sort_stats('cumulative').print_stats(self.limit)
+        finally:
+            if self.running:
+                self.profile.enable()
+        with open(summary_path, 'w') as f:
+            f.write(f"Session started at {self.started_at.isoformat(timespec='seconds')}, "
+                    f"saved after {(datetime.datetime.now() - self.started_at).total_seconds():.1f} s\n\n")
+            f.write(f"GUI thread, top {self.limit} functions by cumulative time\n")
+            f.write(stream.getvalue())
+            f.write('\n')
+            f.write(self.sampler.summary(self.limit))
+        return profile_path, summary_path
+
+
+# The profiler of the session, set when the application is started with --profile
+session_profiler = None
+
+
+def start_session_profiler(sample_interval=0.005):
+    global session_profiler
+    session_profiler = SessionProfiler(sample_interval)
+    session_profiler.start()
+    return session_profiler
+
+
+def save_session_profile(task_directory):
+    """
+    Save the profile of the session to a task directory when a task is closed, if the application was started with
+    --profile.
+    """
+    if session_profiler is None:
+        return None
+    paths = session_profiler.save(task_directory)
+    print(f"Profile saved to {paths[1]}")
+    return paths
+
+
+def stop_session_profiler():
+    global session_profiler
+    if session_profiler is not None:
+        session_profiler.stop()
+        session_profiler = None
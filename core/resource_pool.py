@@ -0,0 +1,49 @@
+import threading
+
+
+class ResourcePool:
+    """
+    Read-only resources shared between the open windows, like the SynonymIndex of a taxonomy, keyed by a hash of
+    their content. A resource is loaded by the first window acquiring its key, later windows get the same object,
+    and it is dropped, closed if it has a close method, when the last window holding it releases it.
+    Shared resources must not be changed in place, a window with changed content acquires it under its new key.
+    """
+
+    def __init__(self):
+        # Acquired from the GUI thread and from loading threads
+        self.lock = threading.Lock()
+        self.resources = {}
+        self.counts = {}
+
+    def acquire(self, key, load):
+        """
+        Return the resource with the given key, calling load() to create it if no window holds it yet.
+        """
+        with self.lock:
+            if key not in self.resources:
+                self.resources[key] = load()
+                self.counts[key] = 0
+            self.counts[key] += 1
+            return self.resources[key]
+
+    def release(self, key):
+        with self.lock:
+            if key not in self.counts:
+                return
+            self.counts[key] -= 1
+            if self.counts[key] > 0:
+                return
+            del self.counts[key]
+            resource = self.resources.pop(key)
+        if hasattr(resource, 'close'):
+            resource.close()
+
+    def __contains__(self, key):
+        return key in self.resources
+
+    def __len__(self):
+        return len(self.resources)
+
+
+# Resources shared by every window of the application
+shared_resources = ResourcePool()
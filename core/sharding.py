@@ -0,0 +1,255 @@
+import collections
+import json
+import os
+import random
+import re
+import time
+
+from .persistence import LabelJournal, atomic_write_csv
+
+# A claim on a shard by an annotator, valid until expires_at (seconds since the epoch)
+ShardLease = collections.namedtuple('ShardLease', ['shard_id', 'annotator', 'expires_at'])
+
+# Result of merging the annotator journals into the canonical labels
+# Result of merging the annotator journals into the canonical labels, journal_offsets maps each annotator to the end of
+# the part of their journal that was read
+MergeReport = collections.namedtuple('MergeReport', ['merged', 'double_labelled', 'agreements', 'conflicts',
+                                                     'journal_offsets'])
+
+ANNOTATOR_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def _write_json_atomically(data, file_path):
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+class ShardManager:
+    """
+    Splits the unlabelled rows of a task into disjoint shards that several annotators can label at the same time.
+    Everything lives in the task directory on a shared filesystem, no server is needed:
+        - shards/manifest.json lists the shards and the audit rows,
+        - shards/<id>.lease is created exclusively by the annotator holding a shard and expires after lease_seconds,
+        - shards/<id>.done marks a completed shard,
+        - journals/<annotator>.journal is the label journal of each annotator,
+        - shards/merged.json holds the byte offset up to which each journal has been merged.
+    Audit rows are placed in two shards so that they get labelled twice, merge reports whether the labels agree.
+    """
+
+    def __init__(self, task_directory, lease_seconds=3600):
+        self.task_directory = task_directory
+        self.shards_directory = os.path.join(task_directory, 'shards')
+        self.journals_directory = os.path.join(task_directory, 'journals')
+        self.manifest_path = os.path.join(self.shards_directory, 'manifest.json')
+        self.merged_path = os.path.join(self.shards_directory, 'merged.json')
+        self.lease_seconds = lease_seconds
+
+    def has_shards(self):
+        return os.path.exists(self.manifest_path)
+
+    def create_shards(self, indices, shard_size, audit_fraction=0.0, seed=0):
+        """
+        Split the given row indices into shards of shard_size rows, and add audit_fraction of the rows to a second
+        shard. Returns the number of shards.
+        """
+        if self.has_shards():
+            raise ValueError("This task has already been split into shards.")
+        if shard_size < 1:
+            raise ValueError("The shard size must be at least 1.")
+        indices = [int(index) for index in indices]
+        shards = [indices[start:start + shard_size] for start in range(0, len(indices), shard_size)]
+
+        audit_rows = []
+        if len(shards) > 1 and audit_fraction > 0:
+            rng = random.Random(seed)
+            audit_positions = sorted(rng.sample(range(len(indices)), int(round(len(indices) * audit_fraction))))
+            for position in audit_positions:
+                primary = position // shard_size
+                second = (primary + rng.randrange(1, len(shards))) % len(shards)
+                shards[second].append(indices[position])
+                audit_rows.append(indices[position])
+
+        os.makedirs(self.shards_directory, exist_ok=True)
+        os.makedirs(self.journals_directory, exist_ok=True)
+        manifest = {'shards': [{'id': shard_id, 'rows': rows} for shard_id, rows in enumerate(shards)],
+                    'audit_rows': audit_rows}
+        _write_json_atomically(manifest, self.manifest_path)
+        return len(shards)
+
+    def load_manifest(self):
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def shard_rows(self, shard_id):
+        return self.load_manifest()['shards'][shard_id]['rows']
+
+    def journal_path(self, annotator):
+        self.validate_annotator(annotator)
+        return os.path.join(self.journals_directory, f'{annotator}.journal')
+
+    def lease(self, annotator):
+        """
+        Claim a shard for the annotator. A shard the annotator already holds is returned first, then a shard
+        nobody holds, then a shard whose lease has expired. Returns None when every shard is done or taken.
+        """
+        self.validate_annotator(annotator)
+        shards = self.load_manifest()['shards']
+        open_shards = [shard['id'] for shard in shards if not os.path.exists(self._done_path(shard['id']))]
+
+        for shard_id in open_shards:
+            lease = self._read_lease(shard_id)
+            if lease is not None and lease.annotator == annotator:
+                return self.renew(lease)
+        for shard_id in open_shards:
+            lease = self._claim(shard_id, annotator)
+            if lease is not None:
+                return lease
+        for shard_id in open_shards:
+            lease = self._read_lease(shard_id)
+            if lease is not None and lease.expires_at < time.time():
+                lease = self._take_over(shard_id, annotator)
+                if lease is not None:
+                    return lease
+        return None
+
+    def renew(self, lease):
+        """
+        Extend a lease held by the annotator. Returns None if the shard was taken over in the meantime.
+        """
+        current = self._read_lease(lease.shard_id)
+        if current is None or current.annotator != lease.annotator:
+            return None
+        renewed = ShardLease(lease.shard_id, lease.annotator, time.time() + self.lease_seconds)
+        _write_json_atomically(renewed._asdict(), self._lease_path(lease.shard_id))
+        return renewed
+
+    def complete(self, lease):
+        """
+        Mark the leased shard as done and release the lease.
+        """
+        with open(self._done_path(lease.shard_id), 'w') as f:
+            f.write(lease.annotator)
+        self.release(lease)
+
+    def release(self, lease):
+        current = self._read_lease(lease.shard_id)
+        if current is not None and current.annotator == lease.annotator:
+            os.remove(self._lease_path(lease.shard_id))
+
+    def merge(self, label_store):
+        """
+        Combine the annotator journals into the label store. Only rows labelled since the journals were last merged
+        are merged, so corrections made to the canonical labels since are kept. Rows labelled identically by several
+        annotators count as agreements, rows with different labels are conflicts and are left unchanged for review.
+        The report is also written to shards/merge_report.json, record_merged marks the journals as merged up to its
+        offsets once the labels are saved.
+        """
+        merged_offsets = self.load_merged_offsets()
+        labels_by_row = collections.defaultdict(dict)
+        changed = set()
+        journal_offsets = {}
+        if os.path.isdir(self.journals_directory):
+            for file_name in sorted(os.listdir(self.journals_directory)):
+                if not file_name.endswith('.journal'):
+                    continue
+                annotator = file_name[:-len('.journal')]
+                journal = LabelJournal(os.path.join(self.journals_directory, file_name))
+                # Read up to a fixed offset, an annotator may still be labelling
+                labels, end = journal.read_range()
+                start = merged_offsets.get(annotator, 0)
+                # A journal shorter than its merged offset was replaced, it is merged from its start
+                recent, _ = journal.read_range(start if start <= end else 0, end)
+                changed.update(recent)
+                journal_offsets[annotator] = end
+                for index, value in labels.items():
+                    if value is not None:
+                        labels_by_row[index][annotator] = value
+
+        merged = {}
+        double_labelled = agreements = 0
+        conflicts = []
+        for index, values in labels_by_row.items():
+            if index not in changed:
+                continue
+            distinct = set(values.values())
+            if len(values) > 1:
+                double_labelled += 1
+            if len(distinct) > 1:
+                conflicts.append({'index': index, 'labels': values})
+                continue
+            if len(values) > 1:
+                agreements += 1
+            merged[index] = distinct.pop()
+
+        label_store.set_many(merged.keys(), [json.loads(value) for value in merged.values()])
+        report = MergeReport(len(merged), double_labelled, agreements, conflicts, journal_offsets)
+        _write_json_atomically(report._asdict(), os.path.join(self.shards_directory, 'merge_report.json'))
+        return report
+
+    def merge_into_file(self, label_store, file_path, journal):
+        """
+        Merge the annotator journals over the canonical labels and the task's own label journal, then atomically
+        rewrite the canonical data file, empty that journal and record the annotator journals as merged.
+        """
+        label_store.apply_labels(journal.replay())
+        report = self.merge(label_store)
+        atomic_write_csv(label_store.snapshot(), file_path)
+        journal.truncate()
+        label_store.take_dirty()
+        self.record_merged(report)
+        return report
+
+    def load_merged_offsets(self):
+        try:
+            with open(self.merged_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def record_merged(self, report):
+        """
+        Record the annotator journals as merged up to the offsets read by the merge of report.
+        """
+        offsets = self.load_merged_offsets()
+        offsets.update(report.journal_offsets)
+        _write_json_atomically(offsets, self.merged_path)
+
+    def _claim(self, shard_id, annotator):
+        lease = ShardLease(shard_id, annotator, time.time() + self.lease_seconds)
+        try:
+            # O_EXCL makes the claim atomic, only one annotator can create the lease file
+            fd = os.open(self._lease_path(shard_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w') as f:
+            json.dump(lease._asdict(), f)
+        return lease
+
+    def _take_over(self, shard_id, annotator):
+        lease = ShardLease(shard_id, annotator, time.time() + self.lease_seconds)
+        _write_json_atomically(lease._asdict(), self._lease_path(shard_id))
+        # Another annotator may have taken it over at the same time, the last rename wins
+        current = self._read_lease(shard_id)
+        return lease if current is not None and current.annotator == annotator else None
+
+    def _read_lease(self, shard_id):
+        try:
+            with open(self._lease_path(shard_id)) as f:
+                return ShardLease(**json.load(f))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _lease_path(self, shard_id):
+        return os.path.join(self.shards_directory, f'{shard_id}.lease')
+
+    def _done_path(self, shard_id):
+        return os.path.join(self.shards_directory, f'{shard_id}.done')
+
+    @staticmethod
+    def validate_annotator(annotator):
+        if not annotator or not ANNOTATOR_PATTERN.match(annotator):
+            raise ValueError("Annotator names may only contain letters, digits, '_' and '-'.")
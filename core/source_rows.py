@@ -0,0 +1,169 @@
+import codecs
+import csv
+import io
+import mmap
+import os
+
+import numpy as np
+
+from .artifacts import file_identity
+from .ingest import input_format
+
+# Bumped when indexes built by older code must not be reused
+ROW_OFFSETS_VERSION = 1
+
+
+def build_row_offsets(file_path):
+    """
+    Find the byte offset where each data row of a CSV file starts, skipping the header and blank lines like
+    pandas.read_csv does. A line break inside a quoted field does not end a row: a row ends at the first line
+    break after an even number of quote characters. Returns a uint64 array with one offset per row followed by the
+    offset of the end of the last row.
+    """
+    offsets = []
+    position = 0
+    row_start = 0
+    quotes = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            quotes += line.count(b'"')
+            position += len(line)
+            if quotes % 2:
+                continue
+            if line.strip(b'\r\n') or position - row_start > len(line):
+                offsets.append(row_start)
+            row_start = position
+            quotes = 0
+    if row_start < position:
+        offsets.append(row_start)
+    # The first row is the header
+    offsets = offsets[1:]
+    offsets.append(position)
+    return np.asarray(offsets, dtype=np.uint64)
+
+
+def load_row_offsets(file_path, index_path):
+    """
+    Load the row offsets of a CSV file saved at index_path, memory-mapped, or build and save them if there is no
+    index yet or it is out of date. An index is out of date if it is older than the file or does not end at the
+    file's size.
+    """
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(file_path):
+        offsets = np.load(index_path, mmap_mode='r')
+        if len(offsets) and int(offsets[-1]) == os.path.getsize(file_path):
+            return offsets
+    offsets = build_row_offsets(file_path)
+    # Written to a temporary file first, a reader never maps a partly written index
+    temporary_path = f'{index_path}.tmp.npy'
+    np.save(temporary_path, offsets)
+    os.replace(temporary_path, index_path)
+    return offsets
+
+
+def row_offsets_path(store, file_path):
+    """
+    Return the path of the row offsets index of a CSV file in a task's ArtifactStore, building it unless the index
+    of the same file is there already.
+    """
+    return store.build('row_offsets', {'file': file_identity(file_path), 'version': ROW_OFFSETS_VERSION},
+                       lambda path: np.save(path, build_row_offsets(file_path)), '.npy')
+
+
+class SourceRows:
+    """
+    Random access to the rows of the original CSV file of a task, so columns that are shown but not labelled do not
+    have to be copied into the task. The file is memory-mapped and only the offsets of the rows are kept, a row is
+    sliced out of the map and parsed when it is asked for.
+    With an index_path the offsets are saved there as a uint64 .npy array and memory-mapped on the next opening,
+    see load_row_offsets. Tasks keep it in their ArtifactStore, see row_offsets_path.
+    """
+
+    def __init__(self, file_path, index_path=None, encoding='utf-8'):
+        self.file_path = file_path
+        self.encoding = encoding
+        # A byte order mark before the header is not part of the first column's name. The offsets still count it,
+        # they are positions in the file's bytes.
+        header_encoding = 'utf-8-sig' if codecs.lookup(encoding).name == 'utf-8' else encoding
+        with open(file_path, newline='', encoding=header_encoding) as f:
+            self.columns = next(csv.reader(f), [])
+        if index_path is None:
+            self.offsets = build_row_offsets(file_path)
+        else:
+            self.offsets = load_row_offsets(file_path, index_path)
+        with open(file_path, 'rb') as f:
+            # An empty file cannot be mapped, it has no rows to read anyway
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(file_path) else b''
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def row(self, position, columns=None):
+        """
+        Read the row at position (0 for the first row after the header). Returns a dict mapping each of the given
+        columns (all of them by default) to its value, as a string.
+        """
+        if not 0 <= position < len(self):
+            raise IndexError(f"Row {position} is out of range, the file has {len(self)} rows")
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        data = self.buffer[start:end]
+        values = next(csv.reader(io.StringIO(data.decode(self.encoding), newline='')), [])
+        row = dict(zip(self.columns, values))
+        if columns is None:
+            return row
+        return {column: row.get(column, '') for column in columns}
+
+    def value(self, position, column):
+        return self.row(position, [column])[column]
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+
+class InputRows:
+    """
+    Random access to the rows of a task by position across its inputs, its original file and the files appended to
+    it, listed in inputs.json with the row id of their first row. sources holds the SourceRows of each input, or None
+    for an input whose rows cannot be read by position: a compressed or JSON lines file, or a file appended with
+    duplicates skipped, whose rows no longer line up with the task's. Rows of those inputs are None.
+    """
+
+    def __init__(self, inputs, sources):
+        self.first_rows = np.array([entry['first_row'] for entry in inputs], dtype=np.int64)
+        self.row_counts = [entry['rows'] for entry in inputs]
+        self.sources = sources
+
+    def __len__(self):
+        return int(self.first_rows[-1]) + self.row_counts[-1] if len(self.first_rows) else 0
+
+    def row(self, position, columns=None):
+        i = int(np.searchsorted(self.first_rows, position, side='right')) - 1
+        if i < 0 or position >= len(self) or self.sources[i] is None:
+            return None
+        return self.sources[i].row(position - int(self.first_rows[i]), columns)
+
+    def close(self):
+        for source in self.sources:
+            if source is not None:
+                source.close()
+
+
+def open_input_rows(inputs, source_file_path, store=None):
+    """
+    Index the inputs of a task that can be read by position, see InputRows. Tasks created before the inputs were
+    listed have a single input without a path, their original file.
+    """
+    sources = []
+    for entry in inputs:
+        path = entry['path'] or source_file_path
+        source = None
+        if path is not None and os.path.exists(path) and input_format(path) == (None, 'csv') \
+                and not entry.get('duplicates'):
+            index_path = row_offsets_path(store, path) if store is not None else None
+            source = SourceRows(path, index_path)
+            if len(source) != entry['rows']:
+                print(f"{path} has {len(source)} rows, {entry['rows']} were read from it")
+                source.close()
+                source = None
+        sources.append(source)
+    return InputRows(inputs, sources)
@@ -0,0 +1,127 @@
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+
+from .phrase_matcher import PhraseMatch
+
+# Name of the suggestion cache in a task directory
+SUGGESTION_CACHE_FILE_NAME = 'suggestion_cache.sqlite'
+
+
+def normalize_text(text):
+    """
+    Normalize a description for the cache key. Suggestions ignore case and the whitespace around a description, so
+    descriptions differing only in those share their suggestion.
+    """
+    return str(text).strip().lower()
+
+
+class SuggestionCache:
+    """
+    Cache of the suggestions of SynonymIndex.suggest, keyed by a hash of the normalized description, the fingerprint
+    of the synonym index and the subcategory threshold. Recent suggestions are kept in a bounded LRU in memory,
+    and every suggestion is also stored in an SQLite file at path if given, so later sessions of the task start warm.
+    Keys include the index fingerprint, so suggestions computed with other synonyms are never returned, and prune
+    drops them from the file.
+    """
+
+    def __init__(self, path=None, capacity=10000):
+        self.capacity = capacity
+        self.memory = collections.OrderedDict()
+        # Suggestions are looked up and stored from the scoring threads
+        self.lock = threading.Lock()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS suggestions '
+                                    '(key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT)')
+            self.connection.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(description, fingerprint, threshold):
+        data = json.dumps([fingerprint, float(threshold), normalize_text(description)])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def suggest(self, synonym_index, description, threshold=0.0):
+        """
+        Return the suggestion of synonym_index for the description, like SynonymIndex.suggest, from the cache if
+        it was computed before.
+        """
+        description = str(description)
+        fingerprint = synonym_index.fingerprint
+        key = self.key(description, fingerprint, threshold)
+        # Matches are cached relative to the stripped description
+        offset = len(description) - len(description.lstrip())
+        cached = self.get(key)
+        if cached is not None:
+            scores, subcategory_scores, matches = cached
+            matches = [match._replace(start=match.start + offset, end=match.end + offset) for match in matches]
+            return scores, subcategory_scores, matches
+        scores, subcategory_scores, matches = synonym_index.suggest(description, threshold)
+        self.put(key, fingerprint, (scores, subcategory_scores,
+                                    [match._replace(start=match.start - offset, end=match.end - offset)
+                                     for match in matches]))
+        return scores, subcategory_scores, matches
+
+    def get(self, key):
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return value
+            if self.connection is not None:
+                row = self.connection.execute('SELECT value FROM suggestions WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    scores, subcategory_scores, matches = json.loads(row[0])
+                    value = (scores, subcategory_scores, [PhraseMatch(*match) for match in matches])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, fingerprint, value):
+        with self.lock:
+            self._remember(key, value)
+            if self.connection is not None:
+                scores, subcategory_scores, matches = value
+                self.connection.execute('INSERT OR REPLACE INTO suggestions VALUES (?, ?, ?)',
+                                        (key, fingerprint, json.dumps([scores, subcategory_scores, matches])))
+                self.connection.commit()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def prune(self, fingerprint):
+        """
+        Drop the suggestions computed with any other synonym index than the one with the given fingerprint.
+        """
+        with self.lock:
+            self.memory.clear()
+            if self.connection is not None:
+                self.connection.execute('DELETE FROM suggestions WHERE fingerprint != ?', (fingerprint,))
+                self.connection.commit()
+
+    def stats(self):
+        """
+        Return the number of lookups, hits, hits served from disk and the hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {'lookups': lookups, 'hits': self.hits, 'disk_hits': self.disk_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,394 @@
+import collections
+import copy
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from .artifacts import task_inputs
+from .phrase_matcher import PhraseMatcher
+
+# Bumped when document frequencies counted by older code must not be reused
+DOCUMENT_FREQUENCIES_VERSION = 1
+
+# The synonym vectors of one class. Each row of subcategory_matrix is the centroid of the synonym vectors of one
+# subcategory, centroid is that of all the synonyms of the class. Classes given as a plain list of synonyms have a
+# single subcategory named None.
+ClassEntry = collections.namedtuple('ClassEntry', ['fingerprint', 'subcategory_names', 'subcategory_matrix',
+                                                   'features', 'centroid'])
+
+
+def fingerprint_synonyms(synonyms):
+    return hashlib.sha1(json.dumps(synonyms, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def idf_fingerprint(idf):
+    return hashlib.sha1(np.ascontiguousarray(idf).tobytes()).hexdigest() if idf is not None else None
+
+
+def index_fingerprint(class_synonyms, n_features=2 ** 18, idf=None):
+    """
+    Return the fingerprint of the SynonymIndex of the given synonyms and IDF weights, without building it.
+    """
+    return fingerprint_synonyms({'class_synonyms': class_synonyms, 'n_features': n_features,
+                                 'idf': idf_fingerprint(idf)})
+
+
+def has_subcategories(synonyms):
+    return isinstance(synonyms, dict)
+
+
+def make_vectorizer(n_features, idf=None):
+    # With IDF weights the raw counts are weighted first and normalized by vectorize
+    return HashingVectorizer(n_features=n_features, alternate_sign=False, norm='l2' if idf is None else None)
+
+
+def vectorize(vectorizer, texts, idf=None):
+    """
+    Vectorize texts with a vectorizer from make_vectorizer, weighting the term counts by idf if given.
+    """
+    vectors = vectorizer.transform([str(text) for text in texts])
+    if idf is None:
+        return vectors
+    vectors.data *= idf[vectors.indices]
+    return normalize(vectors, copy=False)
+
+
+class DocumentFrequencies:
+    """
+    Number of texts of a task containing each hashed feature, from which the IDF weights of the task's corpus are
+    computed. Texts are counted a batch at a time, so the corpus is streamed once and rows added later only need to
+    be counted on top.
+    """
+
+    def __init__(self, n_features=2 ** 18, counts=None, n_documents=0):
+        self.n_features = n_features
+        self.counts = np.zeros(n_features, dtype=np.int64) if counts is None else counts
+        self.n_documents = n_documents
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None, binary=True)
+
+    def update(self, texts):
+        texts = [str(text) for text in texts]
+        if texts:
+            self.counts += np.bincount(self.vectorizer.transform(texts).indices, minlength=self.n_features)
+            self.n_documents += len(texts)
+
+    def idf(self):
+        """
+        Smoothed IDF weights, as computed by scikit-learn's TfidfTransformer.
+        """
+        return np.log((1 + self.n_documents) / (1 + self.counts)) + 1
+
+    def save(self, path):
+        # Written to a temporary file first, so an interrupted save leaves the previous counts in place
+        temporary_path = f'{path}.tmp.npz'
+        np.savez(temporary_path, counts=self.counts, n_documents=self.n_documents)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(len(data['counts']), data['counts'], int(data['n_documents']))
+
+
+def load_document_frequencies(path, csv_path, column, n_features=2 ** 18, chunk_rows=10000):
+    """
+    Load the document frequencies saved at path, or count them over a column of a CSV file, read chunk by chunk,
+    and save them there.
+    """
+    if os.path.exists(path):
+        return DocumentFrequencies.load(path)
+    frequencies = DocumentFrequencies(n_features)
+    for chunk in pd.read_csv(csv_path, usecols=[column], dtype=str, chunksize=chunk_rows):
+        frequencies.update(chunk[column].fillna(''))
+    frequencies.save(path)
+    return frequencies
+
+
+def document_frequencies_inputs(task, n_features=2 ** 18):
+    return {'rows': task_inputs(task), 'column': task.field_to_label, 'n_features': n_features,
+            'version': DOCUMENT_FREQUENCIES_VERSION}
+
+
+def task_document_frequencies(task, store):
+    """
+    Return the document frequencies of the field a task labels, from the task's ArtifactStore, counted over the
+    field unless the frequencies of the same rows are there already.
+    """
+    path = store.build('document_frequencies', document_frequencies_inputs(task),
+                       lambda path: load_document_frequencies(path, task.field_csv_path(), task.field_to_label),
+                       '.npz')
+    return DocumentFrequencies.load(path)
+
+
+class SynonymIndex:
+    """
+    Vectors of the synonyms of every class, used to score descriptions against the classes.
+    Synonyms are vectorized with a stateless HashingVectorizer, so each class is an independent block of rows and a
+    change to synonyms.json only rebuilds the blocks of the classes that changed.
+    The similarity of a description to a (sub)class is its average cosine similarity with the synonyms, which is
+    the similarity with the centroid of the synonym vectors. A class with subcategories scores the maximum over
+    them, see score_hierarchy for the scores of the subcategories themselves.
+    Synonyms occurring word for word in a description are found first by a PhraseMatcher, see suggest.
+    Term counts are weighted by idf if given, the IDF weights of the task's corpus from DocumentFrequencies, so
+    words common to most descriptions weigh less in the similarities than the distinctive ones.
+    """
+
+    def __init__(self, class_synonyms, n_features=2 ** 18, idf=None):
+        self.n_features = n_features
+        self.idf = idf
+        self.idf_fingerprint = idf_fingerprint(idf)
+        self.vectorizer = make_vectorizer(n_features, idf)
+        self.class_synonyms = {}
+        self.fingerprint = None
+        self.classes = {}
+        self.matcher = PhraseMatcher({})
+        self.version = 0
+        self.update(class_synonyms)
+        # Incremented on every later change of this index, only comparable between versions of the same index
+        self.version = 0
+
+    @property
+    def class_names(self):
+        return list(self.classes)
+
+    def subcategory_names(self, class_name):
+        """
+        Return the subcategories of a class, an empty list for a class given as a plain list of synonyms.
+        """
+        if not has_subcategories(self.class_synonyms.get(class_name)):
+            return []
+        return list(self.classes[class_name].subcategory_names)
+
+    def update(self, class_synonyms):
+        """
+        Rebuild the classes whose synonyms changed. Returns a dict mapping each added, changed or removed class to
+        the hashed features of its old and new synonyms, the only features whose scores can have changed.
+        """
+        classes = {}
+        changed = {}
+        for class_name, synonyms in class_synonyms.items():
+            fingerprint = fingerprint_synonyms(synonyms)
+            old_entry = self.classes.get(class_name)
+            if old_entry is not None and old_entry.fingerprint == fingerprint:
+                classes[class_name] = old_entry
+                continue
+            entry = self._build_entry(fingerprint, synonyms)
+            classes[class_name] = entry
+            old_features = old_entry.features if old_entry is not None else np.empty(0, dtype=np.int64)
+            changed[class_name] = np.union1d(entry.features, old_features)
+        for class_name in self.classes.keys() - class_synonyms.keys():
+            changed[class_name] = self.classes[class_name].features
+
+        # The centroids of every class, scored first by score_hierarchy
+        centroids = sp.vstack([entry.centroid for entry in classes.values()], format='csr') if classes else \
+            sp.csr_matrix((0, self.n_features), dtype=np.float64)
+
+        # Swapped in with a single assignment, so a scoring thread always sees a consistent index
+        self.classes, self.centroids = classes, centroids
+        self.class_synonyms = class_synonyms
+        if changed:
+            self.matcher = PhraseMatcher(class_synonyms)
+            self.version += 1
+        # Identifies the scores of the index across sessions, unlike version
+        self.fingerprint = fingerprint_synonyms({'class_synonyms': class_synonyms, 'n_features': self.n_features,
+                                                 'idf': self.idf_fingerprint})
+        return changed
+
+    def copy(self):
+        """
+        Return a copy of the index sharing its built classes, to update an index other windows hold without
+        changing theirs. Only the classes changed by update are rebuilt in the copy.
+        """
+        return copy.copy(self)
+
+    def _build_entry(self, fingerprint, synonyms):
+        if not has_subcategories(synonyms):
+            synonyms = {None: synonyms}
+        names = list(synonyms)
+        rows = []
+        features = []
+        matrices = []
+        for sub_class_name, sub_synonyms in synonyms.items():
+            if sub_synonyms:
+                matrix = self.transform(sub_synonyms)
+                matrices.append(matrix)
+                features.append(matrix.indices)
+                rows.append(sp.csr_matrix(matrix.mean(axis=0)))
+            else:
+                rows.append(sp.csr_matrix((1, self.n_features), dtype=np.float64))
+        subcategory_matrix = sp.vstack(rows, format='csr') if rows else \
+            sp.csr_matrix((0, self.n_features), dtype=np.float64)
+        centroid = sp.csr_matrix(sp.vstack(matrices).mean(axis=0)) if matrices else \
+            sp.csr_matrix((1, self.n_features), dtype=np.float64)
+        features = np.unique(np.concatenate(features)) if features else np.empty(0, dtype=np.int64)
+        return ClassEntry(fingerprint, names, subcategory_matrix, features, centroid)
+
+    def stacked(self, class_names=None):
+        """
+        Stack the subcategory centroids of the given classes (all of them by default) into a single matrix for bulk
+        scoring. Returns the matrix and the class column of each of its rows, the rows of a class are consecutive.
+        """
+        classes = self.classes
+        if class_names is None:
+            class_names = list(classes)
+        matrices = []
+        row_columns = []
+        for column, class_name in enumerate(class_names):
+            entry = classes.get(class_name)
+            if entry is None or not entry.subcategory_matrix.shape[0]:
+                continue
+            matrices.append(entry.subcategory_matrix)
+            row_columns.append(np.full(entry.subcategory_matrix.shape[0], column, dtype=np.int64))
+        if not matrices:
+            return sp.csr_matrix((0, self.n_features), dtype=np.float64), np.empty(0, dtype=np.int64)
+        return sp.vstack(matrices, format='csr'), np.concatenate(row_columns)
+
+    def transform(self, texts):
+        return vectorize(self.vectorizer, texts, self.idf)
+
+    def score_vectors(self, vectors, class_names=None):
+        """
+        Score description vectors against the given classes (all of them by default).
+        Returns an array of shape (number of descriptions, number of classes).
+        """
+        matrix, row_columns = self.stacked(class_names)
+        n_classes = len(self.classes if class_names is None else class_names)
+        return score_stacked(vectors, matrix, row_columns, n_classes)
+
+    def score(self, description):
+        """
+        Score a single description. Returns a dict mapping class name to similarity.
+        """
+        class_names = self.class_names
+        scores = self.score_vectors(self.transform([description]), class_names)[0]
+        return {class_name: float(score) for class_name, score in zip(class_names, scores)}
+
+    def score_hierarchy(self, description, threshold=0.0):
+        """
+        Score a single description against the classes and their subcategories.
+        The class centroids are scored first, the subcategories are only scored for the classes whose centroid
+        scores above threshold, so the cost grows with the number of classes and of the subcategories of the likely
+        classes rather than with all subcategories. A description sharing no feature with a class scores 0 for
+        each of its subcategories, so the default threshold of 0 prunes nothing that could score.
+        Returns a dict mapping class name to score, and a dict mapping each class with scored subcategories to a
+        dict of subcategory scores. Pruned classes keep their centroid score.
+        """
+        classes, centroids = self.classes, self.centroids
+        vector = self.transform([description])
+        centroid_scores = np.asarray((centroids @ vector.T).todense()).ravel()
+        scores = {}
+        subcategory_scores = {}
+        for (class_name, entry), centroid_score in zip(classes.items(), centroid_scores):
+            scores[class_name] = float(centroid_score)
+            if centroid_score <= threshold or entry.subcategory_names == [None]:
+                continue
+            sub_scores = np.asarray((entry.subcategory_matrix @ vector.T).todense()).ravel()
+            if len(sub_scores):
+                scores[class_name] = float(sub_scores.max())
+                subcategory_scores[class_name] = {name: float(score)
+                                                  for name, score in zip(entry.subcategory_names, sub_scores)}
+        return scores, subcategory_scores
+
+    def suggest(self, description, threshold=0.0):
+        """
+        Score a description, using the exact synonym matches when there are any and score_hierarchy otherwise.
+        Returns a dict mapping class name to score, a dict of subcategory scores per class and the list of
+        PhraseMatch found.
+        """
+        matches = self.matcher.find(description)
+        if matches:
+            subcategory_scores = PhraseMatcher.subcategory_scores(matches, description)
+            return PhraseMatcher.class_scores(matches, description), subcategory_scores, matches
+        scores, subcategory_scores = self.score_hierarchy(description, threshold)
+        return scores, subcategory_scores, []
+
+
+def score_stacked(vectors, matrix, row_columns, n_classes):
+    """
+    Score description vectors against the matrix returned by SynonymIndex.stacked in a single product, reduced to
+    the maximum over the subcategories of each class.
+    """
+    scores = np.zeros((vectors.shape[0], n_classes), dtype=np.float32)
+    if not len(row_columns):
+        return scores
+    row_scores = np.asarray((vectors @ matrix.T).todense())
+    # Rows of a class are consecutive, reduceat takes the maximum over each run
+    starts = np.flatnonzero(np.r_[True, row_columns[1:] != row_columns[:-1]])
+    scores[:, row_columns[starts]] = np.maximum.reduceat(row_scores, starts, axis=1)
+    return scores
+
+
+class ScoreMatrix:
+    """
+    Scores of the rows scored so far against every class of a SynonymIndex.
+    The row vectors are kept, so after a synonyms change only the rows sharing a feature with the changed synonyms
+    are re-scored, and only for the changed classes.
+    """
+
+    def __init__(self, class_names, n_features=2 ** 18):
+        self.class_names = list(class_names)
+        self.row_ids = []
+        self.positions = {}
+        self.vectors = sp.csr_matrix((0, n_features), dtype=np.float64)
+        self.scores = np.zeros((0, len(self.class_names)), dtype=np.float32)
+
+    def add(self, row_ids, vectors, scores):
+        """
+        Add scored rows, scores must follow the column order of class_names.
+        """
+        new_rows = [i for i, row_id in enumerate(row_ids) if row_id not in self.positions]
+        for i in new_rows:
+            self.positions[row_ids[i]] = len(self.row_ids)
+            self.row_ids.append(row_ids[i])
+        self.vectors = sp.vstack([self.vectors, vectors[new_rows]], format='csr')
+        self.scores = np.vstack([self.scores, scores[new_rows]])
+
+    def row_scores(self, row_id):
+        """
+        Return a dict mapping class name to the score of a row, or None if the row has not been scored.
+        """
+        position = self.positions.get(row_id)
+        if position is None:
+            return None
+        return {class_name: float(score) for class_name, score in zip(self.class_names, self.scores[position])}
+
+    def top_k(self, position, k, scores=None, class_names=None):
+        scores = self.scores if scores is None else scores
+        class_names = self.class_names if class_names is None else class_names
+        row = scores[position]
+        best = np.argsort(-row, kind='stable')[:k]
+        return [class_names[column] for column in best if row[column] > 0]
+
+    def apply_update(self, index, changed, k=3):
+        """
+        Bring the scores up to date after SynonymIndex.update returned changed. Returns the ids of the rows whose
+        top k classes changed.
+        """
+        if not changed:
+            return []
+        new_class_names = index.class_names
+        old_columns = {class_name: column for column, class_name in enumerate(self.class_names)}
+        new_scores = np.zeros((len(self.row_ids), len(new_class_names)), dtype=np.float32)
+        for column, class_name in enumerate(new_class_names):
+            if class_name in old_columns and class_name not in changed:
+                new_scores[:, column] = self.scores[:, old_columns[class_name]]
+
+        # Rows without any feature of the old or new synonyms score 0 for the changed classes before and after
+        features = np.unique(np.concatenate(list(changed.values())))
+        candidates = np.flatnonzero(self.vectors[:, features].getnnz(axis=1)) if len(features) else []
+        rescored = [class_name for class_name in new_class_names if class_name in changed]
+        if len(candidates) and rescored:
+            columns = [new_class_names.index(class_name) for class_name in rescored]
+            new_scores[np.ix_(candidates, columns)] = index.score_vectors(self.vectors[candidates], rescored)
+
+        affected = [self.row_ids[position] for position in candidates
+                    if self.top_k(position, k) != self.top_k(position, k, new_scores, new_class_names)]
+        self.scores = new_scores
+        self.class_names = new_class_names
+        return affected
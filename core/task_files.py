@@ -0,0 +1,72 @@
+import os
+import shutil
+import time
+
+# Name of the folder, next to the task directories, holding the directories of deleted tasks until they are removed
+TRASH_DIRECTORY_NAME = '.trash'
+
+
+def directory_size(path):
+    """
+    Return the total size in bytes of the files under path, 0 if it does not exist. Files removed while walking are
+    skipped.
+    """
+    size = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return size
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def move_to_trash(task_directory, trash_directory):
+    """
+    Move a task directory into the trash folder with a single rename, however large it is. Returns the path it was
+    moved to, or None if there is no such directory. The trash folder has to be on the same file system, it sits
+    next to the task directories.
+    """
+    if not os.path.isdir(task_directory):
+        return None
+    os.makedirs(trash_directory, exist_ok=True)
+    # Suffixed so a task deleted again before the trash was emptied does not collide
+    target = os.path.join(trash_directory, f'{os.path.basename(task_directory)}.{time.time_ns()}')
+    os.rename(task_directory, target)
+    return target
+
+
+def empty_trash(trash_directory):
+    """
+    Remove every directory in the trash folder. Returns the number of bytes freed.
+    """
+    if not os.path.isdir(trash_directory):
+        return 0
+    freed = 0
+    for entry in os.scandir(trash_directory):
+        size = directory_size(entry.path) if entry.is_dir(follow_symlinks=False) else entry.stat().st_size
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"Could not remove {entry.path}:", e)
+            continue
+        freed += size
+    return freed
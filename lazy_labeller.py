@@ -1,17 +1,28 @@
+import argparse
 import os
 import sys
 from PyQt6.QtWidgets import QApplication
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from models import Base
+from core.profiling import start_session_profiler, stop_session_profiler
+from models import Base, upgrade_schema, create_database_engine
 from screens.start_screen import StartWindow
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description='Lazy Labeller')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile the session, the profile is saved in the directory of each task closed')
+    parser.add_argument('--profile-interval', type=float, default=5,
+                        help='interval in milliseconds between samples of the worker threads')
+    # The remaining arguments are for Qt
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    if args.profile:
+        start_session_profiler(args.profile_interval / 1000)
     # Create a SQLite database engine
-    engine = create_engine('sqlite:///tasks/tasks.db')
+    engine = create_database_engine('sqlite:///tasks/tasks.db')
     Base.metadata.create_all(engine)
+    upgrade_schema(engine)
     # Create a SQLAlchemy SessionFactory
     Session = sessionmaker(bind=engine)
 
@@ -19,4 +30,6 @@ if __name__ == '__main__':
     tool = StartWindow(Session)
     tool.show()
 
-    sys.exit(app.exec())
+    status = app.exec()
+    stop_session_profiler()
+    sys.exit(status)
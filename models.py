@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, Boolean, create_engine, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Float, create_engine, DateTime, inspect, text, event
 from sqlalchemy.orm import validates, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -18,6 +18,17 @@ class Task(Base):
     field_to_label = Column(String)
     single_class = Column(Boolean)
     labelled_samples = Column(Integer, default=0)
+    autosave_interval = Column(Integer, default=10)  # Minutes between autosaves
+    hierarchical_labels = Column(Boolean, default=False)  # Pick a subcategory after a class with subcategories
+    subcategory_threshold = Column(Float, default=0.0)  # Classes scoring at most this skip subcategory scoring
+    display_limit = Column(Integer, default=20000)  # Characters of a sample shown before "Load more"
+    scoring_limit = Column(Integer, default=10000)  # Characters of a sample scored for suggestions
+    source_file_path = Column(String)  # The original CSV file, context columns are read from it
+    context_columns = Column(String, default='')  # Comma separated columns shown next to the field to label
+    field_in_source = Column(Boolean, default=False)  # The field is read from source_file_path, not copied
+    idf_weighting = Column(Boolean, default=False)  # Weight the suggestion vectors by the IDF of the task's texts
+    disk_size = Column(Integer, default=0)  # Bytes of the task directory, updated when its files are written
+    deleted = Column(Boolean, default=False)  # Deleted, its directory is in the trash until the reaper removes it
     task_uuid = Column(String)
     created_at = Column(DateTime, default=datetime.datetime.now())  # Set default value to current UTC time
 
@@ -39,9 +50,47 @@ class Task(Base):
         return value
 
     def get_labels_list(self):
-        return self.labels.split(',')
+        # Parsed once per labels string, callers must not modify the returned list
+        if getattr(self, '_labels_list_source', None) != self.labels:
+            self._labels_list = self.labels.split(',')
+            self._labels_list_source = self.labels
+        return self._labels_list
 
+    def field_csv_path(self):
+        # The CSV file holding the field to label
+        return self.source_file_path if self.field_in_source else self.file_path
 
+    def get_context_columns_list(self):
+        return [column for column in (self.context_columns or '').split(',') if column]
 
 
+def upgrade_schema(engine):
+    """
+    Add the columns introduced after a database was created, `create_all` does not alter existing tables.
+    """
+    existing_columns = {column['name'] for column in inspect(engine).get_columns(Task.__tablename__)}
+    with engine.begin() as connection:
+        for column in Task.__table__.columns:
+            if column.name in existing_columns:
+                continue
+            ddl = f"ALTER TABLE {Task.__tablename__} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if isinstance(default, (bool, int, float, str)):
+                ddl += f" DEFAULT {int(default) if isinstance(default, bool) else repr(default)}"
+            connection.execute(text(ddl))
 
+
+def create_database_engine(url):
+    """
+    Create the engine for the tasks database. SQLite connections use WAL so the GUI can read while the background
+    writer commits, and synchronous=NORMAL so a commit does not fsync the whole database every time.
+    """
+    engine = create_engine(url)
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+    return engine
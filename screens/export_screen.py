@@ -1,8 +1,39 @@
-import os
-import pandas as pd
-from PyQt6.QtWidgets import QDialog, QVBoxLayout, QRadioButton, QPushButton, QFileDialog, QLineEdit, QLabel
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QRadioButton, QPushButton, QFileDialog, QLineEdit, QLabel, \
+    QCheckBox, QMessageBox
+from core.export import export_joined, export_labels
 from models import Task
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import QTimer, QThread, pyqtSignal
+
+
+class ExportThread(QThread):
+    """
+    QThread that writes the rows of a task with its labels, as they are in data.csv (see core.export.export_labels)
+    or joined to its original files (see core.export.export_joined).
+    """
+    done = pyqtSignal(int)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, Session, task_uuid, file_path, only_labelled, joined=True):
+        super().__init__()
+        self.Session = Session
+        self.task_uuid = task_uuid
+        self.file_path = file_path
+        self.only_labelled = only_labelled
+        self.joined = joined
+
+    def run(self):
+        session = self.Session()
+        try:
+            task = session.query(Task).filter_by(task_uuid=self.task_uuid).first()
+            export = export_joined if self.joined else export_labels
+            rows = export(task, self.file_path, self.only_labelled)
+        except Exception as e:
+            self.error_signal.emit(str(e))
+            return
+        finally:
+            session.close()
+        self.done.emit(rows)
+
 
 class ExportWindow(QDialog):
     def __init__(self, Session, task_uuid):
@@ -19,6 +50,11 @@ class ExportWindow(QDialog):
         self.labelled_radio_btn = QRadioButton("Export only labelled rows")
         self.layout.addWidget(self.labelled_radio_btn)
 
+        # Every column of the original file, with the class names, instead of the copied field and class indices
+        self.join_checkbox = QCheckBox("Join labels to the original file")
+        self.layout.addWidget(self.join_checkbox)
+        self.export_thread = None
+
         # Add a button to start the export process
         export_button = QPushButton("Export")
         export_button.clicked.connect(self.export_data)
@@ -29,23 +65,17 @@ class ExportWindow(QDialog):
         file_path, _ = QFileDialog.getSaveFileName(self, "Export File", "", "CSV Files (*.csv)")
 
         if file_path:
-            # Export the labelled samples to the selected file
-            session = self.Session()
-            task = session.query(Task).filter_by(task_uuid=self.task_uuid).first()
-            data = pd.read_csv(os.path.join('tasks', task.task_uuid, 'data.csv'))
-
-            # Only export rows where the label column has a value, if the labelled_radio_btn is checked
-            if self.labelled_radio_btn.isChecked():
-                data = data[data[task.label_column_name].notna()]
-
-            data.to_csv(file_path, index=False)
-
-            session.close()
+            # Only rows where the label column has a value are exported if the labelled_radio_btn is checked
+            self.export_thread = ExportThread(self.Session, self.task_uuid, file_path,
+                                              self.labelled_radio_btn.isChecked(), self.join_checkbox.isChecked())
+            self.export_thread.done.connect(self.on_export_done)
+            self.export_thread.error_signal.connect(lambda message: QMessageBox.critical(self, "Error", message))
+            self.export_thread.start()
 
-            # Close the export window and show the "Export completed" window
-            self.close()
-            self.completed_window = ExportCompletedWindow()
-            self.completed_window.show()
+    def on_export_done(self, rows):
+        self.close()
+        self.completed_window = ExportCompletedWindow()
+        self.completed_window.show()
 
 class ExportCompletedWindow(QDialog):
     def __init__(self):
@@ -0,0 +1,533 @@
+import os
+
+import numpy as np
+import pandas as pd
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QAbstractTableModel, QModelIndex
+from PyQt6.QtGui import QColor, QKeySequence, QShortcut
+from PyQt6.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QWidget, QTableView, \
+    QHeaderView, QSpinBox, QStyledItemDelegate, QComboBox, QDoubleSpinBox, QMessageBox
+
+from core.artifacts import ArtifactStore
+from core.bulk_scoring import score_rows_cached, auto_label
+from core.label_log import LabelLog
+from core.label_store import LabelStore, label_names, compact_columns, memory_report, save_memory_report, \
+    MEMORY_REPORT_FILE_NAME
+from core.profiling import save_session_profile
+from core.resource_pool import shared_resources
+from core.source_rows import SourceRows, row_offsets_path
+from core.synonym_index import ScoreMatrix
+from models import Task
+from .labelling_screen import SavePipeline, DatabaseWriterThread, SynonymsWatcher, acquire_synonym_index, \
+    share_synonym_index
+
+
+class PageScoringThread(QThread):
+    """
+    QThread that scores the rows of a grid page against every class of the synonym index.
+    The result is emitted as a tuple (row ids, row vectors, scores, class names, index fingerprint, generation), the
+    generation tells the window whether the page was scored again since.
+    """
+
+    result_signal = pyqtSignal(object)
+
+    def __init__(self, synonym_index, row_ids, texts, generation=0):
+        super().__init__()
+        self.synonym_index = synonym_index
+        self.row_ids = row_ids
+        self.texts = texts
+        self.generation = generation
+
+    def run(self):
+        fingerprint = self.synonym_index.fingerprint
+        class_names = self.synonym_index.class_names
+        vectors = self.synonym_index.transform(self.texts)
+        scores = self.synonym_index.score_vectors(vectors, class_names)
+        self.result_signal.emit((self.row_ids, vectors, scores, class_names, fingerprint, self.generation))
+
+
+class AutoLabelThread(QThread):
+    """
+    QThread that scores every given row against the synonym index on a pool of processes and picks the classes
+    scoring above the threshold. The scores are kept in the task's ArtifactStore, rows scored before with the same
+    synonyms are not scored again. The result is emitted as a tuple (row positions, class indices of each row).
+    """
+
+    progress_signal = pyqtSignal(int)
+    result_signal = pyqtSignal(object)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, synonym_index, positions, texts, store, labels, threshold, single_class, max_chars=None):
+        super().__init__()
+        self.max_chars = max_chars
+        self.synonym_index = synonym_index
+        self.positions = positions
+        self.texts = texts
+        self.store = store
+        self.labels = labels
+        self.threshold = threshold
+        self.single_class = single_class
+
+    def run(self):
+        try:
+            class_names, scores_path = score_rows_cached(self.store, self.synonym_index, self.texts,
+                                                         progress=self.progress_signal.emit,
+                                                         max_chars=self.max_chars)
+            scores = np.load(scores_path, mmap_mode='r')
+            rows, classes = auto_label(scores, class_names, self.labels, self.threshold, self.single_class)
+        except Exception as e:
+            self.error_signal.emit(str(e))
+            return
+        self.result_signal.emit((self.positions[rows], classes))
+
+
+class LabelPageModel(QAbstractTableModel):
+    """
+    Table model exposing a single page of a task to the grid view.
+    Only the row positions of the current page are held by the model, cell values are read from the task
+    DataFrame on demand so paging through very large tasks never copies the data.
+    """
+
+    headers = ["Row", "Text", "Label"]
+    LABEL_COLUMN = 2
+
+    # Number of characters of the text shown in a grid cell
+    preview_length = 200
+
+    def __init__(self, label_store, field, labels, single_class, parent=None, source_rows=None):
+        super().__init__(parent)
+        self.label_store = label_store
+        self.df = label_store.df
+        # Tasks reading their field from the original file pass its SourceRows, the field is not in the task
+        self.field = field
+        self.source_rows = source_rows
+        self.field_position = self.df.columns.get_loc(field) if source_rows is None else None
+        self.labels = labels
+        self.single_class = single_class
+        self.positions = np.empty(0, dtype=np.int64)
+        # Class indices pending for each row of the page, and the rows which should not be overwritten by suggestions
+        self.pending = []
+        self.edited = set()
+
+    def set_page(self, positions):
+        """
+        Show the rows at the given integer positions. Rows that already carry a label keep it.
+        """
+        self.beginResetModel()
+        self.positions = positions
+        self.pending = []
+        self.edited = set()
+        for row, index in enumerate(self.page_indices()):
+            classes = self.label_store.get(index)
+            if classes is None:
+                self.pending.append([])
+            else:
+                self.pending.append(classes)
+                self.edited.add(row)
+        self.endResetModel()
+
+    def set_suggestions(self, suggestions):
+        """
+        Pre-fill the suggested classes for the rows the annotator has not touched yet.
+        """
+        for row, classes in suggestions.items():
+            if row in self.edited or row >= len(self.pending):
+                continue
+            self.pending[row] = classes
+            index = self.index(row, self.LABEL_COLUMN)
+            self.dataChanged.emit(index, index)
+
+    def page_indices(self):
+        return self.df.index[self.positions]
+
+    def page_labels(self):
+        return list(self.pending)
+
+    def page_texts(self):
+        return [self.text(position) for position in self.positions]
+
+    def text(self, position):
+        if self.source_rows is not None:
+            return self.source_rows.value(position, self.field)
+        return self.df.iat[position, self.field_position]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.positions)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            if column == 0:
+                return str(self.df.index[self.positions[row]])
+            if column == 1:
+                text = str(self.text(self.positions[row]))
+                return text[:self.preview_length].replace("\n", " ")
+            return ", ".join(label_names(self.pending[row], self.labels))
+        if role == Qt.ItemDataRole.BackgroundRole and column == self.LABEL_COLUMN and row in self.edited:
+            return QColor("#fff3b0")
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.column() == self.LABEL_COLUMN:
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        """
+        Set the label of a row from a comma separated list of class names.
+        """
+        if role != Qt.ItemDataRole.EditRole or index.column() != self.LABEL_COLUMN:
+            return False
+        names = [name.strip() for name in str(value).split(',') if name.strip()]
+        if any(name not in self.labels for name in names):
+            return False
+        if self.single_class and len(names) > 1:
+            return False
+        self.pending[index.row()] = [self.labels.index(name) for name in names]
+        self.edited.add(index.row())
+        self.dataChanged.emit(index, index)
+        return True
+
+
+class ClassComboDelegate(QStyledItemDelegate):
+    """
+    Delegate editing the label column with a combo box of the task classes, used for single class tasks.
+    """
+
+    def __init__(self, labels, parent=None):
+        super().__init__(parent)
+        self.labels = labels
+
+    def createEditor(self, parent, option, index):
+        combo = QComboBox(parent)
+        combo.addItems([""] + self.labels)
+        return combo
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data(Qt.ItemDataRole.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.ItemDataRole.EditRole)
+
+
+class GridLabellingWindow(QMainWindow):
+    """
+    Window showing a page of unlabelled rows at once with their suggested classes pre-filled.
+    The annotator only corrects the wrong suggestions and commits the whole page with a single write.
+    """
+
+    def __init__(self, Session, project_uuid, page_size=50):
+        super().__init__()
+        self.session = Session()
+        self.project_data = self.session.query(Task).filter_by(task_uuid=project_uuid).first()
+        self.labels = self.project_data.get_labels_list()
+
+        self.df = pd.read_csv(self.project_data.file_path)
+        self.label_store = LabelStore(self.df, self.project_data.label_column_name, class_count=len(self.labels))
+        compact_columns(self.df, exclude=[self.project_data.field_to_label])
+        self.memory_report = memory_report(self.label_store)
+        save_memory_report(self.memory_report, os.path.join(os.path.dirname(self.project_data.file_path),
+                                                            MEMORY_REPORT_FILE_NAME))
+        self.source_rows = None
+        # Derived data of the task, reused while its inputs are unchanged
+        self.artifact_store = ArtifactStore(os.path.dirname(self.project_data.file_path))
+        if self.project_data.field_in_source:
+            self.source_rows = SourceRows(self.project_data.source_file_path,
+                                          row_offsets_path(self.artifact_store, self.project_data.source_file_path))
+        self.save_pipeline = SavePipeline(self.label_store, self.project_data.file_path)
+        self.save_pipeline.replay_journal()
+        # Committed pages and auto-labellings are logged as one operation each, shared with the labelling window
+        self.label_log = LabelLog(os.path.join(os.path.dirname(self.project_data.file_path), 'label_log.jsonl'),
+                                  background=True)
+        self.unlabelled_positions = self.label_store.unlabelled_positions()
+        self.labelled_count = len(self.df) - len(self.unlabelled_positions)
+        self.page_start = 0
+        self.page_size = page_size
+
+        # Shared with the other open windows of tasks with the same synonyms
+        self.synonym_index_key, self.synonym_index = acquire_synonym_index(self.project_data)
+        # Scores of every row scored in this session, updated incrementally when synonyms.json changes
+        self.score_matrix = ScoreMatrix(self.synonym_index.class_names)
+        self.synonyms_watcher = SynonymsWatcher(self.project_data.synonyms_file_path, self.synonym_index)
+        self.synonyms_watcher.synonyms_changed.connect(self.on_synonyms_changed)
+
+        self.page_scoring_thread = None
+        # Incremented every time the page is scored again, results of older scorers are ignored
+        self.page_generation = 0
+        # Superseded scorers, kept alive until they finish instead of blocking the GUI thread on them
+        self.retired_scoring_threads = []
+        self.auto_label_thread = None
+        self.database_writer = DatabaseWriterThread(Session)
+        self.database_writer.start()
+
+        self.initUI()
+        self.load_page()
+
+    def initUI(self):
+        layout = QVBoxLayout()
+
+        self.page_label = QLabel()
+        layout.addWidget(self.page_label)
+
+        self.model = LabelPageModel(self.label_store, self.project_data.field_to_label, self.labels,
+                                    self.project_data.single_class, source_rows=self.source_rows)
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        if self.project_data.single_class:
+            self.table_view.setItemDelegateForColumn(LabelPageModel.LABEL_COLUMN,
+                                                     ClassComboDelegate(self.labels, self.table_view))
+        layout.addWidget(self.table_view)
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Rows per page"))
+        self.page_size_spinbox = QSpinBox()
+        self.page_size_spinbox.setRange(1, 1000)
+        self.page_size_spinbox.setValue(self.page_size)
+        self.page_size_spinbox.valueChanged.connect(self.on_page_size_changed)
+        controls.addWidget(self.page_size_spinbox)
+
+        self.previous_btn = QPushButton('Previous Page')
+        self.previous_btn.clicked.connect(self.on_previous_button_clicked)
+        controls.addWidget(self.previous_btn)
+
+        self.commit_btn = QPushButton('Commit Page - Ctrl+Enter')
+        self.commit_btn.clicked.connect(self.on_commit_button_clicked)
+        controls.addWidget(self.commit_btn)
+
+        self.undo_btn = QPushButton('Undo - Ctrl+Z')
+        self.undo_btn.clicked.connect(self.on_undo_button_clicked)
+        controls.addWidget(self.undo_btn)
+
+        self.redo_btn = QPushButton('Redo - Ctrl+Shift+Z')
+        self.redo_btn.clicked.connect(self.on_redo_button_clicked)
+        controls.addWidget(self.redo_btn)
+        layout.addLayout(controls)
+
+        auto_label_controls = QHBoxLayout()
+        auto_label_controls.addWidget(QLabel("Auto-label rows scoring at least"))
+        self.threshold_spinbox = QDoubleSpinBox()
+        self.threshold_spinbox.setRange(0.01, 1.0)
+        self.threshold_spinbox.setSingleStep(0.05)
+        self.threshold_spinbox.setValue(0.8)
+        auto_label_controls.addWidget(self.threshold_spinbox)
+        self.auto_label_btn = QPushButton('Auto-label All Rows')
+        self.auto_label_btn.clicked.connect(self.on_auto_label_button_clicked)
+        auto_label_controls.addWidget(self.auto_label_btn)
+        layout.addLayout(auto_label_controls)
+
+        QShortcut(QKeySequence("Ctrl+Return"), self, activated=self.on_commit_button_clicked)
+        QShortcut(QKeySequence("Ctrl+Z"), self, activated=self.on_undo_button_clicked)
+        QShortcut(QKeySequence("Ctrl+Shift+Z"), self, activated=self.on_redo_button_clicked)
+        QShortcut(QKeySequence("Ctrl+Y"), self, activated=self.on_redo_button_clicked)
+
+        central_widget = QWidget()
+        central_widget.setLayout(layout)
+        self.setCentralWidget(central_widget)
+
+    def load_page(self):
+        """
+        Show the current page of unlabelled rows and start scoring its suggestions in the background.
+        """
+        positions = self.unlabelled_positions[self.page_start:self.page_start + self.page_size]
+        self.model.set_page(positions)
+        total = len(self.unlabelled_positions)
+        if len(positions):
+            self.page_label.setText(f"Rows {self.page_start + 1}-{self.page_start + len(positions)} of {total} "
+                                    f"unlabelled rows. Number of labelled samples: {self.labelled_count}")
+        else:
+            self.page_label.setText("No more unlabelled records.")
+        self._start_page_scoring_thread()
+
+    def _start_page_scoring_thread(self):
+        """
+        Suggest classes for the page, rows scored earlier in the session are taken from the score matrix and only
+        the others are scored in the background.
+        """
+        self.page_generation += 1
+        self.retired_scoring_threads = [thread for thread in self.retired_scoring_threads if thread.isRunning()]
+        if self.page_scoring_thread and self.page_scoring_thread.isRunning():
+            self.retired_scoring_threads.append(self.page_scoring_thread)
+        self._apply_suggestions(self.model.page_indices())
+
+        unscored = [(int(row_id), text) for row_id, text in zip(self.model.page_indices(), self.model.page_texts())
+                    if int(row_id) not in self.score_matrix.positions]
+        if not unscored:
+            return
+        row_ids, texts = zip(*unscored)
+        # Only a bounded prefix of each row is scored, so huge rows cannot stall the scorer
+        scoring_limit = self.project_data.scoring_limit or 10000
+        texts = [str(text)[:scoring_limit] for text in texts]
+        self.page_scoring_thread = PageScoringThread(self.synonym_index, list(row_ids), texts, self.page_generation)
+        self.page_scoring_thread.result_signal.connect(self.on_page_scored)
+        self.page_scoring_thread.start()
+
+    def on_page_scored(self, result):
+        row_ids, vectors, scores, class_names, fingerprint, generation = result
+        if generation != self.page_generation:
+            # Scored for a page that was left or scored again since
+            return
+        # The versions of indexes shared with other windows are unrelated, the fingerprint identifies the synonyms
+        if fingerprint != self.synonym_index.fingerprint:
+            # Synonyms changed while scoring
+            self._start_page_scoring_thread()
+            return
+        self.score_matrix.add(row_ids, vectors, scores)
+        self._apply_suggestions(row_ids)
+
+    def on_synonyms_changed(self, changed):
+        """
+        Handler for a change to synonyms.json. Only the rows whose best class changed get a new suggestion.
+        """
+        self.synonym_index_key, self.synonym_index = share_synonym_index(self.synonym_index_key,
+                                                                         self.synonyms_watcher.synonym_index)
+        self.synonyms_watcher.synonym_index = self.synonym_index
+        affected = self.score_matrix.apply_update(self.synonym_index, changed, k=1)
+        self._apply_suggestions(affected)
+        if self.page_scoring_thread and self.page_scoring_thread.isRunning():
+            self._start_page_scoring_thread()
+
+    def _apply_suggestions(self, row_ids):
+        """
+        Pre-fill the best scoring class of the given rows that are on the current page.
+        """
+        page_rows = {int(row_id): row for row, row_id in enumerate(self.model.page_indices())}
+        suggestions = {}
+        for row_id in row_ids:
+            row = page_rows.get(int(row_id))
+            scores = self.score_matrix.row_scores(int(row_id))
+            if row is None or scores is None:
+                continue
+            best_match_class = max(scores, key=scores.get)
+            if scores[best_match_class] > 0 and best_match_class in self.labels:
+                suggestions[row] = [self.labels.index(best_match_class)]
+            else:
+                suggestions[row] = []
+        self.model.set_suggestions(suggestions)
+
+    def on_page_size_changed(self, value):
+        self.page_size = value
+        self.load_page()
+
+    def on_previous_button_clicked(self):
+        self.page_start = max(0, self.page_start - self.page_size)
+        self.load_page()
+
+    def on_commit_button_clicked(self):
+        """
+        Write the labels of the whole page in one bulk assignment, persist them and move to the next page.
+        Rows the annotator did not edit and without a suggestion are left unlabelled.
+        """
+        indices = self.model.page_indices()
+        if not len(indices):
+            return
+        page_labels = self.model.page_labels()
+        rows = [row for row, classes in enumerate(page_labels) if row in self.model.edited or classes]
+        self._set_labels(indices[rows], [page_labels[row] for row in rows])
+        self.page_start += len(self.model.positions)
+        self.load_page()
+
+    def _set_labels(self, indices, labels):
+        """
+        Store the labels of several rows and log the rows that changed as a single operation, undone as a whole.
+        """
+        changes = [(index, old, list(new)) for index, new in zip(indices, labels)
+                   for old in [self.label_store.get(index)] if old != list(new)]
+        if not changes:
+            return
+        self._apply_changes(changes)
+        self.label_log.record_many(*zip(*changes))
+
+    def _apply_changes(self, changes):
+        """
+        Store the new label of each (index, old, new) change and save them in the background.
+        """
+        self.label_store.set_many([index for index, _, _ in changes], [new for _, _, new in changes])
+        self.labelled_count += sum((new is not None) - (old is not None) for _, old, new in changes)
+        self.save_pipeline.request_save()
+        self.database_writer.update_progress(self.project_data.task_uuid, self.labelled_count)
+
+    def on_undo_button_clicked(self):
+        """
+        Revert the last committed page, auto-labelling or label change, and show its rows again.
+        """
+        operation = self.label_log.undo()
+        if operation is not None:
+            self._show_changes([(index, new, old) for index, old, new in operation.rows()])
+
+    def on_redo_button_clicked(self):
+        operation = self.label_log.redo()
+        if operation is not None:
+            self._show_changes(operation.rows())
+
+    def _show_changes(self, changes):
+        self._apply_changes(changes)
+        # Undone rows are unlabelled again, the page starts from the first of them
+        self.unlabelled_positions = self.label_store.unlabelled_positions()
+        first = self.df.index.get_indexer([index for index, _, _ in changes]).min()
+        self.page_start = int(np.searchsorted(self.unlabelled_positions, first))
+        self.load_page()
+
+    def on_auto_label_button_clicked(self):
+        """
+        Score every unlabelled row in the background and label those whose best class scores above the threshold.
+        """
+        if self.auto_label_thread and self.auto_label_thread.isRunning():
+            return
+        positions = self.unlabelled_positions
+        if self.source_rows is not None:
+            # Read row by row from the original file while the worker writes them out for scoring
+            texts = (self.source_rows.value(position, self.project_data.field_to_label) for position in positions)
+        else:
+            texts = self.df.iloc[positions, self.df.columns.get_loc(self.project_data.field_to_label)].fillna('')
+        self.auto_label_thread = AutoLabelThread(self.synonym_index, positions, texts, self.artifact_store,
+                                                 self.labels, self.threshold_spinbox.value(),
+                                                 self.project_data.single_class,
+                                                 self.project_data.scoring_limit or 10000)
+        self.auto_label_thread.progress_signal.connect(
+            lambda done: self.page_label.setText(f"Scored {done} of {len(positions)} unlabelled rows"))
+        self.auto_label_thread.result_signal.connect(self.on_auto_label_done)
+        self.auto_label_thread.error_signal.connect(lambda message: QMessageBox.critical(self, "Error", message))
+        self.auto_label_btn.setEnabled(False)
+        self.auto_label_thread.finished.connect(lambda: self.auto_label_btn.setEnabled(True))
+        self.auto_label_thread.start()
+
+    def on_auto_label_done(self, result):
+        positions, classes = result
+        # Rows labelled in the grid while scoring keep their label
+        unlabelled = self.label_store.unlabelled(positions)
+        positions = positions[unlabelled]
+        classes = [row_classes for row_classes, keep in zip(classes, unlabelled) if keep]
+        self._set_labels(self.df.index[positions], classes)
+        self.unlabelled_positions = self.label_store.unlabelled_positions()
+        self.page_start = 0
+        self.load_page()
+
+    def closeEvent(self, event):
+        if self.auto_label_thread and self.auto_label_thread.isRunning():
+            self.auto_label_thread.wait()
+        for thread in [self.page_scoring_thread] + self.retired_scoring_threads:
+            if thread and thread.isRunning():
+                thread.wait()
+        self.save_pipeline.flush()
+        self.database_writer.update_disk_size(self.project_data.task_uuid, os.path.dirname(self.project_data.file_path))
+        self.database_writer.stop()
+        self.session.close()
+        if self.source_rows is not None:
+            self.source_rows.close()
+        if self.synonym_index_key is not None:
+            shared_resources.release(self.synonym_index_key)
+            self.synonym_index_key = None
+        self.label_log.close()
+        save_session_profile(os.path.dirname(self.project_data.file_path))
+        super().closeEvent(event)
@@ -1,115 +1,206 @@
+import collections
 import datetime
 import os
 import json
 import threading
+import time
 
 import matplotlib
 import numpy as np
 import pandas as pd
-from PyQt6.QtCore import QThread, pyqtSignal, QEvent, QTimer
-from PyQt6.QtWidgets import QMainWindow, QVBoxLayout, QLabel, QTextEdit, QGridLayout, QPushButton, QWidget, \
-    QApplication, QCheckBox
-from PyQt6.QtGui import QKeyEvent
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from matplotlib import cm
-
+from PyQt6.QtCore import Qt, QObject, QThread, pyqtSignal, QEvent, QTimer, QFileSystemWatcher
+from PyQt6.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QGridLayout, QPushButton, QWidget, \
+    QApplication, QCheckBox, QLineEdit, QListWidget, QPlainTextEdit
+from PyQt6.QtGui import QKeyEvent, QColor, QTextCursor
+
+from core.artifacts import ArtifactStore
+from core.class_palette import ClassPaletteIndex
+from core.ingest import read_inputs, INPUTS_FILE_NAME
+from core.label_log import LabelLog
+from core.label_store import LabelStore, split_labels, join_labels, label_names, compact_columns, memory_report, \
+    save_memory_report, MEMORY_REPORT_FILE_NAME
+from core.persistence import LabelJournal, atomic_write_csv
+from core.profiling import save_session_profile
+from core.resource_pool import shared_resources
+from core.sharding import ShardManager
+from core.source_rows import SourceRows, row_offsets_path, open_input_rows
+from core.suggestion_cache import SuggestionCache, SUGGESTION_CACHE_FILE_NAME
+from core.synonym_index import SynonymIndex, task_document_frequencies, index_fingerprint
+from core.task_files import directory_size
 from models import Task
 
 
 class TextProcessingThread(QThread):
     """
     QThread that performs text processing.
-    It calculates cosine similarity between the description of a task and a list of synonyms for each class.
+    It looks for the synonyms of each class in the description of a task and, if none occurs word for word,
+    calculates the cosine similarity between the description and the synonyms, using the window's SynonymIndex.
     The results are then emitted via a PyQt signal.
     """
 
-    # Define a signal that will be emitted with the results of the text processing
-    result_signal = pyqtSignal(dict)
+    # Define a signal that will be emitted with the class scores, the subcategory scores and the exact synonym matches
+    result_signal = pyqtSignal(dict, dict, list)
 
-    def __init__(self, class_synonyms, description):
+    def __init__(self, synonym_index, description, subcategory_threshold=0.0, suggestion_cache=None):
         super().__init__()
-        # Store the class synonyms and description as instance variables
-        self.class_synonyms = class_synonyms
+        # Store the synonym index and description as instance variables
+        self.synonym_index = synonym_index
         self.description = description
-        # Initialize a TF-IDF vectorizer
-        self.tfidf_vectorizer = TfidfVectorizer()
+        self.subcategory_threshold = subcategory_threshold
+        self.suggestion_cache = suggestion_cache
 
     def run(self):
         """
-        Calculates cosine similarity between the description and class synonyms.
+        Scores the description against the class synonyms.
         Emits the result_signal with the results when done.
         """
-
-        results = {}
-
-        # For each class and its synonyms...
-        for class_name, synonyms in self.class_synonyms.items():
-            # If synonyms is a dict, we calculate nested similarities
-            if isinstance(synonyms, dict):
-                nested_similarities = []
-                for sub_class_name, sub_synonyms in synonyms.items():
-                    similarity = self.calculate_similarity(sub_synonyms)
-                    if similarity is not None:
-                        nested_similarities.append(similarity)
-                if len(nested_similarities) == len(synonyms):
-                    results[class_name] = min(nested_similarities)
-            else:
-                # If synonyms is not a dict, we just calculate similarity
-                similarity = self.calculate_similarity(synonyms)
-                if similarity is not None:
-                    results[class_name] = similarity
+        if self.suggestion_cache is not None:
+            results, subcategory_results, matches = self.suggestion_cache.suggest(
+                self.synonym_index, self.description, self.subcategory_threshold)
+        else:
+            results, subcategory_results, matches = self.synonym_index.suggest(self.description,
+                                                                              self.subcategory_threshold)
 
         # Emit the results
-        self.result_signal.emit(results)
+        self.result_signal.emit(results, subcategory_results, matches)
 
-    def calculate_similarity(self, synonyms):
-        """
-        Calculate the cosine similarity between the description and the synonyms.
-        """
 
-        # Create a corpus with the synonyms and the description
-        corpus = synonyms + [self.description]
-        # Generate TF-IDF vectors for the corpus
-        tfidf_matrix = self.tfidf_vectorizer.fit_transform(corpus)
-        # Separate the description vector from the synonyms vectors
-        description_vector = tfidf_matrix[-1]
-        synonyms_vectors = tfidf_matrix[:-1]
-        # Calculate and return the average cosine similarity
-        return cosine_similarity(description_vector, synonyms_vectors).mean()
+class SourceRowsThread(QThread):
+    """
+    QThread that indexes the rows of the inputs of a task, its original CSV file and the files appended to it, so
+    the context columns of a sample can be read from them without blocking the window on a large file. The indexes
+    are kept in the task's ArtifactStore if given. Emits an InputRows.
+    """
+    ready_signal = pyqtSignal(object)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, inputs, file_path, store=None):
+        super().__init__()
+        self.inputs = inputs
+        self.file_path = file_path
+        self.store = store
+
+    def run(self):
+        try:
+            self.ready_signal.emit(open_input_rows(self.inputs, self.file_path, self.store))
+        except (OSError, UnicodeDecodeError) as e:
+            self.error_signal.emit(str(e))
 
 
-class DatabaseUpdateThread(QThread):
+class SynonymsWatcher(QObject):
     """
-    QThread that performs database updates.
-    A signal is emitted when the update is done.
+    Watches a task's synonyms.json and applies changes to its SynonymIndex while the task is open.
+    The index may be shared with the windows of other tasks, changes are applied to a copy of it which replaces
+    synonym_index. Only the classes whose synonyms changed are rebuilt, synonyms_changed is emitted with what
+    SynonymIndex.update returned. Writes are debounced, and a file that is not valid JSON yet (e.g. half saved) is
+    ignored until the next change.
     """
 
-    # Define a signal that will be emitted when the database update is done
+    synonyms_changed = pyqtSignal(dict)
+
+    def __init__(self, file_path, synonym_index, debounce_ms=300):
+        super().__init__()
+        self.file_path = file_path
+        self.synonym_index = synonym_index
+        self.watcher = QFileSystemWatcher([file_path])
+        self.watcher.fileChanged.connect(self.on_file_changed)
+        self.debounce_timer = QTimer()
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.reload)
+
+    def on_file_changed(self, path):
+        # Editors that save by replacing the file remove it from the watcher
+        if path not in self.watcher.files() and os.path.exists(path):
+            self.watcher.addPath(path)
+        self.debounce_timer.start()
+
+    def reload(self):
+        try:
+            with open(self.file_path) as f:
+                class_synonyms = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Could not reload synonyms:", e)
+            return
+        synonym_index = self.synonym_index.copy()
+        changed = synonym_index.update(class_synonyms)
+        if changed:
+            self.synonym_index = synonym_index
+            self.synonyms_changed.emit(changed)
+
+
+class DatabaseWriterThread(QThread):
+    """
+    QThread that owns its own database session and performs all background database updates.
+    Progress and disk size updates are queued from the GUI thread and coalesced, only the latest value for each task
+    is committed, at most once every interval_ms milliseconds. Task directories are measured on this thread too.
+    A signal is emitted after each commit.
+    """
+
+    # Define a signal that will be emitted when a database update is done
     done = pyqtSignal()
 
-    def __init__(self, session, project_data, current_index):
+    def __init__(self, Session, interval_ms=300):
         super().__init__()
 
-        # Store the session, project data, and current index as instance variables
-        self.session = session
-        self.project_data = project_data
-        self.current_index = current_index
+        self.Session = Session
+        self.interval = interval_ms / 1000
+        self.pending_progress = {}
+        self.pending_sizes = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
 
-    def run(self):
+    def update_progress(self, task_uuid, labelled_samples):
+        """
+        Queue the number of labelled samples of a task, replacing any value not yet written. Called from the GUI
+        thread, never blocks on the database.
         """
-        Updates the number of labelled samples in the project data and commits the changes to the session.
-        Emits the done signal when finished.
+        with self.lock:
+            # implicit conversion to int otherwise it gets stored and returned as bytes
+            # believe it is something to do with how a pandas dataframe index works
+            self.pending_progress[task_uuid] = int(labelled_samples)
+
+    def update_disk_size(self, task_uuid, task_directory):
+        """
+        Queue measuring the size in bytes of a task's directory, shown on the start screen without walking the file
+        system. The directory is walked on the writer thread, a large task does not stall the GUI thread.
         """
+        with self.lock:
+            self.pending_sizes[task_uuid] = task_directory
 
-        # Update the number of labelled samples in the project data
-        # implicit conversion to int otherwise it gets stored and returned as bytes
-        # believe it is something to do with how a pandas dataframe index works
-        self.project_data.labelled_samples = int(self.current_index)
+    def stop(self):
+        """
+        Write any queued updates and stop the thread.
+        """
+        self.stop_event.set()
+        self.wait()
 
-        # Add the updated project data to the session and commit the changes
-        self.session.add(self.project_data)
-        self.session.commit()
+    def run(self):
+        session = self.Session()
+        try:
+            while not self.stop_event.wait(self.interval):
+                self._write_pending(session)
+            self._write_pending(session)
+        finally:
+            session.close()
+
+    def _write_pending(self, session):
+        with self.lock:
+            pending_progress, self.pending_progress = self.pending_progress, {}
+            pending_sizes, self.pending_sizes = self.pending_sizes, {}
+        if not pending_progress and not pending_sizes:
+            return
+        try:
+            for task_uuid, labelled_samples in pending_progress.items():
+                session.query(Task).filter_by(task_uuid=task_uuid).update({Task.labelled_samples: labelled_samples})
+            for task_uuid, task_directory in pending_sizes.items():
+                session.query(Task).filter_by(task_uuid=task_uuid).update(
+                    {Task.disk_size: directory_size(task_directory)})
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print("Failed to update database:", e)
+            return
 
         # Emit the done signal
         self.done.emit()
@@ -117,31 +208,208 @@ class DatabaseUpdateThread(QThread):
 
 class FileSavingThread(QThread):
     """
-    QThread that saves the DataFrame to a CSV file.
+    QThread that saves labels to disk.
+    The labels of the rows changed since the previous save are appended to the task's label journal, and when a
+    snapshot of the DataFrame is given it is atomically written to the CSV file and the journal is emptied.
     A signal is emitted when the file saving operation is done.
     """
 
     # signal that will be emitted when the file saving operation is done
     done = pyqtSignal()
+    error_signal = pyqtSignal(str)
 
-    def __init__(self, df, file_path):
+    def __init__(self, df, file_path, journal=None, labels=None):
         super().__init__()
 
         self.df = df
         self.file_path = file_path
+        self.journal = journal
+        self.labels = labels or {}
 
     def run(self):
         """
-        Saves the DataFrame to a CSV file and emits the done signal when finished.
+        Saves the labels and emits the done signal when finished.
         """
-
-        # Save the DataFrame to a CSV file
-        self.df.to_csv(self.file_path, index=False)
+        try:
+            if self.journal is not None:
+                self.journal.append(self.labels)
+            if self.df is not None:
+                # Save the DataFrame to a CSV file
+                atomic_write_csv(self.df, self.file_path)
+                if self.journal is not None:
+                    self.journal.truncate()
+        except Exception as e:
+            self.error_signal.emit(str(e))
+            return
 
         # Emit the done signal
         self.done.emit()
 
 
+class SavePipeline(QObject):
+    """
+    Runs the saves of a task in the background, one at a time.
+    A save requested while another one is running is coalesced into a single follow-up save, which picks up
+    every row changed in the meantime. Saves normally only journal the dirty rows, the full CSV is rewritten
+    when compacting explicitly or once the journal grows past compact_threshold rows.
+    An annotator labelling a shard passes their own journal_path, their labels are never compacted into the CSV,
+    the shard merge does that.
+    """
+
+    saved = pyqtSignal()
+
+    def __init__(self, label_store, file_path, compact_threshold=10000, journal_path=None):
+        super().__init__()
+        self.label_store = label_store
+        self.file_path = file_path
+        self.compact_threshold = compact_threshold
+        self.canonical = journal_path is None
+        if journal_path is None:
+            journal_path = os.path.join(os.path.dirname(file_path), 'labels.journal')
+        self.journal = LabelJournal(journal_path)
+        self.file_saving_thread = None
+        self.pending = False
+        self.pending_compact = False
+
+    def replay_journal(self):
+        """
+        Apply the labels journaled since data.csv was last written.
+        """
+        self.label_store.apply_labels(self.journal.replay())
+
+    def request_save(self, compact=False):
+        self.pending_compact = self.pending_compact or compact
+        if self.file_saving_thread and self.file_saving_thread.isRunning():
+            self.pending = True
+            return
+        self._start_file_saving_thread()
+
+    def flush(self, compact=True):
+        """
+        Save everything synchronously, used when the window closes.
+        """
+        if self.file_saving_thread:
+            self.file_saving_thread.wait()
+        self.pending_compact = self.pending_compact or compact
+        self._start_file_saving_thread()
+        if self.file_saving_thread:
+            self.file_saving_thread.wait()
+
+    def _start_file_saving_thread(self):
+        labels = self.label_store.take_dirty_labels()
+        compact = self.canonical and (self.pending_compact or
+                                      self.journal.entries + len(labels) > self.compact_threshold)
+        self.pending = self.pending_compact = False
+        if not labels and not compact:
+            return
+        # Snapshots are taken on the GUI thread so the worker never reads labels that are being changed
+        snapshot = self.label_store.snapshot() if compact else None
+        self.file_saving_thread = FileSavingThread(snapshot, self.file_path, self.journal, labels)
+        self.file_saving_thread.done.connect(self.on_save_done)
+        self.file_saving_thread.error_signal.connect(self.on_save_error)
+        self.file_saving_thread.start()
+
+    def on_save_done(self):
+        self.saved.emit()
+        if self.pending:
+            self._start_file_saving_thread()
+
+    def on_save_error(self, error_message):
+        print("Failed to save labels:", error_message)
+        # Keep the rows dirty so the next save retries them
+        self.label_store.dirty.update(self.sender().labels.keys())
+        if self.pending:
+            self._start_file_saving_thread()
+
+
+class KeyCommandQueue(QObject):
+    """
+    Runs the labelling commands typed on the keyboard in order, and redraws the window once for all the commands
+    typed in a pass of the event loop.
+    Commands only change the labels and the selection in memory, the slow part of moving to another sample, showing
+    its text and context and starting its scoring, is requested with request_render and done once the keys already
+    in the event queue were handled, so typing quickly or holding a key never queues a stall per key.
+    An auto-repeated key is dropped while the sample of its previous repeat is not shown yet, or until
+    repeat_interval_ms passed since that repeat, so holding a key moves at most a sample a frame.
+    """
+
+    def __init__(self, render, repeat_interval_ms=16):
+        super().__init__()
+        self.pending = collections.deque()
+        self.running = False
+        self.repeat_interval = repeat_interval_ms / 1000
+        self.last_repeat = None
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(0)
+        self.render_timer.timeout.connect(render)
+
+    def push(self, command, auto_repeat=False):
+        """
+        Queue a command and run the queued commands. Returns False if an auto-repeated command was dropped.
+        """
+        if auto_repeat:
+            now = time.monotonic()
+            if self.render_pending() or (self.last_repeat is not None and
+                                         now - self.last_repeat < self.repeat_interval):
+                return False
+            self.last_repeat = now
+        self.pending.append(command)
+        # A command opening a dialog runs the event loop, the keys typed meanwhile wait for it
+        if not self.running:
+            self.running = True
+            try:
+                while self.pending:
+                    self.pending.popleft()()
+            finally:
+                self.running = False
+        return True
+
+    def request_render(self):
+        self.render_timer.start()
+
+    def render_pending(self):
+        return self.render_timer.isActive()
+
+    def stop(self):
+        self.pending.clear()
+        self.render_timer.stop()
+
+
+def task_idf(project_data):
+    """
+    Return the IDF weights of a task weighting its suggestions by IDF, None otherwise. The document frequencies are
+    counted when the task is created, tasks missing them are counted on first use.
+    """
+    if not project_data.idf_weighting:
+        return None
+    store = ArtifactStore(os.path.dirname(project_data.file_path))
+    return task_document_frequencies(project_data, store).idf()
+
+
+def acquire_synonym_index(project_data):
+    """
+    Return the key and the SynonymIndex of a task's synonyms, shared with the open windows of every task with the
+    same synonyms and IDF weights. Release the key with shared_resources.release when the window closes.
+    """
+    with open(project_data.synonyms_file_path) as f:
+        class_synonyms = json.load(f)
+    idf = task_idf(project_data)
+    key = ('synonym_index', index_fingerprint(class_synonyms, idf=idf))
+    return key, shared_resources.acquire(key, lambda: SynonymIndex(class_synonyms, idf=idf))
+
+
+def share_synonym_index(key, synonym_index):
+    """
+    Swap the shared index held under key for an updated copy of it, returning the new key and index. The index of
+    another window is returned if it already has the same content.
+    """
+    new_key = ('synonym_index', synonym_index.fingerprint)
+    synonym_index = shared_resources.acquire(new_key, lambda: synonym_index)
+    shared_resources.release(key)
+    return new_key, synonym_index
+
+
 def contrast_color(color):
     color = color[1:]
     r, g, b = int(color[:2], 16), int(color[2:4], 16), int(color[4:], 16)
@@ -152,19 +420,31 @@ class LabelingProjectWindow(QMainWindow):
     """
     This class represents the main window of the labeling project. It includes various UI elements and methods to manage
     the labeling process.
+    When an annotator name is given, the window leases one shard of the task and labels only its rows, saving to the
+    annotator's own journal. See core.sharding.ShardManager.
+    For tasks with hierarchical labels, picking a class with subcategories shows its subcategory buttons, whose
+    shortcuts replace the class shortcuts until one is picked or Escape is pressed.
+    Classes beyond the shortcut keys are reached with the class palette: '/' opens it, typing filters the classes by
+    name and synonyms, and Enter picks the best match.
     """
 
-    # Define the key map for class button shortcuts
+    # Define the key map for class button shortcuts, the first classes get a key and every class is in the palette
     key_map = ['1', '2', '3', '4', '5', 'q', 'w', 'e', 'r', 't', 'a', 's', 'd', 'f', 'g', 'z', 'x', 'c', 'v', 'b']
 
-    def __init__(self, Session, project_uuid):
+    def __init__(self, Session, project_uuid, annotator=None):
         super().__init__()
-
-        # Install the event filter to catch key press events at the application level
-        QApplication.instance().installEventFilter(self)
+        # Refused before anything is opened for the window
+        if annotator is not None:
+            ShardManager.validate_annotator(annotator)
 
         # Initialize threads and session
         self.text_processing_thread = None
+        # Index of the sample scored by text_processing_thread, None once it moved to another one
+        self.scored_index = None
+        # Scoring threads of samples moved away from, left to finish instead of being waited for
+        self.retired_threads = []
+        # Keys are run as commands from the queue, which shows the sample they moved to once they ran
+        self.key_commands = KeyCommandQueue(self._show_sample_view)
         self.session = Session()
         session = Session()
 
@@ -172,50 +452,129 @@ class LabelingProjectWindow(QMainWindow):
         self.project_data = self.session.query(Task).filter_by(task_uuid=project_uuid).first()
         session.close()
 
-        # Generate colors for class buttons
+        # The labels are parsed once, with the position of each label for lookups by name
+        self.labels = self.project_data.get_labels_list()
+        self.label_positions = {label: i for i, label in enumerate(self.labels)}
+        # The field labelled, and the columns of the original file shown as context for each sample
+        self.field = self.project_data.field_to_label
+        self.context_columns = self.project_data.get_context_columns_list()
+        self.source_rows = None
+        self.source_rows_thread = None
+
+        # Generate colors for class buttons, and their stylesheets when checked and unchecked
         self.colors = self._generate_colors()
+        self.checked_styles = [f"background-color: black; color: {color}; font-weight: bold" for color in self.colors]
+        self.unchecked_styles = [f"background-color: {color}; color: {contrast_color(color)}; font-weight: bold"
+                                 for color in self.colors]
 
         # Load data for labeling from CSV file
         self.df = pd.read_csv(self.project_data.file_path)
-
-        # Add a new column for labels if it does not exist
-        if self.project_data.label_column_name not in self.df.columns:
-            self.df[self.project_data.label_column_name] = None
-
-        # Find the first index where the label is null (i.e., the first unlabeled sample)
-        self.current_index = self.df[self.df[self.project_data.label_column_name].isnull()].first_valid_index()
-
-        # Load class synonyms from JSON file
-        with open(self.project_data.synonyms_file_path) as f:
-            self.class_synonyms = json.load(f)
-
-        # Initialize list of selected classes and the database update thread
+        self.label_store = LabelStore(self.df, self.project_data.label_column_name, class_count=len(self.labels))
+        compact_columns(self.df, exclude=[self.field])
+
+        task_directory = os.path.dirname(self.project_data.file_path)
+        self.memory_report = memory_report(self.label_store)
+        save_memory_report(self.memory_report, os.path.join(task_directory, MEMORY_REPORT_FILE_NAME))
+        print(f"Task data takes {self.memory_report['total']} bytes in memory, "
+              f"labels {self.memory_report['labels']} bytes ({self.memory_report['label_dtype']} per row)")
+        self.annotator = annotator
+        self.shard_manager = None
+        self.shard_lease = None
+        journal_path = None
+        label_log_name = 'label_log.jsonl'
+        if annotator is not None:
+            self.shard_manager = ShardManager(task_directory)
+            self.shard_lease = self.shard_manager.lease(annotator)
+            journal_path = self.shard_manager.journal_path(annotator)
+            label_log_name = f'label_log_{annotator}.jsonl'
+
+        # Background save pipeline, labels saved to the journal after data.csv was last written are replayed first
+        self.save_pipeline = SavePipeline(self.label_store, self.project_data.file_path, journal_path=journal_path)
+        self.save_pipeline.replay_journal()
+        self.save_pipeline.saved.connect(self.on_save_done)
+
+        # Positions of the unlabelled rows are found once, Next walks them with a cursor instead of rescanning
+        self.unlabelled_positions = self.label_store.unlabelled_positions()
+        if annotator is not None:
+            self.unlabelled_positions = self._shard_positions()
+        self.unlabelled_cursor = 0
+        self.labelled_count = len(self.df) - len(self.unlabelled_positions)
+
+        # Find the first unlabeled sample
+        self.current_index = self._next_unlabelled_index()
+
+        # Operation log of label changes for undo/redo and going back to previous samples
+        self.label_log = LabelLog(os.path.join(task_directory, label_log_name), background=True)
+        # Sequence number of the operation being browsed with 'Previous', and where browsing started
+        self.history_position = None
+        self.history_end = None
+
+        # Load class synonyms from JSON file and index them, changes to the file are applied while labelling. Tasks
+        # with the same synonyms share their index.
+        self.synonym_index_key, self.synonym_index = acquire_synonym_index(self.project_data)
+        self.synonyms_watcher = SynonymsWatcher(self.project_data.synonyms_file_path, self.synonym_index)
+        self.synonyms_watcher.synonyms_changed.connect(self.on_synonyms_changed)
+        # Suggestions of descriptions seen before, in this or an earlier session, are reused
+        self.suggestion_cache = SuggestionCache(os.path.join(task_directory, SUGGESTION_CACHE_FILE_NAME))
+        self.suggestion_cache.prune(self.synonym_index.fingerprint)
+        # Classes selected automatically from the suggestion of the current sample
+        self.suggested_classes = None
+        # Scores of the current sample, used to rank the class palette
+        self.class_scores = {}
+        self.palette_index = ClassPaletteIndex(self.labels, self.synonym_index.class_synonyms)
+
+        # Initialize list of selected classes and start the database writer, it uses its own session
         self.selected_classes = []
-        self.database_update_thread = None
+        # Subcategory picked for each selected class, and the class whose subcategory buttons are shown
+        self.selected_subcategories = {}
+        self.subcategory_parent = None
+        self.database_writer = DatabaseWriterThread(Session)
+        self.database_writer.done.connect(self.on_database_update_done)
+        self.database_writer.start()
+
+        # Rows of the original file are read through the row offsets index kept in the task's artifacts. A task
+        # reading its field from the original file needs them for the first sample, the index was built with the
+        # task. Otherwise the context of the shown sample is filled in once the index is loaded in the background.
+        store = ArtifactStore(task_directory)
+        if self.project_data.field_in_source:
+            self.source_rows = SourceRows(self.project_data.source_file_path,
+                                          row_offsets_path(store, self.project_data.source_file_path))
+        elif self.context_columns and not self._context_in_task() and self.project_data.source_file_path:
+            # Rows appended to the task come from other inputs, listed in inputs.json
+            inputs_path = os.path.join(task_directory, INPUTS_FILE_NAME)
+            inputs = read_inputs(inputs_path, self.project_data.file_path, self.project_data.label_column_name) \
+                if os.path.exists(inputs_path) else [{'path': None, 'first_row': 0, 'rows': len(self.df)}]
+            self.source_rows_thread = SourceRowsThread(inputs, self.project_data.source_file_path, store)
+            self.source_rows_thread.ready_signal.connect(self.on_source_rows_ready)
+            self.source_rows_thread.error_signal.connect(self.on_source_rows_error)
 
         # Setup user interface
         self.initUI()
+        if self.source_rows_thread is not None:
+            self.source_rows_thread.start()
 
-        # Initialize file saving thread and autosave timer
-        self.file_saving_thread = None
+        # Initialize autosave timer
         self.autosave_timer = QTimer()
         self.autosave_timer.timeout.connect(self.autosave)
         self.autosave_enabled = False  # Autosave is disabled by default
         self.changes_made = False  # No changes have been made yet
 
-    def _generate_colors(self):
-        num_labels = len(self.project_data.get_labels_list())
-        colors = cm.get_cmap('hsv', num_labels)
-        colors = [colors(i) for i in np.linspace(0, 1, num_labels)]
-        colors = [matplotlib.colors.rgb2hex(c) for c in colors]
-        return colors
+        # Keep the shard lease alive while labelling
+        self.lease_timer = QTimer()
+        self.lease_timer.timeout.connect(self.renew_shard_lease)
+        if self.shard_lease is not None:
+            self.lease_timer.start(self.shard_manager.lease_seconds * 1000 // 2)
+
+        # Install the event filter to catch key press events at the application level, once the window is built so a
+        # window that failed to open does not keep receiving them
+        QApplication.instance().installEventFilter(self)
 
     def _generate_colors(self):
         """
         Generate a list of color codes for class buttons. The number of colors generated is equal to the number of labels.
         """
-        num_labels = len(self.project_data.get_labels_list())
-        colors = cm.get_cmap('hsv', num_labels)
+        num_labels = len(self.labels)
+        colors = matplotlib.colormaps['hsv'].resampled(num_labels)
         colors = [colors(i) for i in np.linspace(0, 1, num_labels)]
         colors = [matplotlib.colors.rgb2hex(c) for c in colors]
         return colors
@@ -231,13 +590,29 @@ class LabelingProjectWindow(QMainWindow):
         layout.addWidget(self.labelled_samples_count_label)
 
         # Setup for description text edit box
-        layout.addWidget(QLabel("Description"))
-        self.description_edit = QTextEdit()
+        layout.addWidget(QLabel(self.field))
+        # Plain text with incremental layout, long samples are shown a display_limit characters at a time
+        self.description_edit = QPlainTextEdit()
         self.description_edit.setReadOnly(True)
         layout.addWidget(self.description_edit)
+        self.load_more_btn = QPushButton()
+        self.load_more_btn.clicked.connect(self.on_load_more_button_clicked)
+        self.load_more_btn.hide()
+        layout.addWidget(self.load_more_btn)
+        self.description_text = ""
+        self.description_shown = 0
+
+        # Setup for the context columns, read from the original file
+        self.context_label = QLabel("Context")
+        layout.addWidget(self.context_label)
+        self.context_edit = QPlainTextEdit()
+        self.context_edit.setReadOnly(True)
+        layout.addWidget(self.context_edit)
+        self.context_label.setVisible(bool(self.context_columns))
+        self.context_edit.setVisible(bool(self.context_columns))
 
         # Setup for TF-IDF results text edit box
-        layout.addWidget(QLabel("TF-IDF Results"))
+        layout.addWidget(QLabel("Suggestions"))
         self.tfidf_results_edit = QTextEdit()
         self.tfidf_results_edit.setReadOnly(True)
         layout.addWidget(self.tfidf_results_edit)
@@ -248,15 +623,47 @@ class LabelingProjectWindow(QMainWindow):
         self.selected_classes_edit.setReadOnly(True)
         layout.addWidget(self.selected_classes_edit)
 
+        # Setup for the class palette
+        self.palette_edit = QLineEdit()
+        self.palette_edit.setPlaceholderText("Find a class - /")
+        self.palette_edit.textChanged.connect(self.update_palette)
+        layout.addWidget(self.palette_edit)
+        self.palette_list = QListWidget()
+        self.palette_list.itemActivated.connect(lambda item: self.pick_palette_class())
+        self.palette_list.hide()
+        layout.addWidget(self.palette_list)
+        self.palette_open = False
+        self.palette_matches = []
+
         # Setup for class buttons
         layout.addWidget(QLabel("Class Buttons"))
         layout.addLayout(self._create_class_buttons())
 
+        # Setup for subcategory buttons, filled when a class with subcategories is picked
+        self.subcategory_panel = QWidget()
+        self.subcategory_layout = QHBoxLayout(self.subcategory_panel)
+        self.subcategory_buttons = []
+        self.subcategory_panel.hide()
+        layout.addWidget(self.subcategory_panel)
+
         # Setup for 'Next' button
         next_btn = QPushButton('Next - Space')
         next_btn.clicked.connect(self.on_next_button_clicked)
         layout.addWidget(next_btn)
 
+        # Setup for history buttons
+        history_layout = QHBoxLayout()
+        previous_btn = QPushButton('Previous - Backspace')
+        previous_btn.clicked.connect(self.on_previous_button_clicked)
+        history_layout.addWidget(previous_btn)
+        undo_btn = QPushButton('Undo - Ctrl+Z')
+        undo_btn.clicked.connect(self.on_undo_button_clicked)
+        history_layout.addWidget(undo_btn)
+        redo_btn = QPushButton('Redo - Ctrl+Y')
+        redo_btn.clicked.connect(self.on_redo_button_clicked)
+        history_layout.addWidget(redo_btn)
+        layout.addLayout(history_layout)
+
         # Setup for 'Save' button
         save_btn = QPushButton('Save')
         save_btn.clicked.connect(self.on_save_button_clicked)
@@ -264,17 +671,15 @@ class LabelingProjectWindow(QMainWindow):
 
         # Setup for autosave checkbox
         layout.addWidget(QLabel("Autosave Checkbox"))
-        self.autosave_checkbox = QCheckBox("Autosave every 10 minutes")
+        self.autosave_checkbox = QCheckBox(f"Autosave every {self._autosave_interval()} minutes")
         self.autosave_checkbox.stateChanged.connect(self.toggle_autosave)
         layout.addWidget(self.autosave_checkbox)
 
         # Finalize UI setup
         central_widget = QWidget()
         central_widget.setLayout(layout)
-        self.description_edit.setText(self.df.loc[self.current_index, 'description'])
-        self.labelled_samples_count_label.setText(f"Number of labelled samples: {self.current_index}")
         self.setCentralWidget(central_widget)
-        self._start_text_processing_thread()
+        self._show_current_sample()
 
     def _create_class_buttons(self):
         """
@@ -282,119 +687,472 @@ class LabelingProjectWindow(QMainWindow):
         """
         grid = QGridLayout()
         self.class_buttons = []
-        for i, class_name in enumerate(self.project_data.get_labels_list()):
-            btn = QPushButton(f"{self.key_map[i]} - {class_name}")
-            btn.setStyleSheet(
-                f"background-color: {self.colors[i]}; color: {contrast_color(self.colors[i])}; font-weight: bold")
+        for i, class_name in enumerate(self.labels):
+            btn = QPushButton(f"{self.key_map[i]} - {class_name}" if i < len(self.key_map) else class_name)
+            btn.setStyleSheet(self.unchecked_styles[i])
             btn.setCheckable(True)
-            btn.clicked.connect(self.on_class_button_clicked)
+            btn.clicked.connect(lambda checked, i=i: self.on_class_button_clicked(i))
             self.class_buttons.append(btn)
             grid.addWidget(btn, i // 3, i % 3)
+        # Indices of the buttons currently styled as checked
+        self.styled_classes = set()
         return grid
 
-    def on_class_button_clicked(self):
+    def on_class_button_clicked(self, class_index):
         """
         Handler for class button click event. It updates the selected classes and changes the appearance of the clicked button.
         """
-        # Identify the button that was just clicked
-        clicked_button = self.sender()
-
-        if self.project_data.single_class:
-            # If single_class is True, deselect other buttons
-            for btn in self.class_buttons:
-                if btn is not clicked_button:
-                    btn.setChecked(False)
-        # Update selected classes
-        self.selected_classes = [i for i, btn in enumerate(self.class_buttons) if btn.isChecked()]
-
-        # Update button styles based on their selection status
-        for i, btn in enumerate(self.class_buttons):
-            if btn.isChecked():
-                btn.setStyleSheet(f"background-color: black; color: {self.colors[i]}; font-weight: bold")
-            else:
-                btn.setStyleSheet(
-                    f"background-color: {self.colors[i]}; color: {contrast_color(self.colors[i])}; font-weight: bold")
-        self.selected_classes_edit.setText(
-            ", ".join(self.project_data.get_labels_list()[i] for i in self.selected_classes))
+        checked = self.class_buttons[class_index].isChecked()
+        if checked and self.project_data.single_class:
+            # If single_class is True, deselect the other selected button
+            selected_classes = [class_index]
+        elif checked:
+            selected_classes = self.selected_classes + [class_index]
+        else:
+            selected_classes = [i for i in self.selected_classes if i != class_index]
+        self._set_selected_classes(selected_classes)
+
+        if checked and self.project_data.hierarchical_labels:
+            self._show_subcategory_buttons(class_index)
+        elif self.subcategory_parent == class_index or self.subcategory_parent not in self.selected_classes:
+            self._hide_subcategory_buttons()
+
+    def _show_subcategory_buttons(self, class_index):
+        """
+        Show the subcategory buttons of a class, if it has subcategories.
+        """
+        self._hide_subcategory_buttons()
+        class_name = self.labels[class_index]
+        names = self.synonym_index.subcategory_names(class_name)[:len(self.key_map)]
+        if not names:
+            return
+        self.subcategory_parent = class_index
+        for i, name in enumerate(names):
+            btn = QPushButton(f"{self.key_map[i]} - {class_name}/{name}")
+            btn.setCheckable(True)
+            btn.setChecked(self.selected_subcategories.get(class_index) == name)
+            btn.clicked.connect(lambda checked, name=name: self.on_subcategory_button_clicked(name, checked))
+            self.subcategory_layout.addWidget(btn)
+            self.subcategory_buttons.append(btn)
+        self.subcategory_panel.show()
+
+    def _hide_subcategory_buttons(self):
+        for btn in self.subcategory_buttons:
+            self.subcategory_layout.removeWidget(btn)
+            btn.deleteLater()
+        self.subcategory_buttons = []
+        self.subcategory_parent = None
+        self.subcategory_panel.hide()
+
+    def on_subcategory_button_clicked(self, name, checked):
+        """
+        Handler for a subcategory button. Picks (or clears) the subcategory of the class and returns to the class
+        buttons.
+        """
+        if checked:
+            self.selected_subcategories[self.subcategory_parent] = name
+        else:
+            self.selected_subcategories.pop(self.subcategory_parent, None)
+        self._hide_subcategory_buttons()
+        self._update_selected_classes()
+
+    def _current_label(self):
+        return join_labels(self.selected_classes, self.selected_subcategories)
+
+    def _set_selected_classes(self, selected_classes):
+        """
+        Select the given classes. Only the buttons whose state changes are touched, so the cost does not grow with
+        the number of classes.
+        """
+        selected = set(selected_classes)
+        previous = set(self.selected_classes)
+        for i in previous - selected:
+            self.class_buttons[i].setChecked(False)
+        for i in selected - previous:
+            self.class_buttons[i].setChecked(True)
+        self.selected_classes = sorted(selected)
+        self._update_selected_classes()
+
+    def _update_selected_classes(self):
+        """
+        Update the appearance of the class buttons and the selected classes text from the selected classes.
+        """
+        # A class that is no longer selected loses its subcategory
+        selected = set(self.selected_classes)
+        self.selected_subcategories = {i: name for i, name in self.selected_subcategories.items() if i in selected}
+
+        # Restyle only the buttons whose selection status changed, with the prebuilt stylesheets
+        for i in selected ^ self.styled_classes:
+            self.class_buttons[i].setStyleSheet(self.checked_styles[i] if i in selected else self.unchecked_styles[i])
+        self.styled_classes = selected
+        self.selected_classes_edit.setText(", ".join(label_names(self._current_label(), self.labels)))
 
     def on_next_button_clicked(self):
         """
-        Handler for 'Next' button click event. It saves the current label, loads the next unlabeled sample,
-        and starts the text processing and database update threads.
+        Handler for 'Next' button click event. It saves the current label, loads the next sample,
+        starts the text processing thread and queues a progress update for the database writer.
+        When browsing back through previous samples, Next moves forward through them before returning to the
+        unlabelled ones.
         """
-        self.df.loc[self.current_index, self.project_data.label_column_name] = str(self.selected_classes)
-        next_indices = self.df[self.df[self.project_data.label_column_name].isnull()].index
-        if len(next_indices) > 0:
-            self.current_index = next_indices[0]
-            self.description_edit.setText(self.df.loc[self.current_index, 'description'])
-            self._start_database_update_thread()
-            self._start_text_processing_thread()
-            self.changes_made = True
+        if self.current_index is None:
+            return
+        recorded = self._record_label(self.current_index, self._current_label())
+
+        operation = None
+        if self.history_position is not None and self.history_position + 1 < self.history_end:
+            self.history_position += 1
+            operation = self.label_log.get(self.history_position)
+        if operation is not None:
+            self.current_index = operation.first_index
+            self._show_current_sample(self.label_store.get(self.current_index))
+        else:
+            self.history_position = None
+            self.current_index = self._next_unlabelled_index()
+            self._show_current_sample()
+
+        if recorded:
+            self._queue_progress_update()
+            if self.labelled_count % 10 == 0:
+                self.save_changes()
 
+    def on_previous_button_clicked(self):
+        """
+        Handler for the 'Previous' button. Goes back to the sample labelled before the current one, O(1) from the
+        operation log.
+        """
+        if self.history_position is None:
+            position = self.history_end = self.label_log.count
         else:
-            self.description_edit.setText("No more unlabelled records.")
-        self.labelled_samples_count_label.setText(f"Number of labelled samples: {self.current_index}")
-        self.selected_classes = []
-        for btn in self.class_buttons:
-            btn.setChecked(False)
-            btn.setStyleSheet(btn.styleSheet().replace("background-color: black",
-                                                       f"background-color: {self.colors[self.class_buttons.index(btn)]}"))
-        if self.current_index % 10 == 0:
-            self.df.to_csv(self.project_data.file_path, index=False)
+            position = self.history_position
+        operation = self.label_log.get(position - 1)
+        if operation is None:
+            return
+        self.history_position = position - 1
+        self.current_index = operation.first_index
+        self._show_current_sample(self.label_store.get(self.current_index))
+
+    def on_undo_button_clicked(self):
+        """
+        Handler for the 'Undo' button. Reverts the most recent label change and shows that sample again. A batch
+        made in the grid window is reverted as a whole, its first row is shown.
+        """
+        operation = self.label_log.undo()
+        if operation is None:
+            return
+        for index, old, new in operation.rows():
+            self._apply_label(index, new, old)
+        self._queue_progress_update()
+        self.history_position = None
+        self.current_index = operation.first_index
+        self._show_current_sample(self.label_store.get(self.current_index))
+
+    def on_redo_button_clicked(self):
+        """
+        Handler for the 'Redo' button. Applies the most recently undone label change again.
+        """
+        operation = self.label_log.redo()
+        if operation is None:
+            return
+        for index, old, new in operation.rows():
+            self._apply_label(index, old, new)
+        self._queue_progress_update()
+        self.history_position = None
+        self.current_index = self._next_unlabelled_index()
+        self._show_current_sample()
+
+    def _record_label(self, index, classes):
+        """
+        Store the label of a sample and append the change to the operation log.
+        Returns False if the label did not change.
+        """
+        old = self.label_store.get(index)
+        classes = list(classes)
+        if old == classes:
+            return False
+        self._apply_label(index, old, classes)
+        self.label_log.record(index, old, classes)
+        return True
+
+    def _apply_label(self, index, old, new):
+        self.label_store.set(index, new)
+        self.labelled_count += (new is not None) - (old is not None)
+        self.changes_made = True
+        if new is None and old is not None:
+            self._reopen(index)
+
+    def _reopen(self, index):
+        """
+        Move the cursor back to a row made unlabelled again, e.g. by an undo, so Next returns to it.
+        """
+        position = self.df.index.get_loc(index)
+        i = int(np.searchsorted(self.unlabelled_positions, position))
+        if i == len(self.unlabelled_positions) or self.unlabelled_positions[i] != position:
+            # A row that was labelled when the task was opened
+            self.unlabelled_positions = np.insert(self.unlabelled_positions, i, position)
+        self.unlabelled_cursor = min(self.unlabelled_cursor, i)
+
+    def _next_unlabelled_index(self):
+        """
+        Return the index of the next unlabelled sample, advancing the cursor past rows labelled since loading.
+        """
+        while self.unlabelled_cursor < len(self.unlabelled_positions):
+            index = self.df.index[self.unlabelled_positions[self.unlabelled_cursor]]
+            if self.label_store.get(index) is None:
+                return index
+            self.unlabelled_cursor += 1
+        return None
+
+    def _show_current_sample(self, selected_classes=None):
+        """
+        Display the current sample with the given classes selected, and start computing its suggestions.
+        Within a key command only the selection is changed, the sample is shown once the queued keys ran.
+        """
+        selected_classes, self.selected_subcategories = split_labels(selected_classes)
+        self._hide_subcategory_buttons()
+        self._set_selected_classes(selected_classes)
+        self.suggested_classes = None
+        self.class_scores = {}
+        # The suggestions of the previous sample must not reach this one
+        self._retire_text_processing_thread()
+        if self.key_commands.running:
+            self.key_commands.request_render()
+            return
+        self._show_sample_view()
+
+    def _show_sample_view(self):
+        """
+        Show the text, the context and the number of labelled samples for the current sample, and start scoring it.
+        """
+        self.labelled_samples_count_label.setText(f"Number of labelled samples: {self.labelled_count}")
+        self.description_edit.setExtraSelections([])
+
+        if self.current_index is None:
+            self._set_description("No more unlabelled records.")
+            self._show_context()
+            return
+        self._set_description(self._sample_text(self.current_index))
+        self._show_context()
+        self._start_text_processing_thread()
+
+    def _sample_text(self, index):
+        if self.project_data.field_in_source:
+            return self.source_rows.value(self.df.index.get_loc(index), self.field)
+        return self.df.loc[index, self.field]
+
+    def _show_context(self):
+        """
+        Show the context columns of the current sample, from the task if they were copied into it and from its row
+        of the original file otherwise.
+        """
+        if not self.context_columns:
+            return
+        if self.current_index is None:
+            self.context_edit.setPlainText("")
+            return
+        if self._context_in_task():
+            row = {column: self.df.loc[self.current_index, column] for column in self.context_columns}
+            self.context_edit.setPlainText("\n".join(f"{column}: {'' if pd.isnull(value) else value}"
+                                                     for column, value in row.items()))
+            return
+        if self.source_rows is None:
+            self.context_edit.setPlainText("Loading..." if self.source_rows_thread is not None else
+                                           "The original file is not available.")
+            return
+        row = self.source_rows.row(self.df.index.get_loc(self.current_index), self.context_columns)
+        if row is None:
+            self.context_edit.setPlainText("The original row of this sample is not available.")
+            return
+        self.context_edit.setPlainText("\n".join(f"{column}: {value}" for column, value in row.items()))
+
+    def _context_in_task(self):
+        # Inputs that cannot be read in place have their context columns copied into the task
+        return all(column in self.df.columns for column in self.context_columns)
+
+    def on_source_rows_ready(self, source_rows):
+        # Rows are matched by position, inputs with another number of rows are not the ones the task was created from
+        if len(source_rows) == len(self.df):
+            self.source_rows = source_rows
+        else:
+            self.source_rows_thread = None
+            print(f"The inputs of the task have {len(source_rows)} rows, the task has {len(self.df)}")
+            source_rows.close()
+        self._show_context()
+
+    def on_source_rows_error(self, error_message):
+        self.source_rows_thread = None
+        print(f"Failed to index the original file: {error_message}")
+        self._show_context()
+
+    def _limit(self, name):
+        defaults = {'display_limit': 20000, 'scoring_limit': 10000}
+        return getattr(self.project_data, name) or defaults[name]
 
-    def _start_database_update_thread(self):
+    def _set_description(self, text):
         """
-        Start the database update thread. If it's already running, wait for it to finish first.
+        Show the first display_limit characters of a sample, the rest is shown on demand with "Load more".
         """
-        if self.database_update_thread and self.database_update_thread.isRunning():
-            self.database_update_thread.wait()
-        self.database_update_thread = DatabaseUpdateThread(self.session, self.project_data, self.current_index)
-        self.database_update_thread.done.connect(self.on_database_update_done)
-        self.database_update_thread.start()
+        self.description_text = str(text)
+        self.description_shown = min(len(self.description_text), self._limit('display_limit'))
+        self.description_edit.setPlainText(self.description_text[:self.description_shown])
+        self._update_load_more_button()
+
+    def on_load_more_button_clicked(self):
+        """
+        Append the next display_limit characters of the sample.
+        """
+        end = min(len(self.description_text), self.description_shown + self._limit('display_limit'))
+        cursor = QTextCursor(self.description_edit.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(self.description_text[self.description_shown:end])
+        self.description_shown = end
+        self._update_load_more_button()
+
+    def _update_load_more_button(self):
+        remaining = len(self.description_text) - self.description_shown
+        self.load_more_btn.setText(f"Load more ({remaining} characters left)")
+        self.load_more_btn.setVisible(remaining > 0)
+
+    def _queue_progress_update(self):
+        """
+        Queue the number of labelled samples for the database writer.
+        Annotators labelling a shard only see part of the labels, the shard merge updates the task instead.
+        """
+        if self.annotator is None:
+            self.database_writer.update_progress(self.project_data.task_uuid, self.labelled_count)
+
+    def _shard_positions(self):
+        """
+        Return the positions of the still unlabelled rows of the leased shard.
+        """
+        if self.shard_lease is None:
+            return np.empty(0, dtype=np.int64)
+        positions = self.df.index.get_indexer(self.shard_manager.shard_rows(self.shard_lease.shard_id))
+        positions = positions[positions >= 0]
+        unlabelled = self.label_store.unlabelled(positions)
+        return np.sort(positions[unlabelled])
+
+    def renew_shard_lease(self):
+        self.shard_lease = self.shard_manager.renew(self.shard_lease)
+        if self.shard_lease is None:
+            self.lease_timer.stop()
+            print("The shard lease expired and was taken over by another annotator")
+
+    def _retire_text_processing_thread(self):
+        """
+        Drop the results of the running text processing thread, it is left to finish in the background.
+        """
+        self.retired_threads = [thread for thread in self.retired_threads if thread.isRunning()]
+        thread = self.text_processing_thread
+        if thread and thread.isRunning() and thread not in self.retired_threads:
+            # Results for the previous sample are stale, drop them
+            thread.result_signal.disconnect()
+            self.retired_threads.append(thread)
+        self.scored_index = None
 
     def _start_text_processing_thread(self):
         """
-        Start the text processing thread. If it's already running, stop it first and wait for it to finish.
+        Start the text processing thread. A thread still scoring a previous sample is not waited for.
         """
-        if self.text_processing_thread and self.text_processing_thread.isRunning():
-            self.text_processing_thread.stop_signal.emit()
-            self.text_processing_thread.wait()
-        self.text_processing_thread = TextProcessingThread(self.class_synonyms,
-                                                           self.df.loc[self.current_index, 'description'])
+        self._retire_text_processing_thread()
+        # Only a bounded prefix is scored, so huge samples cannot stall the scorer
+        description = str(self._sample_text(self.current_index))[:self._limit('scoring_limit')]
+        self.text_processing_thread = TextProcessingThread(self.synonym_index, description,
+                                                           self.project_data.subcategory_threshold or 0.0,
+                                                           self.suggestion_cache)
         self.text_processing_thread.result_signal.connect(self.on_similarity_computed)
+        self.scored_index = self.current_index
         self.text_processing_thread.start()
     def on_save_button_clicked(self):
         """
-        Handler for 'Save' button click event. Saves the current label and writes the DataFrame to a CSV file.
+        Handler for 'Save' button click event. Saves the current label and writes the DataFrame to a CSV file
+        in the background.
         """
-        self.df.loc[self.current_index, self.project_data.label_column_name] = str(self.selected_classes)
-        self.df.to_csv(self.project_data.file_path, index=False)
+        if self.current_index is not None:
+            self._record_label(self.current_index, self._current_label())
+        self.save_pipeline.request_save(compact=True)
 
     def on_database_update_done(self):
         """
-        Handler for the completion signal from the database update thread.
+        Handler for the completion signal from the database writer.
         """
         print("Database update done")
 
-    def on_similarity_computed(self, results):
+    def on_similarity_computed(self, results, subcategory_results=None, matches=()):
         """
         Handler for the completion signal from the text processing thread. It updates the selected classes based on the similarity results, and displays the results.
+        The scores of the subcategories of the likely classes are listed under them, and with hierarchical labels
+        the best subcategory is suggested along with its class.
+        Exact synonym matches are highlighted in the description with the color of their class.
         """
-        if not results:
+        subcategory_results = subcategory_results or {}
+        if self.sender() is not None and (self.sender() is not self.text_processing_thread or
+                                          self.scored_index != self.current_index):
+            # Queued before the thread was replaced, the results belong to another sample
             return
-        if self.selected_classes:
+        self._highlight_matches(matches)
+        self.class_scores = results
+        if self.palette_open:
+            self.update_palette()
+        if not results:
             return
         best_match_class = max(results, key=results.get)
-        best_match_index = self.project_data.get_labels_list().index(best_match_class)
-        self.class_buttons[best_match_index].setChecked(True)
-        self.on_class_button_clicked()
+        if not self.selected_classes and best_match_class in self.label_positions:
+            class_index = self.label_positions[best_match_class]
+            sub_scores = subcategory_results.get(best_match_class)
+            if self.project_data.hierarchical_labels and sub_scores:
+                best_subcategory = max(sub_scores, key=sub_scores.get)
+                if sub_scores[best_subcategory] > 0:
+                    self.selected_subcategories[class_index] = best_subcategory
+            self._set_selected_classes([class_index])
+            self.suggested_classes = self._current_label()
 
         sorted_results = sorted(results.items(), key=lambda item: item[1], reverse=True)
         top_n = 10
         sorted_results = sorted_results[:top_n]
-        results_str = "\n".join(f"{class_name}: {similarity:.2f}" for class_name, similarity in sorted_results)
+        lines = []
+        for class_name, similarity in sorted_results:
+            lines.append(f"{class_name}: {similarity:.2f}")
+            sub_scores = sorted(subcategory_results.get(class_name, {}).items(), key=lambda item: item[1],
+                                reverse=True)
+            lines.extend(f"    {class_name}/{name}: {score:.2f}" for name, score in sub_scores[:top_n])
+        results_str = "\n".join(lines)
+        if matches:
+            phrases = ", ".join(sorted({match.phrase for match in matches}))
+            results_str = f"Exact matches: {phrases}\n{results_str}"
         self.tfidf_results_edit.setText(results_str)
 
+    def _highlight_matches(self, matches):
+        selections = []
+        for match in matches:
+            if match.class_name not in self.label_positions or match.end > self.description_shown:
+                continue
+            color = self.colors[self.label_positions[match.class_name]]
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(QColor(color))
+            selection.format.setForeground(QColor(contrast_color(color)))
+            selection.cursor = QTextCursor(self.description_edit.document())
+            selection.cursor.setPosition(match.start)
+            selection.cursor.setPosition(match.end, QTextCursor.MoveMode.KeepAnchor)
+            selections.append(selection)
+        self.description_edit.setExtraSelections(selections)
+
+    def on_synonyms_changed(self, changed):
+        """
+        Handler for a change to synonyms.json. Re-scores the current sample, replacing the selection if it was
+        only the previous suggestion.
+        """
+        self.synonym_index_key, self.synonym_index = share_synonym_index(self.synonym_index_key,
+                                                                         self.synonyms_watcher.synonym_index)
+        self.synonyms_watcher.synonym_index = self.synonym_index
+        self.palette_index = ClassPaletteIndex(self.labels, self.synonym_index.class_synonyms)
+        self.suggestion_cache.prune(self.synonym_index.fingerprint)
+        if self.current_index is None:
+            return
+        if self._current_label() == self.suggested_classes:
+            self._show_current_sample()
+        else:
+            self._start_text_processing_thread()
+
     def on_save_done(self):
         """
         Handler for the completion signal from the file saving thread.
@@ -408,11 +1166,17 @@ class LabelingProjectWindow(QMainWindow):
         """
         if state == 2:  # Checkbox is checked
             self.autosave_enabled = True
-            self.autosave_timer.start(10 * 60 * 1000)  # Start the timer with a 10-minute interval
+            self.autosave_timer.start(self._autosave_interval() * 60 * 1000)  # Start the timer with the task's interval
         else:  # Checkbox is not checked
             self.autosave_enabled = False
             self.autosave_timer.stop()
 
+    def _autosave_interval(self):
+        """
+        Minutes between autosaves configured for the task.
+        """
+        return self.project_data.autosave_interval or 10
+
     def autosave(self):
         """
         Autosave method.
@@ -420,29 +1184,152 @@ class LabelingProjectWindow(QMainWindow):
         if self.changes_made:
             self.save_changes()
 
+    def save_changes(self):
+        """
+        Journal the labels changed since the last save in the background. Never blocks the GUI thread.
+        """
+        self.save_pipeline.request_save()
+
     def eventFilter(self, source, event):
         """
         Event filter method. It captures key press events at the application level and processes them. Required for spacebar shortcut.
+        Every open labelling window filters the events of the application, each one only handles the keys sent to
+        itself or its widgets, i.e. the keys typed while it has the focus.
         """
-        if event.type() == QEvent.Type.KeyPress:
-            self.keyPressEvent(event)
+        if event.type() == QEvent.Type.KeyPress and self._owns(source):
+            if self.palette_open or self.palette_edit.hasFocus():
+                # Typing goes to the palette, only the keys moving through it are handled here
+                return self._palette_key_press(event)
+            command = self._key_command(event)
+            if command is not None:
+                self.key_commands.push(command, event.isAutoRepeat())
             return True
         return super().eventFilter(source, event)
 
+    def _owns(self, source):
+        # Key events reach the filter for the native window first, then for the widget with the focus
+        if isinstance(source, QWidget):
+            return source.window() is self
+        return source is self.windowHandle()
+
+    def open_palette(self):
+        self.palette_open = True
+        self.palette_list.show()
+        self.palette_edit.setFocus()
+        self.update_palette()
+
+    def close_palette(self):
+        self.palette_open = False
+        self.palette_list.hide()
+        self.palette_edit.blockSignals(True)
+        self.palette_edit.clear()
+        self.palette_edit.blockSignals(False)
+        self.palette_edit.clearFocus()
+
+    def update_palette(self):
+        """
+        Filter the class palette with the typed text, classes matching equally well are ranked by the suggestion
+        scores of the current sample.
+        """
+        if not self.palette_open:
+            self.open_palette()
+            return
+        labels = self.labels
+        self.palette_matches = self.palette_index.search(self.palette_edit.text(), self.class_scores)
+        self.palette_list.clear()
+        for i in self.palette_matches:
+            score = self.class_scores.get(labels[i])
+            self.palette_list.addItem(labels[i] if score is None else f"{labels[i]}  {score:.2f}")
+        self.palette_list.setCurrentRow(0)
+
+    def pick_palette_class(self):
+        """
+        Pick the highlighted class of the palette as if its button had been clicked.
+        """
+        row = self.palette_list.currentRow()
+        matches = self.palette_matches
+        self.close_palette()
+        if 0 <= row < len(matches):
+            self.class_buttons[matches[row]].click()
+
+    def _palette_key_press(self, event):
+        if event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+            self.pick_palette_class()
+        elif event.key() == Qt.Key.Key_Escape:
+            self.close_palette()
+        elif event.key() in (Qt.Key.Key_Down, Qt.Key.Key_Up):
+            step = 1 if event.key() == Qt.Key.Key_Down else -1
+            row = max(0, min(self.palette_list.currentRow() + step, self.palette_list.count() - 1))
+            self.palette_list.setCurrentRow(row)
+        else:
+            return False
+        return True
+
 
     def keyPressEvent(self, event: QKeyEvent):
         """
         Handler for key press events. It processes shortcuts for class buttons and the 'Next' button.
         """
-        if event.key() == 32:  # space bar
-            self.on_next_button_clicked()
-        elif event.text() in self.key_map:
-            index = self.key_map.index(event.text())
-            self.class_buttons[index].click()
+        command = self._key_command(event)
+        if command is not None:
+            self.key_commands.push(command, event.isAutoRepeat())
+
+    def _key_command(self, event):
+        """
+        Return the command run by a key, or None if the key does nothing.
+        """
+        modifiers = event.modifiers()
+        if modifiers & Qt.KeyboardModifier.ControlModifier:
+            if event.key() == Qt.Key.Key_Z and modifiers & Qt.KeyboardModifier.ShiftModifier:
+                return self.on_redo_button_clicked
+            elif event.key() == Qt.Key.Key_Z:
+                return self.on_undo_button_clicked
+            elif event.key() == Qt.Key.Key_Y:
+                return self.on_redo_button_clicked
+        elif event.key() == 32:  # space bar
+            return self.on_next_button_clicked
+        elif event.text() == '/':
+            return self.open_palette
+        elif event.key() in (Qt.Key.Key_Backspace, Qt.Key.Key_Left):
+            return self.on_previous_button_clicked
+        elif event.key() == Qt.Key.Key_Escape:
+            return self._hide_subcategory_buttons
+        elif self.subcategory_parent is not None and event.text() in self.key_map[:len(self.subcategory_buttons)]:
+            return self.subcategory_buttons[self.key_map.index(event.text())].click
+        elif event.text() in self.key_map[:len(self.class_buttons)]:
+            return self.class_buttons[self.key_map.index(event.text())].click
+        return None
 
     def closeEvent(self, event):
         """
-        Handler for the window close event. It closes the database session before closing the window.
+        Handler for the window close event. It writes any unsaved labels and closes the database session before
+        closing the window.
         """
+        QApplication.instance().removeEventFilter(self)
+        self.key_commands.stop()
+        for thread in self.retired_threads + [self.text_processing_thread]:
+            if thread is not None:
+                thread.wait()
+        if self.source_rows_thread is not None:
+            self.source_rows_thread.wait()
+        if self.source_rows is not None:
+            self.source_rows.close()
+        self.save_pipeline.flush(compact=self.annotator is None)
+        self.database_writer.update_disk_size(self.project_data.task_uuid, os.path.dirname(self.project_data.file_path))
+        self.database_writer.stop()
         self.session.close()
+        stats = self.suggestion_cache.stats()
+        print(f"Suggestion cache: {stats['hits']} hits in {stats['lookups']} lookups "
+              f"({stats['hit_rate']:.0%}, {stats['disk_hits']} from disk)")
+        self.suggestion_cache.close()
+        if self.synonym_index_key is not None:
+            shared_resources.release(self.synonym_index_key)
+            self.synonym_index_key = None
+        self.label_log.close()
+        if self.shard_lease is not None:
+            self.lease_timer.stop()
+            # An unfinished shard stays leased to the annotator until the lease expires, so they can resume it
+            if self.current_index is None:
+                self.shard_manager.complete(self.shard_lease)
+        save_session_profile(os.path.dirname(self.project_data.file_path))
         super().closeEvent(event)
@@ -1,6 +1,7 @@
 from PyQt6.QtCore import Qt, pyqtSignal, QThread, QTimer
 from PyQt6.QtWidgets import QListWidgetItem, QFileDialog, QRadioButton, QPushButton, QListWidget, QLabel, QCheckBox, \
-    QLineEdit, QVBoxLayout, QDialog, QMessageBox, QButtonGroup
+    QLineEdit, QVBoxLayout, QDialog, QMessageBox, QButtonGroup, QSpinBox, \
+    QDoubleSpinBox
 import pandas as pd
 import json
 import os
@@ -9,6 +10,12 @@ import uuid
 import traceback
 import qtawesome as qta
 
+from core.ingest import expand_inputs, is_plain_csv, ingest, read_columns, append_rows, INPUTS_FILE_NAME, \
+    ROW_HASHES_FILE_NAME
+from core.artifacts import ArtifactStore
+from core.source_rows import SourceRows, row_offsets_path
+from core.synonym_index import task_document_frequencies, document_frequencies_inputs, DocumentFrequencies
+from core.task_files import directory_size
 from models import Task
 
 class LoadFileThread(QThread):
@@ -21,7 +28,12 @@ class LoadFileThread(QThread):
 
     def run(self):
         if self.is_csv:
-            data = pd.read_csv(self.file_path, dtype=str)
+            # The first rows are enough to list the columns, large and compressed inputs are not read in full here
+            try:
+                data = read_columns(self.file_path)
+            except (OSError, ValueError, ImportError) as e:
+                print(f"Failed to read {self.file_path}: {e}")
+                return
         else:  # json file
             with open(self.file_path, 'r') as f:
                 data = json.load(f)
@@ -33,7 +45,8 @@ class SaveTaskThread(QThread):
 
     The `task` dictionary should contain the following keys:
         - 'task_name': The name of the task.
-        - 'file_path': The path to the original CSV file.
+        - 'file_path': The path to the original CSV file. It may be compressed with gzip, bz2 or zstd, be a JSON lines
+          file, or be a glob pattern of shards, whose rows are numbered in the sorted order of the shards.
         - 'labels': A list of labels.
         - 'label_column_name': The name of the column in the CSV file where the labels should be stored.
         - 'synonyms_file_path': The path to the synonyms JSON file.
@@ -41,6 +54,19 @@ class SaveTaskThread(QThread):
         - 'selected_field': The name of the field that is to be labeled.
         - 'task_directory': The path to the directory where task data will be saved.
         - 'task_uuid': A unique identifier for the task.
+        - 'autosave_interval': Optional, the minutes between autosaves while labelling. Defaults to 10.
+        - 'hierarchical_labels': Optional, whether a subcategory is picked after a class with subcategories.
+        - 'subcategory_threshold': Optional, the score a class needs for its subcategories to be scored.
+        - 'display_limit': Optional, the characters of a sample shown before "Load more". Defaults to 20000.
+        - 'scoring_limit': Optional, the characters of a sample scored for suggestions. Defaults to 10000.
+        - 'context_columns': Optional, a list of columns of the original CSV file shown next to the field to label.
+          They are read from the original file while labelling and are not copied into the task, unless it cannot
+          be read in place (compressed, JSON lines or shards).
+        - 'field_in_source': Optional, whether the field to label is also read from the original file rather than
+          copied into data.csv, which then only holds the label column. The original file has to stay in place, and
+          be a single uncompressed CSV file.
+        - 'idf_weighting': Optional, whether suggestions weight words by their IDF over the field to label. The
+          document frequencies are counted once here and saved in the task directory.
     """
     task_saved_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
@@ -56,13 +82,30 @@ class SaveTaskThread(QThread):
         self.create_directory(self.task_directory)
         session = None
         try:
-            df = self.load_csv_into_dataframe(self.task['file_path'], self.task['selected_field'], self.task['label_column_name'])
-            self.save_dataframe_to_csv(df, os.path.join(self.task_directory, 'data.csv'))
+            inputs = expand_inputs(self.task['file_path'])
+            data_path = os.path.join(self.task_directory, 'data.csv')
+            if self.task.get('field_in_source', False):
+                if not is_plain_csv(inputs):
+                    raise ValueError("The field can only be read from a single uncompressed CSV file.")
+                df = self.index_source_file(self.task['file_path'], self.task['selected_field'],
+                                            self.task['label_column_name'])
+                self.save_dataframe_to_csv(df, data_path)
+            else:
+                # Context columns of inputs that cannot be read in place are copied along with the field
+                columns = [self.task['selected_field']]
+                if not is_plain_csv(inputs):
+                    columns += [column for column in self.task.get('context_columns', []) if column not in columns]
+                ingest(self.task['file_path'], data_path, columns, self.task['label_column_name'],
+                       os.path.join(self.task_directory, INPUTS_FILE_NAME),
+                       os.path.join(self.task_directory, ROW_HASHES_FILE_NAME))
 
             if self.task['synonyms_file_path'] is not None:
                 self.copy_synonyms_file_to_task_directory(self.task['synonyms_file_path'])
 
             new_task = self.create_new_task()
+            if new_task.idf_weighting:
+                task_document_frequencies(new_task, ArtifactStore(self.task_directory))
+            new_task.disk_size = directory_size(self.task_directory)
             self.save_task_to_database(new_task, session)
             self.task_saved_signal.emit(self.task['task_uuid'])
             print("Finished running SaveTaskThread.")
@@ -76,11 +119,18 @@ class SaveTaskThread(QThread):
         os.makedirs(directory, exist_ok=True)
         print(f"Created task directory: {directory}")
 
-    def load_csv_into_dataframe(self, file_path, selected_field, label_column_name):
-        df = pd.read_csv(file_path)
-        df = df[[selected_field]]
-        df[label_column_name] = None
-        return df
+    def index_source_file(self, file_path, selected_field, label_column_name):
+        """
+        Index the byte offset of every row of the original file in the task directory, in a single pass over it, and
+        return an empty label column with a row for each of them.
+        """
+        source_rows = SourceRows(file_path, row_offsets_path(ArtifactStore(self.task_directory), file_path))
+        try:
+            if selected_field not in source_rows.columns:
+                raise ValueError(f"The column {selected_field} is not in {file_path}")
+            return pd.DataFrame({label_column_name: [None] * len(source_rows)})
+        finally:
+            source_rows.close()
 
     def save_dataframe_to_csv(self, df, file_path):
         df.to_csv(file_path, index=False)
@@ -99,7 +149,16 @@ class SaveTaskThread(QThread):
             synonyms_file_path=os.path.join(self.task_directory, 'synonyms.json'),
             single_class=self.task['single_class'],
             field_to_label=self.task['selected_field'],
-            task_uuid=self.task['task_uuid']
+            task_uuid=self.task['task_uuid'],
+            autosave_interval=self.task.get('autosave_interval', 10),
+            hierarchical_labels=self.task.get('hierarchical_labels', False),
+            subcategory_threshold=self.task.get('subcategory_threshold', 0.0),
+            display_limit=self.task.get('display_limit', 20000),
+            scoring_limit=self.task.get('scoring_limit', 10000),
+            source_file_path=os.path.abspath(self.task['file_path']),
+            context_columns=",".join(self.task.get('context_columns', [])),
+            field_in_source=self.task.get('field_in_source', False),
+            idf_weighting=self.task.get('idf_weighting', False)
         )
         return new_task
 
@@ -118,6 +177,55 @@ class SaveTaskThread(QThread):
         print(e)
         self.error_signal.emit(str(e))  # emit error signal with the exception message
 
+class AppendRowsThread(QThread):
+    """
+    QThread that appends the rows of new inputs to an existing task. Rows already in the task are skipped, the
+    existing rows and their labels are left untouched and the new rows are counted into the document frequencies of
+    tasks weighting their suggestions by IDF.
+    """
+    done = pyqtSignal(int, int)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, Session, task_uuid, file_path):
+        super().__init__()
+        self.Session = Session
+        self.task_uuid = task_uuid
+        self.file_path = file_path
+
+    def run(self):
+        session = self.Session()
+        try:
+            task = session.query(Task).filter_by(task_uuid=self.task_uuid).first()
+            if task.field_in_source:
+                raise ValueError("Rows cannot be appended to a task reading its field from the original file.")
+            task_directory = os.path.dirname(task.file_path)
+            store = ArtifactStore(task_directory)
+            frequencies = None
+            frequencies_path = store.lookup('document_frequencies', document_frequencies_inputs(task)) \
+                if task.idf_weighting else None
+            if frequencies_path is not None:
+                frequencies = DocumentFrequencies.load(frequencies_path)
+
+            def on_chunk(chunk):
+                if frequencies is not None:
+                    frequencies.update(chunk[task.field_to_label].fillna(''))
+
+            appended, duplicates = append_rows(self.file_path, task.file_path, task.label_column_name,
+                                               os.path.join(task_directory, ROW_HASHES_FILE_NAME),
+                                               os.path.join(task_directory, INPUTS_FILE_NAME), on_chunk)
+            if frequencies is not None:
+                # Stored under the rows of the task with the appended ones
+                store.put('document_frequencies', document_frequencies_inputs(task), frequencies.save, '.npz')
+            task.disk_size = directory_size(task_directory)
+            session.commit()
+        except Exception as e:
+            self.error_signal.emit(str(e))
+            return
+        finally:
+            session.close()
+        self.done.emit(appended, duplicates)
+
+
 class NewTaskDialog(QDialog):
     task_saved = pyqtSignal()
 
@@ -134,6 +242,8 @@ class NewTaskDialog(QDialog):
 
         layout.addWidget(QLabel("CSV File Path"))
         self.file_path_edit = QLineEdit()
+        self.file_path_edit.setPlaceholderText("data.csv, data.csv.gz, data.jsonl or shards/*.csv.zst")
+        self.file_path_edit.editingFinished.connect(self.on_file_path_edited)
         layout.addWidget(self.file_path_edit)
 
         self.file_path_button = QPushButton("...")
@@ -168,10 +278,49 @@ class NewTaskDialog(QDialog):
         self.single_class_checkbox = QCheckBox("Single Class")
         layout.addWidget(self.single_class_checkbox)
 
+        layout.addWidget(QLabel("Autosave Interval (minutes)"))
+        self.autosave_interval_spinbox = QSpinBox()
+        self.autosave_interval_spinbox.setRange(1, 120)
+        self.autosave_interval_spinbox.setValue(10)
+        layout.addWidget(self.autosave_interval_spinbox)
+
+        self.hierarchical_labels_checkbox = QCheckBox("Label Subcategories")
+        layout.addWidget(self.hierarchical_labels_checkbox)
+
+        layout.addWidget(QLabel("Minimum Class Score to Score its Subcategories"))
+        self.subcategory_threshold_spinbox = QDoubleSpinBox()
+        self.subcategory_threshold_spinbox.setRange(0.0, 1.0)
+        self.subcategory_threshold_spinbox.setSingleStep(0.05)
+        layout.addWidget(self.subcategory_threshold_spinbox)
+
+        layout.addWidget(QLabel("Characters Shown per Sample"))
+        self.display_limit_spinbox = QSpinBox()
+        self.display_limit_spinbox.setRange(100, 10_000_000)
+        self.display_limit_spinbox.setSingleStep(1000)
+        self.display_limit_spinbox.setValue(20000)
+        layout.addWidget(self.display_limit_spinbox)
+
+        layout.addWidget(QLabel("Characters Scored per Sample"))
+        self.scoring_limit_spinbox = QSpinBox()
+        self.scoring_limit_spinbox.setRange(100, 10_000_000)
+        self.scoring_limit_spinbox.setSingleStep(1000)
+        self.scoring_limit_spinbox.setValue(10000)
+        layout.addWidget(self.scoring_limit_spinbox)
+
         layout.addWidget(QLabel("Field to Label"))
         self.field_to_label_list_widget = QListWidget()
         layout.addWidget(self.field_to_label_list_widget)
 
+        layout.addWidget(QLabel("Context Columns"))
+        self.context_columns_list_widget = QListWidget()
+        layout.addWidget(self.context_columns_list_widget)
+
+        self.field_in_source_checkbox = QCheckBox("Read the Field from the Original File instead of Copying it")
+        layout.addWidget(self.field_in_source_checkbox)
+
+        self.idf_weighting_checkbox = QCheckBox("Weight Suggestions by Word Rarity (TF-IDF)")
+        layout.addWidget(self.idf_weighting_checkbox)
+
         self.save_btn = QPushButton('Save')
         self.save_btn.clicked.connect(self.on_save_button_clicked)
         layout.addWidget(self.save_btn)
@@ -197,12 +346,23 @@ class NewTaskDialog(QDialog):
         self.labels_edit.clear()
 
     def on_file_path_button_clicked(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select CSV File", "", "CSV Files (*.csv)")
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Select CSV File", "",
+            "Data Files (*.csv *.csv.gz *.csv.bz2 *.csv.zst *.jsonl *.jsonl.gz *.jsonl.bz2 *.jsonl.zst);;All Files (*)")
         if file_path:
             self.file_path_edit.setText(file_path)
-            self.load_file_thread = LoadFileThread(file_path, is_csv=True)
-            self.load_file_thread.data_signal.connect(self.on_csv_loaded)
-            self.load_file_thread.start()
+            self.load_columns(file_path)
+
+    def on_file_path_edited(self):
+        # A typed path or glob pattern of shards
+        file_path = self.file_path_edit.text().strip()
+        if file_path:
+            self.load_columns(file_path)
+
+    def load_columns(self, file_path):
+        self.load_file_thread = LoadFileThread(file_path, is_csv=True)
+        self.load_file_thread.data_signal.connect(self.on_csv_loaded)
+        self.load_file_thread.start()
 
     def on_csv_loaded(self, df):
         column_names = df.columns.tolist()
@@ -214,6 +374,12 @@ class NewTaskDialog(QDialog):
             list_item = QListWidgetItem(self.field_to_label_list_widget)
             self.field_to_label_list_widget.setItemWidget(list_item, radio_btn)
 
+        self.context_columns_list_widget.clear()
+        for column_name in column_names:
+            context_item = QListWidgetItem(column_name, self.context_columns_list_widget)
+            context_item.setFlags(context_item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            context_item.setCheckState(Qt.CheckState.Unchecked)
+
     def on_synonyms_file_path_button_clicked(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select JSON File", "", "JSON Files (*.json)")
         if file_path:
@@ -254,6 +420,10 @@ class NewTaskDialog(QDialog):
             return
 
         selected_field = selected_field_button.text()
+        context_columns = [self.context_columns_list_widget.item(i).text()
+                           for i in range(self.context_columns_list_widget.count())
+                           if self.context_columns_list_widget.item(i).checkState() == Qt.CheckState.Checked and
+                           self.context_columns_list_widget.item(i).text() != selected_field]
 
         # Generate a UUID for the task
         task_uuid = str(uuid.uuid4())
@@ -276,7 +446,15 @@ class NewTaskDialog(QDialog):
             'single_class': single_class,
             'selected_field': selected_field,
             'task_directory': task_directory,
-            'task_uuid': task_uuid
+            'task_uuid': task_uuid,
+            'autosave_interval': self.autosave_interval_spinbox.value(),
+            'hierarchical_labels': self.hierarchical_labels_checkbox.isChecked(),
+            'subcategory_threshold': self.subcategory_threshold_spinbox.value(),
+            'display_limit': self.display_limit_spinbox.value(),
+            'scoring_limit': self.scoring_limit_spinbox.value(),
+            'context_columns': context_columns,
+            'field_in_source': self.field_in_source_checkbox.isChecked(),
+            'idf_weighting': self.idf_weighting_checkbox.isChecked()
         }
 
         self.save_btn.setIcon(qta.icon('fa5s.spinner', animation=qta.Spin(self.save_btn)))
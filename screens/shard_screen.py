@@ -0,0 +1,163 @@
+import os
+
+import pandas as pd
+from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QSpinBox, QPushButton, QMessageBox
+
+from core.label_store import LabelStore
+from core.persistence import LabelJournal
+from core.sharding import ShardManager
+from models import Task
+from .labelling_screen import LabelingProjectWindow
+
+
+class CreateShardsThread(QThread):
+    """
+    QThread that splits the unlabelled rows of a task into shards.
+    """
+    done = pyqtSignal(int)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, file_path, label_column_name, shard_size, audit_fraction):
+        super().__init__()
+        self.file_path = file_path
+        self.label_column_name = label_column_name
+        self.shard_size = shard_size
+        self.audit_fraction = audit_fraction
+
+    def run(self):
+        try:
+            task_directory = os.path.dirname(self.file_path)
+            label_store = LabelStore(pd.read_csv(self.file_path), self.label_column_name)
+            label_store.apply_labels(LabelJournal(os.path.join(task_directory, 'labels.journal')).replay())
+            indices = label_store.df.index[label_store.unlabelled_positions()]
+            shard_count = ShardManager(task_directory).create_shards(indices, self.shard_size, self.audit_fraction)
+        except Exception as e:
+            self.error_signal.emit(str(e))
+            return
+        self.done.emit(shard_count)
+
+
+class MergeShardsThread(QThread):
+    """
+    QThread that merges the annotator journals into the task's data file and updates its progress.
+    """
+    done = pyqtSignal(object)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, Session, task_uuid):
+        super().__init__()
+        self.Session = Session
+        self.task_uuid = task_uuid
+
+    def run(self):
+        session = self.Session()
+        try:
+            task = session.query(Task).filter_by(task_uuid=self.task_uuid).first()
+            task_directory = os.path.dirname(task.file_path)
+            label_store = LabelStore(pd.read_csv(task.file_path), task.label_column_name)
+            report = ShardManager(task_directory).merge_into_file(
+                label_store, task.file_path, LabelJournal(os.path.join(task_directory, 'labels.journal')))
+            task.labelled_samples = label_store.labelled_count()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            self.error_signal.emit(str(e))
+            return
+        finally:
+            session.close()
+        self.done.emit(report)
+
+
+class ShardDialog(QDialog):
+    """
+    Dialog to split a task between several annotators, label one shard and merge everyone's labels back.
+    """
+
+    def __init__(self, Session, task_uuid, parent=None):
+        super().__init__(parent)
+        self.Session = Session
+        self.task_uuid = task_uuid
+        self.shard_thread = None
+        self.label_window = None
+
+        session = Session()
+        self.task = session.query(Task).filter_by(task_uuid=task_uuid).first()
+        session.close()
+        self.shard_manager = ShardManager(os.path.dirname(self.task.file_path))
+
+        layout = QVBoxLayout()
+
+        layout.addWidget(QLabel("Annotator Name"))
+        self.annotator_edit = QLineEdit()
+        layout.addWidget(self.annotator_edit)
+
+        layout.addWidget(QLabel("Rows per Shard"))
+        self.shard_size_spinbox = QSpinBox()
+        self.shard_size_spinbox.setRange(1, 10_000_000)
+        self.shard_size_spinbox.setValue(1000)
+        layout.addWidget(self.shard_size_spinbox)
+
+        layout.addWidget(QLabel("Double-labelled Audit Rows (%)"))
+        self.audit_spinbox = QSpinBox()
+        self.audit_spinbox.setRange(0, 50)
+        layout.addWidget(self.audit_spinbox)
+
+        self.create_btn = QPushButton('Create Shards')
+        self.create_btn.clicked.connect(self.on_create_button_clicked)
+        layout.addWidget(self.create_btn)
+
+        self.label_btn = QPushButton('Label a Shard')
+        self.label_btn.clicked.connect(self.on_label_button_clicked)
+        layout.addWidget(self.label_btn)
+
+        self.merge_btn = QPushButton('Merge Shards')
+        self.merge_btn.clicked.connect(self.on_merge_button_clicked)
+        layout.addWidget(self.merge_btn)
+
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        self.setLayout(layout)
+        self.update_status()
+
+    def update_status(self):
+        if self.shard_manager.has_shards():
+            shard_count = len(self.shard_manager.load_manifest()['shards'])
+            self.status_label.setText(f"The task is split into {shard_count} shards.")
+        else:
+            self.status_label.setText("The task has not been split into shards yet.")
+        self.create_btn.setEnabled(not self.shard_manager.has_shards())
+        self.label_btn.setEnabled(self.shard_manager.has_shards())
+        self.merge_btn.setEnabled(self.shard_manager.has_shards())
+
+    def on_create_button_clicked(self):
+        self.shard_thread = CreateShardsThread(self.task.file_path, self.task.label_column_name,
+                                               self.shard_size_spinbox.value(), self.audit_spinbox.value() / 100)
+        self.shard_thread.done.connect(lambda shard_count: self.update_status())
+        self.shard_thread.error_signal.connect(self.on_error)
+        self.shard_thread.start()
+
+    def on_label_button_clicked(self):
+        annotator = self.annotator_edit.text().strip()
+        try:
+            self.label_window = LabelingProjectWindow(self.Session, self.task_uuid, annotator=annotator)
+        except ValueError as e:
+            self.on_error(str(e))
+            return
+        if self.label_window.shard_lease is None:
+            self.status_label.setText("Every shard is either done or leased by another annotator.")
+        self.label_window.show()
+
+    def on_merge_button_clicked(self):
+        self.shard_thread = MergeShardsThread(self.Session, self.task_uuid)
+        self.shard_thread.done.connect(self.on_merge_done)
+        self.shard_thread.error_signal.connect(self.on_error)
+        self.shard_thread.start()
+
+    def on_merge_done(self, report):
+        self.status_label.setText(f"Merged {report.merged} labels. {report.agreements} of {report.double_labelled} "
+                                  f"audit rows agree, {len(report.conflicts)} conflicts left for review.")
+
+    def on_error(self, error_message):
+        QMessageBox.critical(self, "Error", error_message)
@@ -1,11 +1,56 @@
 import os
-import shutil
+from PyQt6.QtCore import QThread, pyqtSignal
+from core.task_files import move_to_trash, empty_trash, format_size, TRASH_DIRECTORY_NAME
 from models import Task
 from .export_screen import ExportWindow
+from .grid_labelling_screen import GridLabellingWindow
 from .labelling_screen import LabelingProjectWindow
-from .new_task_screen import NewTaskDialog
+from .new_task_screen import NewTaskDialog, AppendRowsThread
+from .shard_screen import ShardDialog
 from PyQt6.QtWidgets import (QTableWidget, QTableWidgetItem, QHeaderView, QMainWindow, QVBoxLayout, QPushButton,
-                             QWidget, QLabel, QMessageBox)
+                             QWidget, QLabel, QMessageBox, QFileDialog)
+
+
+def task_directory_path(task_uuid):
+    return os.path.join(os.getcwd(), 'tasks', task_uuid)
+
+
+class TrashReaperThread(QThread):
+    """
+    QThread that removes the files of deleted tasks in the background. Directories of tasks flagged as deleted that
+    are still in place, e.g. after a crash right after flagging, are moved to the trash first. The trash is then
+    emptied and the rows of the deleted tasks are removed from the database.
+    """
+    done = pyqtSignal(int)
+
+    def __init__(self, Session, trash_directory):
+        super().__init__()
+        self.Session = Session
+        self.trash_directory = trash_directory
+
+    def run(self):
+        session = self.Session()
+        try:
+            reaped = []
+            for task in session.query(Task).filter(Task.deleted.is_(True)).all():
+                try:
+                    move_to_trash(task_directory_path(task.task_uuid), self.trash_directory)
+                except OSError as e:
+                    # E.g. a file still open on Windows, the task is reaped on a later pass
+                    print(f"Could not move the task {task.task_uuid} to the trash:", e)
+                    continue
+                reaped.append(task)
+            freed = empty_trash(self.trash_directory)
+            for task in reaped:
+                session.delete(task)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print("Failed to empty the trash:", e)
+            return
+        finally:
+            session.close()
+        self.done.emit(freed)
 
 
 class StartWindow(QMainWindow):
@@ -13,12 +58,15 @@ class StartWindow(QMainWindow):
         super().__init__()
         self.Session = Session
         self.tasks = []  # List to hold Task objects
+        # Open labelling and grid windows by task uuid, several tasks can be labelled at once
+        self.label_windows = {}
+        self.grid_windows = {}
         layout = QVBoxLayout()
 
-        # Initialize the table with 0 rows and 5 columns
-        self.task_table_widget = QTableWidget(0, 6)
+        # Initialize the table with 0 rows and 10 columns
+        self.task_table_widget = QTableWidget(0, 10)
         self.task_table_widget.setHorizontalHeaderLabels(
-            ["Task Name", "Labelled", "Created", "Open", "Delete", "Export"])
+            ["Task Name", "Labelled", "Created", "Open", "Delete", "Export", "Grid", "Shards", "Append", "Size"])
         self.task_table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.task_table_widget.setSortingEnabled(True)
         self.task_table_widget.verticalHeader().setVisible(False)
@@ -41,11 +89,17 @@ class StartWindow(QMainWindow):
         # Load tasks into the table
         self.load_tasks()
 
+        # Files of tasks deleted in an earlier session are removed in the background
+        self.trash_directory = os.path.join(os.getcwd(), 'tasks', TRASH_DIRECTORY_NAME)
+        self.reaper_thread = None
+        self.reap_again = False
+        self.reap_trash()
+
     def load_tasks(self):
         """Load tasks from the database and populate the table with task details."""
         self.task_table_widget.setRowCount(0)  # Clear the table
         session = self.Session()
-        self.tasks = session.query(Task).all()
+        self.tasks = session.query(Task).filter(Task.deleted.isnot(True)).all()
 
         for task in self.tasks:
             row_position = self.task_table_widget.rowCount()
@@ -68,13 +122,27 @@ class StartWindow(QMainWindow):
             export_button.clicked.connect(lambda checked, task=task: self.on_export_button_clicked(task))
             self.task_table_widget.setCellWidget(row_position, 5, export_button)
 
+            grid_button = QPushButton("Grid")
+            grid_button.clicked.connect(lambda checked, task=task: self.on_grid_button_clicked(task))
+            self.task_table_widget.setCellWidget(row_position, 6, grid_button)
+
+            shards_button = QPushButton("Shards")
+            shards_button.clicked.connect(lambda checked, task=task: self.on_shards_button_clicked(task))
+            self.task_table_widget.setCellWidget(row_position, 7, shards_button)
+
+            append_button = QPushButton("Append")
+            append_button.clicked.connect(lambda checked, task=task: self.on_append_button_clicked(task))
+            self.task_table_widget.setCellWidget(row_position, 8, append_button)
+
+            # Sizes are tracked in the database, the task directories are not walked to list the tasks
+            self.task_table_widget.setCellWidget(row_position, 9, QLabel(format_size(task.disk_size or 0)))
+
         session.close()
 
     def on_task_double_clicked(self, item):
         """Open the labeling window for the double-clicked task."""
         task = self.tasks[item.row()]
-        self.label_window = LabelingProjectWindow(self.Session, task.task_uuid)
-        self.label_window.show()
+        self.on_open_button_clicked(task)
 
     def on_new_task_button_clicked(self):
         """Open the 'New Task' dialog."""
@@ -84,6 +152,10 @@ class StartWindow(QMainWindow):
 
     def on_delete_button_clicked(self, task):
         """Delete the clicked task after confirmation."""
+        if self._open_task_windows(task.task_uuid, include_shards=True):
+            # The windows would keep writing into the directory being removed
+            QMessageBox.warning(self, "Task Open", "Close the task before deleting it.")
+            return
         confirm_box = QMessageBox()
         confirm_box.setIcon(QMessageBox.Icon.Question)
         confirm_box.setWindowTitle("Confirm Deletion")
@@ -96,25 +168,107 @@ class StartWindow(QMainWindow):
         response = confirm_box.exec()
 
         if response == QMessageBox.StandardButton.Yes:
-            # Remove task from database
+            # Flag the task as deleted first, a directory left in place is moved to the trash by the reaper
             session = self.Session()
-            session.delete(task)
+            session.query(Task).filter_by(task_uuid=task.task_uuid).update({Task.deleted: True})
             session.commit()
             session.close()
 
-            # Remove task files from disk
-            task_directory = os.path.join(os.getcwd(), 'tasks', task.task_uuid)
-            shutil.rmtree(task_directory, ignore_errors=True)
+            # A single rename, the files are removed in the background
+            try:
+                move_to_trash(task_directory_path(task.task_uuid), self.trash_directory)
+            except OSError as e:
+                print("Could not move the task to the trash:", e)
+            self.reap_trash()
+
+            # Only the row of the task is removed from the table
+            row = self.tasks.index(task)
+            self.task_table_widget.removeRow(row)
+            del self.tasks[row]
 
-            # Refresh task list
-            self.load_tasks()
+    def reap_trash(self):
+        """Remove the files of the deleted tasks in the background, again once the running pass is done if needed."""
+        if self.reaper_thread is not None and self.reaper_thread.isRunning():
+            self.reap_again = True
+            return
+        self.reap_again = False
+        self.reaper_thread = TrashReaperThread(self.Session, self.trash_directory)
+        self.reaper_thread.finished.connect(self.on_reaper_finished)
+        self.reaper_thread.start()
+
+    def on_reaper_finished(self):
+        if self.reap_again:
+            self.reap_trash()
+
+    def closeEvent(self, event):
+        if self.reaper_thread is not None:
+            self.reaper_thread.wait()
+        super().closeEvent(event)
 
     def on_open_button_clicked(self, task):
-        """Open the labeling window for the clicked task."""
-        self.label_window = LabelingProjectWindow(self.Session, task.task_uuid)
-        self.label_window.show()
+        """Open the labeling window for the clicked task, or bring it to the front if it is already open."""
+        self._open_window(self.label_windows, task, LabelingProjectWindow)
+
+    def on_grid_button_clicked(self, task):
+        """Open the grid labelling window for the clicked task, or bring it to the front if it is already open."""
+        self._open_window(self.grid_windows, task, GridLabellingWindow)
+
+    def _open_window(self, windows, task, window_class):
+        window = windows.get(task.task_uuid)
+        if window is not None and window.isVisible():
+            window.raise_()
+            window.activateWindow()
+            return
+        if self._open_task_windows(task.task_uuid):
+            # Both windows would save their own labels over the same data.csv and journal
+            QMessageBox.warning(self, "Task Open", "The task is open in the other labelling mode, close it first.")
+            return
+        window = window_class(self.Session, task.task_uuid)
+        windows[task.task_uuid] = window
+        window.show()
+
+    def _open_task_windows(self, task_uuid, include_shards=False):
+        """
+        Return the open windows writing to the files of a task. Annotators labelling a shard write to their own
+        journal, their windows are only included if include_shards is set.
+        """
+        windows = [self.label_windows.get(task_uuid), self.grid_windows.get(task_uuid)]
+        if include_shards:
+            windows += [dialog.label_window for dialog in self.findChildren(ShardDialog)
+                        if dialog.task_uuid == task_uuid]
+        return [window for window in windows if window is not None and window.isVisible()]
+
+    def on_shards_button_clicked(self, task):
+        """Open the dialog to split the clicked task between several annotators."""
+        self.shard_dialog = ShardDialog(self.Session, task.task_uuid, self)
+        self.shard_dialog.show()
 
     def on_export_button_clicked(self, task):
         """Open the export window for the clicked task."""
         self.export_window = ExportWindow(self.Session, task.task_uuid)
-        self.export_window.show()
\ No newline at end of file
+        self.export_window.show()
+
+    def on_append_button_clicked(self, task):
+        """Append the rows of a new data file to the clicked task, skipping the rows it already holds."""
+        if task.field_in_source:
+            QMessageBox.warning(self, "Cannot Append",
+                                "Rows cannot be appended to a task reading its field from the original file.")
+            return
+        if self._open_task_windows(task.task_uuid, include_shards=True):
+            # An open window would write its rows back over the appended ones
+            QMessageBox.warning(self, "Task Open", "Close the task before appending rows to it.")
+            return
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Select Data File", "",
+            "Data Files (*.csv *.csv.gz *.csv.bz2 *.csv.zst *.jsonl *.jsonl.gz *.jsonl.bz2 *.jsonl.zst);;All Files (*)")
+        if not file_path:
+            return
+        self.append_rows_thread = AppendRowsThread(self.Session, task.task_uuid, file_path)
+        self.append_rows_thread.done.connect(self.on_rows_appended)
+        self.append_rows_thread.error_signal.connect(lambda message: QMessageBox.critical(self, "Error", message))
+        self.append_rows_thread.start()
+
+    def on_rows_appended(self, appended, duplicates):
+        QMessageBox.information(self, "Rows Appended",
+                                f"Appended {appended} rows, skipped {duplicates} rows already in the task.")
+        self.load_tasks()
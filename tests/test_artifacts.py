@@ -0,0 +1,59 @@
+import json
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from core.artifacts import ArtifactStore, file_identity
+
+
+class TestArtifactStore:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_store(self, tmp_path):
+        self.store = ArtifactStore(str(tmp_path))
+        self.source_path = tmp_path / 'source.csv'
+        self.source_path.write_text('text\na\n')
+
+    def write(self, content):
+        def write(path):
+            with open(path, 'w') as f:
+                f.write(content)
+        return MagicMock(side_effect=write)
+
+    def test_built_once_while_inputs_unchanged(self):
+        inputs = {'file': file_identity(self.source_path), 'version': 1}
+        write = self.write('a')
+        path = self.store.build('index', inputs, write, '.txt')
+        assert self.store.build('index', inputs, write, '.txt') == path
+        write.assert_called_once()
+        assert open(path).read() == 'a'
+
+        # A new store on the same directory, e.g. after a restart, reuses it too
+        assert ArtifactStore(os.path.dirname(self.store.directory)).lookup('index', inputs) == path
+        entry = self.store.manifest()['index']
+        assert entry['inputs'] == inputs
+        assert entry['file'] == os.path.basename(path)
+
+    def test_changed_inputs_rebuild_and_replace(self):
+        old_path = self.store.build('index', {'file': file_identity(self.source_path)}, self.write('a'))
+        with open(self.source_path, 'a') as f:
+            f.write('b\n')
+        inputs = {'file': file_identity(self.source_path)}
+        assert self.store.lookup('index', inputs) is None
+        path = self.store.build('index', inputs, self.write('ab'))
+        assert path != old_path
+        assert not os.path.exists(old_path)
+        assert os.listdir(self.store.directory) == [os.path.basename(path)]
+
+    def test_missing_or_interrupted_artifact_rebuilt(self):
+        path = self.store.build('index', {'n': 1}, self.write('a'))
+        os.remove(path)
+        # A temporary file left by a build interrupted before the rename
+        with open(f'{path}.tmp', 'w') as f:
+            f.write('partial')
+        write = self.write('a')
+        assert self.store.build('index', {'n': 1}, write) == path
+        write.assert_called_once()
+        with open(self.store.manifest_path) as f:
+            assert json.load(f)['index']['key'] == ArtifactStore.key('index', {'n': 1})
@@ -0,0 +1,95 @@
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from core.artifacts import ArtifactStore
+from core.bulk_scoring import score_rows, score_rows_cached, auto_label
+from core.synonym_index import SynonymIndex, DocumentFrequencies, score_stacked
+
+
+class TestScoreRows:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_index(self, tmp_path):
+        self.index = SynonymIndex({
+            'fruit': ['apple', 'pear juice'],
+            'vehicle': {'car': ['car', 'sedan'], 'bike': ['bike', 'red bicycle']},
+            'empty': [],
+        })
+        self.texts = ['a red apple', 'car and bike', 'bicycle', 'nothing here', 'pear', 'sedan bicycle', '']
+        self.output_path = str(tmp_path / 'scores.npy')
+
+    def expected_scores(self):
+        class_names = self.index.class_names
+        expected = np.zeros((len(self.texts), len(class_names)), dtype=np.float32)
+        for row, text in enumerate(self.texts):
+            scores, subcategory_scores, matches = self.index.suggest(text)
+            for class_name, score in scores.items():
+                expected[row, class_names.index(class_name)] = score
+        return expected
+
+    def test_matches_suggest(self):
+        class_names = score_rows(self.index, self.texts, self.output_path, processes=1, chunk_rows=3)
+        assert class_names == self.index.class_names
+        assert np.allclose(np.load(self.output_path), self.expected_scores(), atol=1e-6)
+
+    def test_process_pool(self):
+        progress = []
+        score_rows(self.index, self.texts, self.output_path, processes=2, chunk_rows=2, progress=progress.append)
+        assert np.allclose(np.load(self.output_path), self.expected_scores(), atol=1e-6)
+        assert progress[-1] == len(self.texts)
+
+    def test_stacked_scores_match_score_vectors(self):
+        vectors = self.index.transform(self.texts)
+        matrix, row_columns = self.index.stacked()
+        stacked = score_stacked(vectors, matrix, row_columns, len(self.index.class_names))
+        assert np.allclose(stacked, self.index.score_vectors(vectors), atol=1e-6)
+
+    def test_idf_weighted_index(self):
+        frequencies = DocumentFrequencies()
+        frequencies.update(self.texts)
+        self.index = SynonymIndex(self.index.class_synonyms, idf=frequencies.idf())
+        score_rows(self.index, self.texts, self.output_path, processes=1)
+        assert np.allclose(np.load(self.output_path), self.expected_scores(), atol=1e-6)
+
+    def test_no_rows(self):
+        assert score_rows(self.index, [], self.output_path, processes=1) == self.index.class_names
+        assert np.load(self.output_path).shape == (0, 3)
+
+    def test_cached_scores_reused(self, tmp_path):
+        store = ArtifactStore(str(tmp_path))
+        class_names, path = score_rows_cached(store, self.index, self.texts, processes=1)
+        assert class_names == self.index.class_names
+        assert np.allclose(np.load(path), self.expected_scores(), atol=1e-6)
+
+        # Same texts and synonyms, nothing is scored
+        with patch('core.bulk_scoring._score_shared_texts') as score:
+            assert score_rows_cached(store, self.index, iter(self.texts), processes=1)[1] == path
+            score.assert_not_called()
+
+        self.index.update({**self.index.class_synonyms, 'fruit': ['apple']})
+        _, updated_path = score_rows_cached(store, self.index, self.texts, processes=1)
+        assert updated_path != path
+        assert not os.path.exists(path)
+
+
+class TestAutoLabel:
+
+    def test_single_class(self):
+        scores = np.array([[0.9, 0.2], [0.5, 0.6], [0.0, 0.0]], dtype=np.float32)
+        positions, classes = auto_label(scores, ['a', 'b'], ['b', 'a'], threshold=0.55)
+        assert positions.tolist() == [0, 1]
+        assert classes == [[1], [0]]
+
+    def test_multi_class(self):
+        scores = np.array([[0.9, 0.7], [0.1, 0.6], [0.0, 0.0]], dtype=np.float32)
+        positions, classes = auto_label(scores, ['a', 'b'], ['a', 'b'], threshold=0.5, single_class=False)
+        assert positions.tolist() == [0, 1]
+        assert classes == [[0, 1], [1]]
+
+    def test_classes_without_label_ignored(self):
+        scores = np.array([[0.9, 0.7]], dtype=np.float32)
+        positions, classes = auto_label(scores, ['a', 'b'], ['b'], threshold=0.5)
+        assert classes == [[0]]
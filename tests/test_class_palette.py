@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+from core.class_palette import ClassPaletteIndex
+
+
+class TestClassPaletteIndex:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_index(self):
+        self.labels = ['apple', 'pear', 'pineapple', 'vehicle', 'red wine']
+        self.index = ClassPaletteIndex(self.labels, {
+            'apple': ['granny smith'],
+            'pear': ['conference'],
+            'vehicle': {'car': ['sedan'], 'bike': ['bicycle']},
+        })
+
+    def names(self, indices):
+        return [self.labels[i] for i in indices]
+
+    def test_name_prefix_ranks_first(self):
+        assert self.names(self.index.search('p')) == ['pear', 'pineapple']
+        assert self.names(self.index.search('wi')) == ['red wine']
+
+    def test_synonyms_and_subcategories(self):
+        assert self.names(self.index.search('gran')) == ['apple']
+        assert self.names(self.index.search('bike')) == ['vehicle']
+
+    def test_scores_break_ties(self):
+        assert self.names(self.index.search('p', {'pineapple': 0.9, 'pear': 0.1})) == ['pineapple', 'pear']
+        assert self.names(self.index.search('', {'vehicle': 0.5}, limit=2)) == ['vehicle', 'apple']
+
+    def test_fuzzy_trigrams(self):
+        # A typo still finds the class through the trigrams it shares
+        assert self.names(self.index.search('vehicel')) == ['vehicle']
+        assert self.index.search('xyzzy') == []
+
+    def test_every_query_word_matches(self):
+        assert self.names(self.index.search('red w')) == ['red wine']
+        assert self.index.search('red pear') == []
+
+    def test_fast_with_many_classes(self):
+        labels = [f'class {i} item{i}' for i in range(500)]
+        index = ClassPaletteIndex(labels, {label: [f'synonym{i}', f'other {i}'] for i, label in enumerate(labels)})
+        start = time.perf_counter()
+        for query in ['c', 'cl', 'item4', 'item42', 'synonym499']:
+            index.search(query)
+        assert (time.perf_counter() - start) / 5 < 0.05
+        assert labels[index.search('item499')[0]] == 'class 499 item499'
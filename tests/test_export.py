@@ -0,0 +1,104 @@
+import json
+
+import pandas as pd
+import pytest
+
+from core.export import export_joined, export_labels
+from core.ingest import ingest, append_rows
+from core.persistence import LabelJournal
+from models import Task
+
+
+class TestExportJoined:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_task(self, tmp_path):
+        self.source_path = tmp_path / 'source.csv'
+        pd.DataFrame({'text': ['red apple', 'green pear', 'red apple'], 'id': ['1', '2', '3'],
+                      'country': ['fr', 'de', 'fr']}).to_csv(self.source_path, index=False)
+        self.data_path = tmp_path / 'data.csv'
+        ingest(str(self.source_path), self.data_path, ['text'], 'label', tmp_path / 'inputs.json',
+               tmp_path / 'row_hashes.npy')
+        df = pd.read_csv(self.data_path, dtype=str)
+        df.loc[0, 'label'] = '[0]'
+        df.loc[2, 'label'] = '[0, [1, "car"]]'
+        df.to_csv(self.data_path, index=False)
+        self.task = Task(task_name="Task", file_path=str(self.data_path), labels="fruit,vehicle",
+                         label_column_name="label", field_to_label="text", single_class=False,
+                         source_file_path=str(self.source_path))
+        self.output_path = tmp_path / 'export.csv'
+
+    def test_all_columns_with_class_names(self):
+        assert export_joined(self.task, self.output_path, chunk_rows=2) == 3
+        exported = pd.read_csv(self.output_path, dtype=str)
+        assert exported.columns.tolist() == ['text', 'id', 'country', 'label']
+        assert exported['id'].tolist() == ['1', '2', '3']
+        assert json.loads(exported['label'][0]) == ['fruit']
+        assert pd.isnull(exported['label'][1])
+        assert json.loads(exported['label'][2]) == ['fruit', 'vehicle/car']
+
+    def test_only_labelled_rows_with_journal(self, tmp_path):
+        LabelJournal(str(tmp_path / 'labels.journal')).append({1: '[1]', 2: None})
+        assert export_joined(self.task, self.output_path, only_labelled=True) == 2
+        exported = pd.read_csv(self.output_path, dtype=str)
+        assert exported['id'].tolist() == ['1', '2']
+        assert json.loads(exported['label'][1]) == ['vehicle']
+
+    def test_appended_duplicates_skipped(self, tmp_path):
+        new_path = tmp_path / 'new.csv'
+        pd.DataFrame({'text': ['green pear', 'car', 'car'], 'id': ['4', '5', '6'],
+                      'country': ['it', 'es', 'pt']}).to_csv(new_path, index=False)
+        append_rows(str(new_path), self.data_path, 'label', tmp_path / 'row_hashes.npy', tmp_path / 'inputs.json')
+        df = pd.read_csv(self.data_path, dtype=str)
+        df.loc[3, 'label'] = '[1]'
+        df.to_csv(self.data_path, index=False)
+
+        assert export_joined(self.task, self.output_path, chunk_rows=2) == 4
+        exported = pd.read_csv(self.output_path, dtype=str)
+        assert exported['id'].tolist() == ['1', '2', '3', '5']
+        assert json.loads(exported['label'][3]) == ['vehicle']
+
+    def test_row_count_mismatch(self):
+        pd.DataFrame({'text': ['red apple'], 'id': ['1'], 'country': ['fr']}).to_csv(self.source_path, index=False)
+        with pytest.raises(ValueError):
+            export_joined(self.task, self.output_path)
+
+
+class TestExportLabels:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_task(self, tmp_path):
+        self.data_path = tmp_path / 'data.csv'
+        pd.DataFrame({'text': ['red apple', 'green pear', 'car'], 'label': ['[0]', None, None]}).to_csv(
+            self.data_path, index=False)
+        self.task = Task(task_name="Task", file_path=str(self.data_path), labels="fruit,vehicle",
+                         label_column_name="label", field_to_label="text", single_class=False)
+        self.output_path = tmp_path / 'export.csv'
+
+    def test_uncompacted_journal_applied(self, tmp_path):
+        LabelJournal(str(tmp_path / 'labels.journal')).append({0: None, 2: '[1]'})
+        assert export_labels(self.task, self.output_path, chunk_rows=2) == 3
+        exported = pd.read_csv(self.output_path, dtype=str)
+        assert exported.columns.tolist() == ['text', 'label']
+        assert exported['text'].tolist() == ['red apple', 'green pear', 'car']
+        assert exported['label'].isna().tolist() == [True, True, False]
+        assert exported['label'][2] == '[1]'
+
+    def test_only_labelled_rows(self, tmp_path):
+        LabelJournal(str(tmp_path / 'labels.journal')).append({1: '[0]'})
+        assert export_labels(self.task, self.output_path, only_labelled=True) == 2
+        exported = pd.read_csv(self.output_path, dtype=str)
+        assert exported['text'].tolist() == ['red apple', 'green pear']
+
+    def test_field_read_from_original_file(self, tmp_path):
+        source_path = tmp_path / 'source.csv'
+        pd.DataFrame({'text': ['red apple', 'green pear', 'car'], 'id': ['1', '2', '3']}).to_csv(source_path,
+                                                                                             index=False)
+        pd.DataFrame({'label': ['[0]', None, '[1]']}).to_csv(self.data_path, index=False)
+        self.task.source_file_path = str(source_path)
+        self.task.field_in_source = True
+        assert export_labels(self.task, self.output_path, chunk_rows=2) == 3
+        exported = pd.read_csv(self.output_path, dtype=str)
+        assert exported.columns.tolist() == ['text', 'label']
+        assert exported['text'].tolist() == ['red apple', 'green pear', 'car']
+        assert exported['label'][2] == '[1]'
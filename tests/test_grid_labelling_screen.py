@@ -0,0 +1,197 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+from unittest.mock import MagicMock
+from PyQt6.QtCore import Qt
+from sqlalchemy.orm import sessionmaker
+
+from core.artifacts import ArtifactStore
+from core.label_store import LabelStore
+from models import Base, Task, create_database_engine
+from screens.grid_labelling_screen import GridLabellingWindow, LabelPageModel
+
+
+class TestGridLabellingWindow:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_task(self, qtbot, tmp_path):
+        self.engine = create_database_engine(f'sqlite:///{tmp_path}/tasks.db')
+        self.Session = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        self.session = self.Session()
+
+        self.data_path = tmp_path / 'data.csv'
+        pd.DataFrame({'description': ['red apple', 'green pear', 'apple pie', 'pear juice', 'apple'],
+                      'label': [None] * 5}).to_csv(self.data_path, index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        with open(synonyms_path, 'w') as f:
+            json.dump({'apple': ['apple'], 'pear': ['pear']}, f)
+
+        task = Task(task_name="Task 1", file_path=str(self.data_path), labels="apple,pear",
+                    label_column_name="label", synonyms_file_path=str(synonyms_path), field_to_label="description",
+                    single_class=True, task_uuid="uuid1")
+        self.session.add(task)
+        self.session.commit()
+
+        self.window = GridLabellingWindow(self.Session, "uuid1", page_size=2)
+        qtbot.addWidget(self.window)
+
+        yield
+
+        self.window.close()
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_first_page(self, qtbot):
+        assert self.window.model.rowCount() == 2
+        assert self.window.model.index(0, 1).data() == 'red apple'
+
+    def test_suggestions_prefilled(self, qtbot):
+        qtbot.waitUntil(lambda: self.window.model.page_labels() == [[0], [1]])
+        assert self.window.model.index(1, LabelPageModel.LABEL_COLUMN).data() == 'pear'
+
+    def test_commit_page(self, qtbot):
+        self.window.page_scoring_thread.wait()
+        qtbot.wait(10)
+        self.window.model.setData(self.window.model.index(0, LabelPageModel.LABEL_COLUMN), 'pear')
+        self.window.on_commit_button_clicked()
+        self.window.save_pipeline.flush()
+
+        saved = pd.read_csv(self.data_path)
+        assert saved['label'].tolist()[:2] == ['[1]', '[1]']
+        assert saved['label'][2:].isnull().all()
+        assert self.window.model.index(0, 1).data() == 'apple pie'
+        assert self.window.labelled_count == 2
+
+    def test_rows_without_label_left_unlabelled(self, qtbot):
+        self.window.page_scoring_thread.wait()
+        qtbot.wait(10)
+        # As if nothing was suggested for the second row
+        self.window.model.pending[1] = []
+        self.window.on_commit_button_clicked()
+        assert self.window.label_store.get(0) == [0]
+        assert self.window.label_store.get(1) is None
+        assert self.window.labelled_count == 1
+
+    def test_previous_page_keeps_labels(self, qtbot):
+        self.window.page_scoring_thread.wait()
+        qtbot.wait(10)
+        self.window.on_commit_button_clicked()
+        self.window.on_previous_button_clicked()
+        assert self.window.model.edited == {0, 1}
+
+
+    def test_synonyms_hot_reload(self, qtbot):
+        qtbot.waitUntil(lambda: self.window.model.page_labels() == [[0], [1]])
+        with open(self.window.project_data.synonyms_file_path, 'w') as f:
+            json.dump({'apple': ['apple', 'green'], 'pear': ['juice']}, f)
+        self.window.synonyms_watcher.reload()
+
+        # Only 'green pear' now scores best for another class
+        assert self.window.model.page_labels() == [[0], [0]]
+
+    def test_undo_redo_committed_page(self, qtbot):
+        self.window.page_scoring_thread.wait()
+        qtbot.wait(10)
+        self.window.on_commit_button_clicked()
+        self.window.page_scoring_thread.wait()
+        qtbot.wait(10)
+        self.window.on_commit_button_clicked()
+        assert self.window.labelled_count == 4
+
+        # The second page is undone as a whole and shown again
+        self.window.on_undo_button_clicked()
+        assert [self.window.label_store.get(index) for index in range(4)] == [[0], [1], None, None]
+        assert self.window.labelled_count == 2
+        assert self.window.model.index(0, 1).data() == 'apple pie'
+
+        self.window.on_redo_button_clicked()
+        assert self.window.label_store.get(3) == [1]
+        assert self.window.labelled_count == 4
+
+    def test_auto_label_undone(self, qtbot):
+        self.window.threshold_spinbox.setValue(0.6)
+        self.window.on_auto_label_button_clicked()
+        qtbot.waitUntil(lambda: not self.window.auto_label_thread.isRunning())
+        qtbot.wait(10)
+        assert self.window.label_store.get(4) == [0]
+        self.window.on_undo_button_clicked()
+        assert self.window.label_store.get(4) is None
+        assert self.window.labelled_count == 0
+
+    def test_scores_of_other_synonyms_dropped(self, qtbot):
+        self.window.page_scoring_thread.wait()
+        qtbot.wait(10)
+        self.window.score_matrix.add = MagicMock()
+        self.window._start_page_scoring_thread = MagicMock()
+        # Another window's index can have the same version for other synonyms
+        self.window.on_page_scored(([0], None, None, ['apple'], 'other synonyms', self.window.page_generation))
+        self.window.score_matrix.add.assert_not_called()
+        self.window._start_page_scoring_thread.assert_called_once()
+
+    def test_superseded_scorer_not_waited_for(self, qtbot):
+        self.window.page_scoring_thread.wait()
+        qtbot.wait(10)
+        scorer = self.window.page_scoring_thread = MagicMock()
+        scorer.isRunning.return_value = True
+        generation = self.window.page_generation
+        self.window._start_page_scoring_thread()
+        scorer.wait.assert_not_called()
+        assert self.window.retired_scoring_threads == [scorer]
+        assert self.window.page_generation == generation + 1
+        self.window.score_matrix.add = MagicMock()
+        # Results of the previous scorer arriving late are ignored
+        self.window.on_page_scored(([0], None, None, self.window.synonym_index.class_names,
+                                    self.window.synonym_index.fingerprint, generation))
+        self.window.score_matrix.add.assert_not_called()
+
+    def test_auto_label(self, qtbot):
+        self.window.threshold_spinbox.setValue(0.6)
+        self.window.on_auto_label_button_clicked()
+        qtbot.waitUntil(lambda: not self.window.auto_label_thread.isRunning())
+        qtbot.wait(10)
+        self.window.save_pipeline.flush()
+
+        # Only 'apple' is covered by its exact match for more than 60% of the text
+        saved = pd.read_csv(self.data_path)['label'].tolist()
+        assert saved[4] == '[0]'
+        assert pd.isnull(saved[0])
+        assert self.window.labelled_count == sum(not pd.isnull(label) for label in saved)
+        assert 'suggestion_scores' in ArtifactStore(str(self.data_path.parent)).manifest()
+
+
+    def test_field_read_from_original_file(self, qtbot, tmp_path):
+        self.window.close()
+        source_path = tmp_path / 'source.csv'
+        pd.read_csv(self.data_path)[['description']].to_csv(source_path, index=False)
+        pd.DataFrame({'label': [None] * 5}).to_csv(self.data_path, index=False)
+        task = self.session.query(Task).filter_by(task_uuid="uuid1").first()
+        task.source_file_path = str(source_path)
+        task.field_in_source = True
+        self.session.commit()
+
+        self.window = GridLabellingWindow(self.Session, "uuid1", page_size=2)
+        qtbot.addWidget(self.window)
+        assert self.window.model.index(1, 1).data() == 'green pear'
+        qtbot.waitUntil(lambda: self.window.model.page_labels() == [[0], [1]])
+
+        self.window.threshold_spinbox.setValue(0.6)
+        self.window.on_auto_label_button_clicked()
+        qtbot.waitUntil(lambda: not self.window.auto_label_thread.isRunning())
+        qtbot.wait(10)
+        assert self.window.label_store.get(4) == [0]
+
+
+class TestLabelPageModel:
+
+    def test_set_data_rejects_unknown_class(self, qtbot):
+        df = pd.DataFrame({'description': ['a', 'b']})
+        model = LabelPageModel(LabelStore(df, 'label'), 'description', ['x', 'y'], single_class=False)
+        model.set_page(LabelStore(df, 'label').unlabelled_positions())
+
+        assert not model.setData(model.index(0, LabelPageModel.LABEL_COLUMN), 'z')
+        assert model.setData(model.index(0, LabelPageModel.LABEL_COLUMN), 'x, y')
+        assert model.page_labels() == [[0, 1], []]
+        assert model.flags(model.index(0, 1)) & Qt.ItemFlag.ItemIsEditable == Qt.ItemFlag.NoItemFlags
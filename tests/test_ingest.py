@@ -0,0 +1,109 @@
+import bz2
+import gzip
+import json
+
+import pandas as pd
+import pytest
+
+from core.ingest import expand_inputs, input_format, ingest, read_columns, append_rows
+
+
+class TestIngest:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_inputs(self, tmp_path):
+        self.directory = tmp_path / 'shards'
+        self.directory.mkdir()
+        with gzip.open(self.directory / 'part-0.csv.gz', 'wt') as f:
+            pd.DataFrame({'text': ['red apple', 'two\nlines'], 'id': ['1', '2']}).to_csv(f, index=False)
+        with bz2.open(self.directory / 'part-1.csv.bz2', 'wt') as f:
+            pd.DataFrame({'text': ['green pear'], 'id': ['3']}).to_csv(f, index=False)
+        with open(self.directory / 'part-2.jsonl', 'w') as f:
+            f.write(json.dumps({'text': 'car', 'id': 4}) + '\n')
+            f.write(json.dumps({'id': 5}) + '\n')
+        self.output_path = tmp_path / 'data.csv'
+        self.inputs_path = tmp_path / 'inputs.json'
+
+    def test_input_format(self):
+        assert input_format('a.csv') == (None, 'csv')
+        assert input_format('a.CSV.GZ') == ('gzip', 'csv')
+        assert input_format('a.jsonl.zst') == ('zstd', 'jsonl')
+
+    def test_expand_inputs_sorted(self):
+        paths = expand_inputs(str(self.directory / 'part-*'))
+        assert [path.rsplit('/', 1)[1] for path in paths] == ['part-0.csv.gz', 'part-1.csv.bz2', 'part-2.jsonl']
+        with pytest.raises(FileNotFoundError):
+            expand_inputs(str(self.directory / 'missing-*'))
+
+    def test_read_columns(self):
+        assert read_columns(str(self.directory / 'part-*')).columns.tolist() == ['text', 'id']
+
+    def test_ingest_shards_with_global_row_ids(self):
+        rows = ingest(str(self.directory / 'part-*'), self.output_path, ['text', 'id'], 'label', self.inputs_path,
+                      chunk_rows=1)
+        assert rows == 5
+        df = pd.read_csv(self.output_path, dtype=str)
+        assert df.columns.tolist() == ['text', 'id', 'label']
+        assert df['text'].tolist()[:4] == ['red apple', 'two\nlines', 'green pear', 'car']
+        assert pd.isnull(df.loc[4, 'text'])
+        assert df['id'].tolist() == ['1', '2', '3', '4', '5']
+        assert df['label'].isnull().all()
+        with open(self.inputs_path) as f:
+            inputs = json.load(f)
+        assert [(entry['first_row'], entry['rows']) for entry in inputs] == [(0, 2), (2, 1), (3, 2)]
+
+    def test_zstd(self, tmp_path):
+        zstandard = pytest.importorskip('zstandard')
+        path = tmp_path / 'data.csv.zst'
+        path.write_bytes(zstandard.ZstdCompressor().compress(b'text\nred apple\n'))
+        assert ingest(str(path), self.output_path, ['text'], 'label') == 1
+
+
+class TestAppendRows:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_task(self, tmp_path):
+        self.source_path = tmp_path / 'source.csv'
+        pd.DataFrame({'text': ['red apple', 'green pear'], 'id': ['1', '2']}).to_csv(self.source_path, index=False)
+        self.data_path = tmp_path / 'data.csv'
+        self.hashes_path = tmp_path / 'row_hashes.npy'
+        self.inputs_path = tmp_path / 'inputs.json'
+        ingest(str(self.source_path), self.data_path, ['text'], 'label', self.inputs_path, self.hashes_path)
+        # A labelled row must keep its label
+        df = pd.read_csv(self.data_path, dtype=str)
+        df.loc[0, 'label'] = '[0]'
+        df.to_csv(self.data_path, index=False)
+        self.new_path = tmp_path / 'new.csv'
+        pd.DataFrame({'text': ['green pear', 'car', 'bike', 'car'], 'id': ['2', '3', '4', '5']}).to_csv(
+            self.new_path, index=False)
+
+    def test_appends_only_new_rows(self):
+        chunks = []
+        appended, duplicates = append_rows(str(self.new_path), self.data_path, 'label', self.hashes_path,
+                                           self.inputs_path, chunks.append, chunk_rows=3)
+        assert (appended, duplicates) == (2, 2)
+        df = pd.read_csv(self.data_path)
+        assert df['text'].tolist() == ['red apple', 'green pear', 'car', 'bike']
+        assert df['label'].tolist()[0] == '[0]'
+        assert df['label'].isnull().tolist()[1:] == [True, True, True]
+        assert sum(len(chunk) for chunk in chunks) == 2
+        with open(self.inputs_path) as f:
+            inputs = json.load(f)
+        assert [(entry['first_row'], entry['rows']) for entry in inputs] == [(0, 2), (2, 2)]
+
+        # Appending the same file again adds nothing
+        assert append_rows(str(self.new_path), self.data_path, 'label', self.hashes_path, self.inputs_path) == (0, 4)
+
+    def test_hashes_built_for_older_tasks(self):
+        self.hashes_path.unlink()
+        self.inputs_path.unlink()
+        assert append_rows(str(self.new_path), self.data_path, 'label', self.hashes_path,
+                           self.inputs_path) == (2, 2)
+        with open(self.inputs_path) as f:
+            assert json.load(f)[-1]['first_row'] == 2
+
+    def test_refused_for_label_only_task(self):
+        pd.DataFrame({'label': ['[0]', None]}).to_csv(self.data_path, index=False)
+        with pytest.raises(ValueError):
+            append_rows(str(self.new_path), self.data_path, 'label', self.hashes_path, self.inputs_path)
+        assert pd.read_csv(self.data_path).shape == (2, 1)
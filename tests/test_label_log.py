@@ -0,0 +1,78 @@
+from core.label_log import LabelLog
+
+
+class TestLabelLog:
+
+    def test_undo_redo(self):
+        log = LabelLog()
+        log.record(0, None, [1])
+        log.record(1, None, [2])
+
+        assert log.undo().index == 1
+        assert log.redo().index == 1
+        assert log.undo().index == 1
+        assert log.undo().index == 0
+        assert log.undo() is None
+
+    def test_record_clears_redo(self):
+        log = LabelLog()
+        log.record(0, None, [1])
+        log.undo()
+        log.record(1, None, [2])
+        assert log.redo() is None
+
+    def test_ring_is_bounded(self):
+        log = LabelLog(capacity=3)
+        for i in range(10):
+            log.record(i, None, [0])
+        assert len(log.operations) == 3
+        assert log.get(9).index == 9
+        assert log.get(7).index == 7
+        assert log.get(6) is None
+        assert log.get(10) is None
+
+    def test_tail_reloaded_from_disk(self, tmp_path):
+        file_path = tmp_path / 'label_log.jsonl'
+        log = LabelLog(str(file_path))
+        for i in range(5):
+            log.record(i, None, [i])
+        log.close()
+
+        # Simulate a crash in the middle of writing a line
+        with open(file_path, 'a') as f:
+            f.write('{"index": 5, "ol')
+
+        reopened = LabelLog(str(file_path), capacity=2)
+        assert [operation.index for operation in reopened.operations] == [3, 4]
+        assert reopened.undo().new == [4]
+        reopened.close()
+
+    def test_background_writes(self, tmp_path):
+        file_path = tmp_path / 'label_log.jsonl'
+        log = LabelLog(str(file_path), background=True)
+        for i in range(100):
+            log.record(i, None, [i])
+        log.undo()
+        log.close()
+
+        reopened = LabelLog(str(file_path))
+        # The undo is appended as the inverse change
+        assert reopened.count == 101
+        assert reopened.operations[-1] == (99, [99], None, False)
+        reopened.close()
+
+    def test_batch_undone_as_a_whole(self, tmp_path):
+        file_path = tmp_path / 'label_log.jsonl'
+        log = LabelLog(str(file_path))
+        log.record(0, None, [1])
+        operation = log.record_many([1, 2], [None, [0]], [[1], [1]])
+        assert operation.rows() == [(1, None, [1]), (2, [0], [1])]
+        assert operation.first_index == 1
+        assert log.undo() == operation
+        assert log.redo() == operation
+        log.close()
+
+        reopened = LabelLog(str(file_path))
+        assert reopened.operations[-1].batch
+        assert reopened.operations[-1].rows() == [(1, None, [1]), (2, [0], [1])]
+        reopened.close()
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.label_store import LabelStore, compact_columns, memory_report, mask_dtype
+
+
+class TestLabelStore:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_df(self):
+        self.df = pd.DataFrame({
+            'description': ['apple', 'red car', 'bike', 'pear'],
+            'label': ['[0]', '[0, 2]', None, '[0, [1, "car"]]'],
+        })
+
+    def test_mask_dtype(self):
+        assert mask_dtype(3) == np.uint8
+        assert mask_dtype(9) == np.uint16
+        assert mask_dtype(32) == np.uint32
+        assert mask_dtype(40) == np.uint64
+
+    def test_labels_kept_as_bitmasks(self):
+        store = LabelStore(self.df, 'label', class_count=3)
+        assert 'label' not in self.df.columns
+        assert store.masks.dtype == np.uint8
+        assert store.masks.tolist() == [1, 5, 0, 0]
+        assert store.get(0) == [0]
+        assert store.get(1) == [0, 2]
+        assert store.get(2) is None
+        # Subcategory pairs cannot be a bitmask
+        assert store.get(3) == [0, [1, 'car']]
+        assert store.unlabelled_positions().tolist() == [2]
+        assert store.labelled_count() == 3
+
+    def test_set_and_snapshot_round_trip(self):
+        store = LabelStore(self.df, 'label', class_count=3)
+        store.set(2, [1])
+        store.set(0, None)
+        store.set_many([1, 3], [[2, 0], [[2, 'big']]])
+        assert store.take_dirty() == {0, 1, 2, 3}
+        snapshot = store.snapshot()
+        assert snapshot.columns.tolist() == ['description', 'label']
+        assert snapshot['label'].isna().tolist() == [True, False, False, False]
+        assert snapshot['label'].tolist()[1:] == ['[2, 0]', '[1]', '[[2, "big"]]']
+        assert LabelStore(snapshot, 'label', class_count=3).get(1) == [2, 0]
+
+    def test_unlabelled(self):
+        store = LabelStore(self.df, 'label', class_count=3)
+        assert store.unlabelled(np.array([2, 0])).tolist() == [True, False]
+
+    def test_memory_report(self):
+        df = pd.DataFrame({'description': [f'row {i}' for i in range(100)],
+                           'country': ['fr', 'de'] * 50,
+                           'label': ['[0, 1]'] * 100})
+        store = LabelStore(df, 'label', class_count=2)
+        compact_columns(df, exclude=['description'])
+        assert isinstance(df['country'].dtype, pd.CategoricalDtype)
+        assert not isinstance(df['description'].dtype, pd.CategoricalDtype)
+        report = memory_report(store)
+        assert report['label_dtype'] == 'uint8'
+        assert report['labels'] == 200
+        assert report['labels'] < report['labels_as_strings']
+        assert set(report['columns']) == {'description', 'country'}
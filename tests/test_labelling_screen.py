@@ -0,0 +1,565 @@
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+from PyQt6.QtCore import Qt, QEvent
+from PyQt6.QtGui import QKeyEvent
+from PyQt6.QtWidgets import QApplication
+from sqlalchemy.orm import sessionmaker
+
+from core.artifacts import ArtifactStore
+from core.ingest import append_rows
+from core.persistence import LabelJournal
+from core.resource_pool import shared_resources
+from core.sharding import ShardManager
+from core.task_files import directory_size
+from models import Base, Task, create_database_engine
+from screens.labelling_screen import LabelingProjectWindow, DatabaseWriterThread
+
+
+class TestLabelingProjectWindow:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_window(self, qtbot, tmp_path):
+        self.engine = create_database_engine(f'sqlite:///{tmp_path}/tasks.db')
+        self.Session = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        self.session = self.Session()
+
+        self.task_directory = tmp_path
+        self.data_path = tmp_path / 'data.csv'
+        pd.DataFrame({'description': ['red apple', 'green pear', 'apple pie', 'pear juice'],
+                      'label': [None] * 4}).to_csv(self.data_path, index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        with open(synonyms_path, 'w') as f:
+            json.dump({'apple': ['apple'], 'pear': ['pear']}, f)
+
+        task = Task(task_name="Task 1", file_path=str(self.data_path), labels="apple,pear",
+                    label_column_name="label", synonyms_file_path=str(synonyms_path), field_to_label="description",
+                    single_class=True, task_uuid="uuid1")
+        self.session.add(task)
+        self.session.commit()
+
+        self.window = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(self.window)
+
+        yield
+
+        self.window.text_processing_thread.wait()
+        self.window.close()
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def label_current(self, class_index, qtbot):
+        # Let the suggestion for the sample arrive first, it may already have selected the class
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        if not self.window.class_buttons[class_index].isChecked():
+            self.window.class_buttons[class_index].click()
+        self.window.on_next_button_clicked()
+
+    def test_next_labels_and_advances(self, qtbot):
+        self.label_current(1, qtbot)
+        assert self.window.label_store.get(0) == [1]
+        assert self.window.current_index == 1
+        assert self.window.labelled_count == 1
+
+    def test_previous_shows_last_labelled_sample(self, qtbot):
+        self.label_current(0, qtbot)
+        self.label_current(1, qtbot)
+        self.window.on_previous_button_clicked()
+        assert self.window.current_index == 1
+        assert self.window.selected_classes == [1]
+        self.window.on_previous_button_clicked()
+        assert self.window.current_index == 0
+        assert self.window.selected_classes == [0]
+
+    def test_relabel_previous_then_return(self, qtbot):
+        self.label_current(0, qtbot)
+        self.label_current(0, qtbot)
+        self.window.on_previous_button_clicked()
+        self.window.on_previous_button_clicked()
+        self.label_current(1, qtbot)
+        assert self.window.label_store.get(0) == [1]
+        assert self.window.current_index == 1
+        self.window.on_next_button_clicked()
+        assert self.window.current_index == 2
+
+    def test_undone_rows_shown_again(self, qtbot):
+        self.label_current(0, qtbot)
+        self.label_current(1, qtbot)
+        self.window.on_undo_button_clicked()
+        self.window.on_undo_button_clicked()
+        assert self.window.current_index == 0
+        self.label_current(1, qtbot)
+        # Row 1 was unlabelled by the undo, Next returns to it before row 2
+        assert self.window.current_index == 1
+        assert self.window.label_store.get(1) is None
+
+    def test_exact_matches_highlighted(self, qtbot):
+        qtbot.waitUntil(lambda: self.window.tfidf_results_edit.toPlainText() != '')
+        selections = self.window.description_edit.extraSelections()
+        assert [selection.cursor.selectedText() for selection in selections] == ['apple']
+        assert self.window.tfidf_results_edit.toPlainText().startswith('Exact matches: apple')
+        assert self.window.selected_classes == [0]
+
+    def test_class_palette(self, qtbot):
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        qtbot.keyClick(self.window, '/')
+        assert self.window.palette_open
+        qtbot.keyClicks(self.window.palette_edit, 'pe')
+        assert self.window.palette_list.item(0).text().startswith('pear')
+        qtbot.keyClick(self.window.palette_edit, Qt.Key.Key_Return)
+        assert not self.window.palette_open
+        assert self.window.selected_classes == [1]
+
+    def test_more_classes_than_shortcut_keys(self, qtbot):
+        task = self.session.query(Task).filter_by(task_uuid="uuid1").first()
+        task.labels = ",".join(f"class{i}" for i in range(30))
+        self.session.commit()
+        self.window.text_processing_thread.wait()
+        self.window.close()
+        window = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(window)
+        assert window.class_buttons[29].text() == 'class29'
+        window.open_palette()
+        qtbot.keyClicks(window.palette_edit, 'class29')
+        qtbot.keyClick(window.palette_edit, Qt.Key.Key_Return)
+        assert window.selected_classes == [29]
+        window.text_processing_thread.wait()
+        window.close()
+
+    def test_keys_labelled_at_once_and_shown_once(self, qtbot):
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        qtbot.keyClick(self.window, '2')
+        qtbot.keyClick(self.window, Qt.Key.Key_Space)
+        qtbot.keyClick(self.window, '2')
+        qtbot.keyClick(self.window, Qt.Key.Key_Space)
+        # The labels are changed by the keys, the sample they moved to is shown from the event loop
+        assert self.window.label_store.get(0) == [1]
+        assert self.window.label_store.get(1) == [1]
+        assert self.window.current_index == 2
+        assert self.window.key_commands.render_pending()
+        assert self.window.description_edit.toPlainText() == 'red apple'
+        qtbot.waitUntil(lambda: not self.window.key_commands.render_pending())
+        assert self.window.description_edit.toPlainText() == 'apple pie'
+        assert self.window.labelled_samples_count_label.text() == "Number of labelled samples: 2"
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        assert self.window.selected_classes == [0]
+
+    def test_auto_repeat_limited_to_shown_samples(self, qtbot):
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        for _ in range(3):
+            QApplication.sendEvent(self.window, QKeyEvent(QEvent.Type.KeyPress, Qt.Key.Key_Space,
+                                                          Qt.KeyboardModifier.NoModifier, ' ', True))
+        # The repeats sent before the next sample was shown are dropped
+        assert self.window.current_index == 1
+        qtbot.waitUntil(lambda: not self.window.key_commands.render_pending())
+        qtbot.wait(20)
+        QApplication.sendEvent(self.window, QKeyEvent(QEvent.Type.KeyPress, Qt.Key.Key_Space,
+                                                      Qt.KeyboardModifier.NoModifier, ' ', True))
+        assert self.window.current_index == 2
+
+    def test_only_changed_buttons_restyled(self, qtbot):
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        for btn in self.window.class_buttons:
+            btn.setStyleSheet = MagicMock()
+        self.window.class_buttons[1].click()
+        # Single class: the suggested class is deselected and the clicked one selected
+        assert [btn.setStyleSheet.call_count for btn in self.window.class_buttons] == [1, 1]
+        self.window.on_next_button_clicked()
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        # 'green pear' is suggested the same class, the other button is left alone
+        assert self.window.class_buttons[0].setStyleSheet.call_count == 1
+        self.window.class_buttons[1].setStyleSheet.assert_called_with(self.window.checked_styles[1])
+
+    def test_long_description_truncated(self, qtbot):
+        self.window.project_data.display_limit = 100
+        self.window.project_data.scoring_limit = 50
+        self.window.df.loc[0, 'description'] = 'apple ' * 50
+        self.window._show_current_sample()
+        assert len(self.window.description_edit.toPlainText()) == 100
+        assert not self.window.load_more_btn.isHidden()
+        assert len(self.window.text_processing_thread.description) == 50
+
+        self.window.on_load_more_button_clicked()
+        self.window.on_load_more_button_clicked()
+        assert self.window.description_edit.toPlainText() == 'apple ' * 50
+        assert self.window.load_more_btn.isHidden()
+
+        # Exact matches are only found in the scored prefix
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        assert len(self.window.description_edit.extraSelections()) == 8
+
+    def test_suggestions_cached(self, qtbot):
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        self.window._start_text_processing_thread()
+        self.window.text_processing_thread.wait()
+        assert self.window.suggestion_cache.stats()['hits'] == 1
+        assert os.path.exists(self.task_directory / 'suggestion_cache.sqlite')
+
+    def test_undo_and_redo(self, qtbot):
+        self.label_current(0, qtbot)
+        self.label_current(1, qtbot)
+
+        self.window.on_undo_button_clicked()
+        assert self.window.current_index == 1
+        assert self.window.label_store.get(1) is None
+        assert self.window.labelled_count == 1
+
+        self.window.on_undo_button_clicked()
+        assert self.window.current_index == 0
+        assert self.window.label_store.get(0) is None
+
+        self.window.on_redo_button_clicked()
+        self.window.on_redo_button_clicked()
+        assert self.window.label_store.get(0) == [0]
+        assert self.window.label_store.get(1) == [1]
+        assert self.window.current_index == 2
+
+    def test_operations_written_to_disk(self, qtbot):
+        self.label_current(1, qtbot)
+        with open(self.task_directory / 'label_log.jsonl') as f:
+            records = [json.loads(line) for line in f]
+        assert records[0]['index'] == 0
+        assert records[0]['old'] is None
+        assert records[0]['new'] == [1]
+
+    def test_save_changes_journals_dirty_rows(self, qtbot):
+        self.label_current(1, qtbot)
+        self.window.save_changes()
+        self.window.save_pipeline.file_saving_thread.wait()
+
+        # data.csv is untouched until the journal is compacted
+        assert pd.read_csv(self.data_path)['label'].isnull().all()
+        assert self.window.save_pipeline.journal.replay() == {0: '[1]'}
+
+        reopened = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(reopened)
+        assert reopened.label_store.get(0) == [1]
+        assert reopened.current_index == 1
+        reopened.text_processing_thread.wait()
+        reopened.close()
+
+    def test_overlapping_saves_coalesce(self, qtbot):
+        pipeline = self.window.save_pipeline
+        self.label_current(0, qtbot)
+        running_thread = MagicMock()
+        running_thread.isRunning.return_value = True
+        pipeline.file_saving_thread = running_thread
+
+        self.window.save_changes()
+        self.label_current(1, qtbot)
+        self.window.save_changes()
+        assert pipeline.pending
+        assert pipeline.file_saving_thread is running_thread
+
+        # When the running save finishes, one follow-up save writes every row changed in the meantime
+        pipeline.on_save_done()
+        pipeline.file_saving_thread.wait()
+        assert pipeline.journal.replay() == {0: '[0]', 1: '[1]'}
+
+    def test_save_button_compacts_journal(self, qtbot):
+        self.label_current(1, qtbot)
+        self.window.save_changes()
+        self.window.on_save_button_clicked()
+        self.window.save_pipeline.flush(compact=False)
+
+        assert pd.read_csv(self.data_path)['label'].tolist()[0] == '[1]'
+        assert self.window.save_pipeline.journal.replay() == {}
+
+    def test_progress_written_by_database_writer(self, qtbot):
+        self.label_current(0, qtbot)
+        self.label_current(1, qtbot)
+        self.window.database_writer.stop()
+
+        session = self.Session()
+        assert session.query(Task).filter_by(task_uuid="uuid1").first().labelled_samples == 2
+        session.close()
+
+    def test_annotator_labels_leased_shard(self, qtbot):
+        ShardManager(str(self.task_directory)).create_shards([0, 1, 2, 3], shard_size=2)
+        window = LabelingProjectWindow(self.Session, "uuid1", annotator="alice")
+        qtbot.addWidget(window)
+        shard_rows = ShardManager(str(self.task_directory)).shard_rows(window.shard_lease.shard_id)
+        assert window.current_index == shard_rows[0]
+
+        window.on_next_button_clicked()
+        window.on_next_button_clicked()
+        assert window.current_index is None
+        window.text_processing_thread.wait()
+        window.close()
+
+        # Labels went to the annotator journal, the canonical data file is left for the merge
+        assert set(LabelJournal(str(self.task_directory / 'journals' / 'alice.journal')).replay()) == set(shard_rows)
+        assert pd.read_csv(self.data_path)['label'].isnull().all()
+        assert os.path.exists(self.task_directory / 'shards' / f'{window.shard_lease.shard_id}.done')
+
+    def test_invalid_annotator_refused_before_filtering_keys(self, qtbot):
+        ShardManager(str(self.task_directory)).create_shards([0, 1, 2, 3], shard_size=2)
+        with patch.object(QApplication, 'installEventFilter') as install_event_filter:
+            with pytest.raises(ValueError):
+                LabelingProjectWindow(self.Session, "uuid1", annotator="../alice")
+        install_event_filter.assert_not_called()
+
+    def test_tasks_with_same_synonyms_share_index(self, qtbot, tmp_path):
+        task_directory = tmp_path / 'task2'
+        task_directory.mkdir()
+        data_path = task_directory / 'data.csv'
+        pd.DataFrame({'description': ['pear tart', 'apple'], 'label': [None] * 2}).to_csv(data_path, index=False)
+        synonyms_path = task_directory / 'synonyms.json'
+        with open(synonyms_path, 'w') as f:
+            json.dump({'apple': ['apple'], 'pear': ['pear']}, f)
+        self.session.add(Task(task_name="Task 2", file_path=str(data_path), labels="apple,pear",
+                              label_column_name="label", synonyms_file_path=str(synonyms_path),
+                              field_to_label="description", single_class=True, task_uuid="uuid2"))
+        self.session.commit()
+
+        window = LabelingProjectWindow(self.Session, "uuid2")
+        qtbot.addWidget(window)
+        assert window.synonym_index is self.window.synonym_index
+        window.text_processing_thread.wait()
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+
+        # Keys only go to the window they are typed in
+        qtbot.keyClick(window, '1')
+        assert 0 in window.selected_classes
+        assert 0 in self.window.selected_classes
+        qtbot.keyClick(self.window, '1')
+        assert 0 in window.selected_classes
+        assert 0 not in self.window.selected_classes
+
+        key = window.synonym_index_key
+        window.close()
+        assert key in shared_resources
+        self.window.close()
+        assert key not in shared_resources
+
+
+class TestDatabaseWriterThread:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_writer(self, tmp_path):
+        self.engine = create_database_engine(f'sqlite:///{tmp_path}/tasks.db')
+        self.Session = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        session = self.Session()
+        session.add(Task(task_name="Task 1", file_path=str(tmp_path), labels="a,b", label_column_name="label",
+                         field_to_label="description", single_class=True, task_uuid="uuid1"))
+        session.commit()
+        session.close()
+
+        yield
+
+        Base.metadata.drop_all(self.engine)
+
+    def test_updates_coalesced(self, qtbot):
+        writer = DatabaseWriterThread(self.Session, interval_ms=10000)
+        writer.start()
+        for labelled_samples in range(1, 101):
+            writer.update_progress("uuid1", labelled_samples)
+        commits = []
+        writer.done.connect(lambda: commits.append(True))
+        writer.stop()
+        qtbot.wait(10)
+
+        session = self.Session()
+        assert session.query(Task).filter_by(task_uuid="uuid1").first().labelled_samples == 100
+        session.close()
+        assert len(commits) == 1
+
+    def test_disk_size_measured_on_writer_thread(self, qtbot, tmp_path):
+        task_directory = tmp_path / 'task'
+        task_directory.mkdir()
+        (task_directory / 'data.csv').write_text('a' * 100)
+        writer = DatabaseWriterThread(self.Session, interval_ms=10000)
+        writer.start()
+        with patch('screens.labelling_screen.directory_size', wraps=directory_size) as measure:
+            writer.update_disk_size("uuid1", str(task_directory))
+            measure.assert_not_called()
+            writer.stop()
+        assert measure.call_count == 1
+
+        session = self.Session()
+        assert session.query(Task).filter_by(task_uuid="uuid1").first().disk_size == 100
+        session.close()
+
+    def test_wal_mode(self):
+        with self.engine.connect() as connection:
+            assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+
+
+class TestHierarchicalLabelling:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_window(self, qtbot, tmp_path):
+        self.engine = create_database_engine(f'sqlite:///{tmp_path}/tasks.db')
+        self.Session = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        self.session = self.Session()
+
+        self.data_path = tmp_path / 'data.csv'
+        pd.DataFrame({'description': ['a red sedan', 'a mountain bike'], 'label': [None] * 2}).to_csv(
+            self.data_path, index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        with open(synonyms_path, 'w') as f:
+            json.dump({'fruit': ['apple'], 'vehicle': {'car': ['sedan', 'car'], 'bike': ['bike']}}, f)
+
+        task = Task(task_name="Task 1", file_path=str(self.data_path), labels="fruit,vehicle",
+                    label_column_name="label", synonyms_file_path=str(synonyms_path), field_to_label="description",
+                    single_class=True, hierarchical_labels=True, task_uuid="uuid1")
+        self.session.add(task)
+        self.session.commit()
+
+        self.window = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(self.window)
+
+        yield
+
+        self.window.text_processing_thread.wait()
+        self.window.close()
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def wait_for_suggestion(self, qtbot):
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+
+    def test_best_subcategory_suggested(self, qtbot):
+        self.wait_for_suggestion(qtbot)
+        assert self.window._current_label() == [[1, 'car']]
+        assert 'vehicle/car' in self.window.tfidf_results_edit.toPlainText()
+        self.window.on_next_button_clicked()
+        assert self.window.label_store.get(0) == [[1, 'car']]
+
+    def test_subcategory_keys_after_parent(self, qtbot):
+        self.wait_for_suggestion(qtbot)
+        # Clear the suggestion, then pick the class and its second subcategory with two keystrokes
+        qtbot.keyClick(self.window, '2')
+        assert self.window.selected_classes == []
+        qtbot.keyClick(self.window, '2')
+        assert self.window.subcategory_parent == 1
+        assert [btn.text() for btn in self.window.subcategory_buttons] == ['1 - vehicle/car', '2 - vehicle/bike']
+        qtbot.keyClick(self.window, '2')
+        assert self.window.subcategory_parent is None
+        assert self.window._current_label() == [[1, 'bike']]
+        assert self.window.selected_classes_edit.toPlainText() == 'vehicle/bike'
+
+    def test_escape_keeps_class_without_subcategory(self, qtbot):
+        self.wait_for_suggestion(qtbot)
+        qtbot.keyClick(self.window, '1')
+        assert self.window.subcategory_parent is None
+        qtbot.keyClick(self.window, '2')
+        qtbot.keyClick(self.window, Qt.Key.Key_Escape)
+        assert self.window._current_label() == [1]
+
+
+class TestContextColumns:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_window(self, qtbot, tmp_path):
+        self.engine = create_database_engine(f'sqlite:///{tmp_path}/tasks.db')
+        self.Session = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        self.session = self.Session()
+
+        # The task only holds the labelled field, the context columns stay in the original file
+        self.task_directory = tmp_path
+        self.source_path = tmp_path / 'source.csv'
+        pd.DataFrame({'title': ['Apples', 'Pears'], 'body': ['red apple', 'green pear'],
+                      'author': ['ann', 'bob']}).to_csv(self.source_path, index=False)
+        self.data_path = tmp_path / 'data.csv'
+        pd.DataFrame({'body': ['red apple', 'green pear'], 'label': [None] * 2}).to_csv(self.data_path, index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        with open(synonyms_path, 'w') as f:
+            json.dump({'apple': ['apple'], 'pear': ['pear']}, f)
+
+        task = Task(task_name="Task 1", file_path=str(self.data_path), labels="apple,pear",
+                    label_column_name="label", synonyms_file_path=str(synonyms_path), field_to_label="body",
+                    single_class=True, source_file_path=str(self.source_path), context_columns="title,author",
+                    task_uuid="uuid1")
+        self.session.add(task)
+        self.session.commit()
+
+        self.window = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(self.window)
+
+        yield
+
+        self.window.text_processing_thread.wait()
+        self.window.close()
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_labels_configured_field(self, qtbot):
+        assert self.window.description_edit.toPlainText() == 'red apple'
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        assert self.window.selected_classes == [0]
+
+    def test_context_read_from_original_file(self, qtbot):
+        qtbot.waitUntil(lambda: self.window.source_rows is not None)
+        assert self.window.context_edit.toPlainText() == 'title: Apples\nauthor: ann'
+        self.window.on_next_button_clicked()
+        assert self.window.context_edit.toPlainText() == 'title: Pears\nauthor: bob'
+
+    def test_context_of_appended_rows(self, qtbot, tmp_path):
+        self.window.text_processing_thread.wait()
+        self.window.close()
+        appended_path = tmp_path / 'appended.csv'
+        pd.DataFrame({'title': ['Cars'], 'body': ['red car'], 'author': ['cy']}).to_csv(appended_path, index=False)
+        append_rows(str(appended_path), self.data_path, 'label', str(tmp_path / 'row_hashes.npy'),
+                    str(tmp_path / 'inputs.json'))
+
+        self.window = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(self.window)
+        qtbot.waitUntil(lambda: self.window.source_rows is not None)
+        assert self.window.context_edit.toPlainText() == 'title: Apples\nauthor: ann'
+        self.window.on_next_button_clicked()
+        self.window.on_next_button_clicked()
+        assert self.window.context_edit.toPlainText() == 'title: Cars\nauthor: cy'
+
+    def test_field_read_from_original_file(self, qtbot):
+        self.window.text_processing_thread.wait()
+        self.window.close()
+        pd.DataFrame({'label': [None] * 2}).to_csv(self.data_path, index=False)
+        task = self.session.query(Task).filter_by(task_uuid="uuid1").first()
+        task.field_in_source = True
+        self.session.commit()
+
+        self.window = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(self.window)
+        assert self.window.description_edit.toPlainText() == 'red apple'
+        assert self.window.context_edit.toPlainText() == 'title: Apples\nauthor: ann'
+        assert 'row_offsets' in ArtifactStore(str(self.task_directory)).manifest()
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        assert self.window.selected_classes == [0]
+
+    def test_context_copied_into_task(self, qtbot):
+        self.window.text_processing_thread.wait()
+        self.window.close()
+        pd.DataFrame({'body': ['red apple', 'green pear'], 'title': ['Apples', None], 'author': ['ann', 'bob'],
+                      'label': [None] * 2}).to_csv(self.data_path, index=False)
+        self.source_path.unlink()
+
+        self.window = LabelingProjectWindow(self.Session, "uuid1")
+        qtbot.addWidget(self.window)
+        assert self.window.source_rows_thread is None
+        assert self.window.context_edit.toPlainText() == 'title: Apples\nauthor: ann'
+        self.window.text_processing_thread.wait()
+        qtbot.wait(10)
+        self.window.on_next_button_clicked()
+        assert self.window.context_edit.toPlainText() == 'title: \nauthor: bob'
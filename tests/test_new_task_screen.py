@@ -1,4 +1,5 @@
 import json
+import os
 from unittest.mock import patch, MagicMock
 
 import pandas as pd
@@ -9,8 +10,10 @@ from PyQt6.QtWidgets import QFileDialog, QMessageBox
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from core.artifacts import ArtifactStore
+from core.synonym_index import DocumentFrequencies
 from models import Base, Task
-from screens.new_task_screen import NewTaskDialog, LoadFileThread, SaveTaskThread
+from screens.new_task_screen import NewTaskDialog, LoadFileThread, SaveTaskThread, AppendRowsThread
 
 
 class TestNewTaskDialog:
@@ -249,8 +252,85 @@ class TestSaveTaskThread:
         assert task.single_class == self.task['single_class']
         assert task.field_to_label == self.task['selected_field']
         assert task.task_uuid == self.task['task_uuid']
+        assert task.source_file_path == os.path.abspath(self.task['file_path'])
+        assert task.get_context_columns_list() == []
         session.close()
 
+    def test_save_task_with_field_in_source(self, tmp_path):
+        source_path = tmp_path / 'source.csv'
+        pd.DataFrame({'column1': ['a\nb', 'c'], 'column2': ['x', 'y']}).to_csv(source_path, index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        synonyms_path.write_text(json.dumps({'label1': ['a']}))
+        self.task.update({'file_path': str(source_path), 'synonyms_file_path': str(synonyms_path),
+                          'task_directory': str(tmp_path / 'task'), 'field_in_source': True})
+        save_task_thread = SaveTaskThread(self.Session, self.task)
+        save_task_thread.run()
+
+        # Only the label column is copied, the rows of the field are indexed in the original file
+        assert pd.read_csv(tmp_path / 'task' / 'data.csv').columns.tolist() == ['label']
+        assert len(pd.read_csv(tmp_path / 'task' / 'data.csv')) == 2
+        assert 'row_offsets' in ArtifactStore(str(tmp_path / 'task')).manifest()
+        session = self.Session()
+        task = session.query(Task).filter_by(task_uuid=self.task['task_uuid']).first()
+        assert task.field_in_source
+        assert task.source_file_path == str(source_path)
+        session.close()
+
+    def test_save_task_with_idf_weighting(self, tmp_path):
+        source_path = tmp_path / 'source.csv'
+        pd.DataFrame({'column1': ['red apple', 'green pear']}).to_csv(source_path, index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        synonyms_path.write_text(json.dumps({'label1': ['apple']}))
+        self.task.update({'file_path': str(source_path), 'synonyms_file_path': str(synonyms_path),
+                          'task_directory': str(tmp_path / 'task'), 'idf_weighting': True})
+        SaveTaskThread(self.Session, self.task).run()
+
+        store = ArtifactStore(str(tmp_path / 'task'))
+        frequencies = DocumentFrequencies.load(
+            os.path.join(store.directory, store.manifest()['document_frequencies']['file']))
+        assert frequencies.n_documents == 2
+
+    def test_save_task_from_compressed_shards(self, tmp_path):
+        for i, texts in enumerate([['a', 'b'], ['c']]):
+            pd.DataFrame({'column1': texts, 'column2': ['x'] * len(texts)}).to_csv(
+                tmp_path / f'part-{i}.csv.gz', index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        synonyms_path.write_text(json.dumps({'label1': ['a']}))
+        self.task.update({'file_path': str(tmp_path / 'part-*.csv.gz'), 'synonyms_file_path': str(synonyms_path),
+                          'task_directory': str(tmp_path / 'task'), 'context_columns': ['column2']})
+        SaveTaskThread(self.Session, self.task).run()
+
+        # Context columns of inputs that cannot be read in place are copied into the task
+        df = pd.read_csv(tmp_path / 'task' / 'data.csv')
+        assert df.columns.tolist() == ['column1', 'column2', 'label']
+        assert df['column1'].tolist() == ['a', 'b', 'c']
+        assert os.path.exists(tmp_path / 'task' / 'inputs.json')
+
+    def test_append_rows(self, tmp_path):
+        source_path = tmp_path / 'source.csv'
+        pd.DataFrame({'column1': ['a', 'b']}).to_csv(source_path, index=False)
+        synonyms_path = tmp_path / 'synonyms.json'
+        synonyms_path.write_text(json.dumps({'label1': ['a']}))
+        self.task.update({'file_path': str(source_path), 'synonyms_file_path': str(synonyms_path),
+                          'task_directory': str(tmp_path / 'task'), 'idf_weighting': True})
+        SaveTaskThread(self.Session, self.task).run()
+
+        new_path = tmp_path / 'new.csv'
+        pd.DataFrame({'column1': ['b', 'c']}).to_csv(new_path, index=False)
+        append_rows_thread = AppendRowsThread(self.Session, self.task['task_uuid'], str(new_path))
+        append_rows_thread.done.connect(lambda appended, duplicates: self.slot((appended, duplicates)))
+        append_rows_thread.run()
+
+        assert self.emitted_data == (1, 1)
+        assert pd.read_csv(tmp_path / 'task' / 'data.csv')['column1'].tolist() == ['a', 'b', 'c']
+        # The counts of the appended rows are added and stored under the new inputs of the task
+        store = ArtifactStore(str(tmp_path / 'task'))
+        entry = store.manifest()['document_frequencies']
+        assert len(entry['inputs']['rows']['inputs']) == 2
+        frequencies = DocumentFrequencies.load(os.path.join(store.directory, entry['file']))
+        assert frequencies.n_documents == 3
+        assert len(os.listdir(store.directory)) == 1
+
     def test_save_task_with_error(self):
         self.task['file_path'] = '/path/to/non/existent/file.csv'  # This file does not exist, should raise an error
         save_task_thread = SaveTaskThread(self.Session, self.task)
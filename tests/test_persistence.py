@@ -0,0 +1,64 @@
+import os
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from core.persistence import LabelJournal, atomic_write_csv
+
+
+class TestAtomicWriteCsv:
+
+    def test_write(self, tmp_path):
+        file_path = tmp_path / 'data.csv'
+        atomic_write_csv(pd.DataFrame({'a': [1, 2]}), str(file_path))
+        assert pd.read_csv(file_path)['a'].tolist() == [1, 2]
+        assert os.listdir(tmp_path) == ['data.csv']
+
+    def test_failed_write_keeps_old_file(self, tmp_path):
+        file_path = tmp_path / 'data.csv'
+        atomic_write_csv(pd.DataFrame({'a': [1, 2]}), str(file_path))
+
+        with patch('core.persistence.os.replace', side_effect=OSError('disk full')):
+            with pytest.raises(OSError):
+                atomic_write_csv(pd.DataFrame({'a': [3]}), str(file_path))
+
+        assert pd.read_csv(file_path)['a'].tolist() == [1, 2]
+        assert os.listdir(tmp_path) == ['data.csv']
+
+
+class TestLabelJournal:
+
+    def test_read_range_stops_at_incomplete_line(self, tmp_path):
+        journal = LabelJournal(str(tmp_path / 'labels.journal'))
+        journal.append({0: '[1]'})
+        end = os.path.getsize(journal.file_path)
+        journal.append({1: '[0]'})
+        with open(journal.file_path, 'a') as f:
+            f.write('[[2, "[1]"')
+        assert journal.read_range() == ({0: '[1]', 1: '[0]'}, os.path.getsize(journal.file_path) - 10)
+        assert journal.read_range(end)[0] == {1: '[0]'}
+        assert journal.read_range(0, end) == ({0: '[1]'}, end)
+
+    def test_replay_keeps_latest_value(self, tmp_path):
+        journal = LabelJournal(str(tmp_path / 'labels.journal'))
+        journal.append({0: '[1]', 1: '[0]'})
+        journal.append({0: None})
+
+        reopened = LabelJournal(str(tmp_path / 'labels.journal'))
+        assert reopened.replay() == {0: None, 1: '[0]'}
+        assert reopened.entries == 3
+
+    def test_partial_line_ignored(self, tmp_path):
+        journal = LabelJournal(str(tmp_path / 'labels.journal'))
+        journal.append({0: '[1]'})
+        with open(journal.file_path, 'a') as f:
+            f.write('[[1, "[')
+        assert journal.replay() == {0: '[1]'}
+
+    def test_truncate(self, tmp_path):
+        journal = LabelJournal(str(tmp_path / 'labels.journal'))
+        journal.append({0: '[1]'})
+        journal.truncate()
+        assert journal.replay() == {}
+        assert journal.entries == 0
@@ -0,0 +1,62 @@
+import pytest
+
+from core.phrase_matcher import PhraseMatcher
+from core.synonym_index import SynonymIndex
+
+
+class TestPhraseMatcher:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_matcher(self):
+        self.matcher = PhraseMatcher({
+            'fruit': ['apple', 'apple pie', 'pie crust'],
+            'vehicle': {'car': ['car', 'red car'], 'bike': ['bicycle']},
+        })
+
+    def test_finds_overlapping_phrases(self):
+        text = 'Apple pie crust'
+        matches = self.matcher.find(text)
+        assert sorted((text[m.start:m.end], m.class_name) for m in matches) == [
+            ('Apple', 'fruit'), ('Apple pie', 'fruit'), ('pie crust', 'fruit')]
+
+    def test_matches_whole_words_only(self):
+        assert self.matcher.find('a cart and a carpet') == []
+        assert [m.phrase for m in self.matcher.find('the car.')] == ['car']
+
+    def test_subcategories(self):
+        matches = self.matcher.find('a red car and a bicycle')
+        assert {(m.subcategory, m.phrase) for m in matches} == {('car', 'car'), ('car', 'red car'),
+                                                                ('bike', 'bicycle')}
+        assert {m.class_name for m in matches} == {'vehicle'}
+
+    def test_fail_links(self):
+        # 'red' starts 'red car' but the scan has to fall back to find 'car' after 'red red'
+        matches = self.matcher.find('red red car')
+        assert sorted(m.phrase for m in matches) == ['car', 'red car']
+        assert [m.start for m in matches if m.phrase == 'red car'] == [4]
+
+    def test_class_scores(self):
+        text = 'apple car'
+        scores = PhraseMatcher.class_scores(self.matcher.find(text), text)
+        assert scores == {'fruit': pytest.approx(5 / 9), 'vehicle': pytest.approx(3 / 9)}
+
+
+class TestSuggest:
+
+    def test_exact_matches_before_vectors(self):
+        index = SynonymIndex({'fruit': ['green apple'], 'colour': ['green']})
+        scores, subcategory_scores, matches = index.suggest('a green apple')
+        assert set(scores) == {'fruit', 'colour'}
+        assert scores['fruit'] > scores['colour']
+        assert len(matches) == 2
+
+    def test_falls_back_to_vectors(self):
+        index = SynonymIndex({'fruit': ['green apple'], 'colour': ['blue']})
+        scores, subcategory_scores, matches = index.suggest('apple')
+        assert matches == []
+        assert scores['fruit'] > 0 and scores['colour'] == 0
+
+    def test_matcher_rebuilt_on_update(self):
+        index = SynonymIndex({'fruit': ['apple']})
+        index.update({'fruit': ['pear']})
+        assert [m.phrase for m in index.matcher.find('apple pear')] == ['pear']
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from core import profiling
+from core.profiling import SessionProfiler, ThreadSampler, save_session_profile, PROFILES_DIRECTORY_NAME, \
+    _function_key
+
+
+def busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestThreadSampler:
+
+    def test_samples_worker_threads(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_worker, args=(stop,))
+        worker.start()
+        sampler = ThreadSampler(interval=0.001, ignore=[threading.get_ident()])
+        try:
+            for _ in range(20):
+                sampler.sample(sampler.ignore)
+        finally:
+            stop.set()
+            worker.join()
+        assert sampler.samples == 20
+        names = {key[2] for key in sampler.cumulative}
+        assert 'busy_worker' in names
+        # The test thread itself is not sampled
+        assert 'TestThreadSampler.test_samples_worker_threads' not in names
+        # Named Thread._bootstrap from Python 3.11, _bootstrap before
+        assert any(name.endswith('_bootstrap') for name in sampler.threads)
+        assert 'busy_worker' in sampler.summary()
+
+
+    def test_code_without_qualified_name(self):
+        # Code objects before Python 3.11
+        code = SimpleNamespace(co_filename='worker.py', co_firstlineno=3, co_name='run')
+        assert _function_key(code) == ('worker.py', 3, 'run')
+
+class TestSessionProfiler:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_directory(self, tmp_path):
+        self.task_directory = str(tmp_path)
+
+    def test_save_writes_profile_and_summary(self):
+        profiler = SessionProfiler(sample_interval=0.001)
+        profiler.start()
+        try:
+            sum(range(100000))
+            time.sleep(0.01)
+            profile_path, summary_path = profiler.save(self.task_directory)
+            # Still recording after a save
+            assert profiler.running
+        finally:
+            profiler.stop()
+        assert os.path.dirname(profile_path) == os.path.join(self.task_directory, PROFILES_DIRECTORY_NAME)
+        assert os.path.getsize(profile_path) > 0
+        with open(summary_path) as f:
+            summary = f.read()
+        assert 'GUI thread, top 30 functions by cumulative time' in summary
+        assert 'time.sleep' in summary
+        assert 'Worker threads' in summary
+
+    def test_nothing_saved_without_flag(self):
+        assert profiling.session_profiler is None
+        assert save_session_profile(self.task_directory) is None
+        assert not os.path.exists(os.path.join(self.task_directory, PROFILES_DIRECTORY_NAME))
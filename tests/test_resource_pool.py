@@ -0,0 +1,29 @@
+from unittest.mock import MagicMock
+
+from core.resource_pool import ResourcePool
+
+
+class TestResourcePool:
+
+    def test_loaded_once_and_shared(self):
+        pool = ResourcePool()
+        load = MagicMock(return_value=object())
+        first = pool.acquire('key', load)
+        second = pool.acquire('key', load)
+        assert first is second
+        load.assert_called_once()
+
+    def test_evicted_when_last_holder_releases(self):
+        pool = ResourcePool()
+        resource = MagicMock()
+        pool.acquire('key', lambda: resource)
+        pool.acquire('key', lambda: resource)
+        pool.release('key')
+        assert 'key' in pool
+        resource.close.assert_not_called()
+        pool.release('key')
+        assert 'key' not in pool
+        resource.close.assert_called_once()
+        # Releasing a key nobody holds does nothing
+        pool.release('key')
+        assert len(pool) == 0
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from core.label_store import LabelStore
+from core.persistence import LabelJournal
+from core.sharding import ShardManager
+
+
+class TestShardManager:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_manager(self, tmp_path):
+        self.task_directory = str(tmp_path)
+        self.manager = ShardManager(self.task_directory, lease_seconds=60)
+
+    def test_shards_are_disjoint(self):
+        assert self.manager.create_shards(range(10), shard_size=4) == 3
+        rows = [self.manager.shard_rows(shard_id) for shard_id in range(3)]
+        assert rows == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+    def test_audit_rows_in_two_shards(self):
+        self.manager.create_shards(range(100), shard_size=10, audit_fraction=0.1)
+        manifest = self.manager.load_manifest()
+        assert len(manifest['audit_rows']) == 10
+        occurrences = {}
+        for shard in manifest['shards']:
+            for index in shard['rows']:
+                occurrences[index] = occurrences.get(index, 0) + 1
+        assert {index for index, count in occurrences.items() if count == 2} == set(manifest['audit_rows'])
+
+    def test_create_twice_raises(self):
+        self.manager.create_shards(range(10), shard_size=4)
+        with pytest.raises(ValueError):
+            self.manager.create_shards(range(10), shard_size=4)
+
+    def test_leases_are_exclusive(self):
+        self.manager.create_shards(range(10), shard_size=5)
+        alice = self.manager.lease('alice')
+        bob = self.manager.lease('bob')
+        assert {alice.shard_id, bob.shard_id} == {0, 1}
+        assert self.manager.lease('carol') is None
+        # Asking again returns the shard already held
+        assert self.manager.lease('alice').shard_id == alice.shard_id
+
+    def test_expired_lease_taken_over(self):
+        self.manager.create_shards(range(5), shard_size=5)
+        alice = self.manager.lease('alice')
+        with open(os.path.join(self.task_directory, 'shards', '0.lease'), 'w') as f:
+            json.dump(alice._replace(expires_at=time.time() - 1)._asdict(), f)
+
+        assert self.manager.lease('bob').shard_id == 0
+        assert self.manager.renew(alice) is None
+
+    def test_completed_shard_not_leased_again(self):
+        self.manager.create_shards(range(5), shard_size=5)
+        self.manager.complete(self.manager.lease('alice'))
+        assert self.manager.lease('bob') is None
+
+    def test_invalid_annotator(self):
+        self.manager.create_shards(range(5), shard_size=5)
+        with pytest.raises(ValueError):
+            self.manager.lease('../alice')
+
+    def test_merge(self):
+        self.manager.create_shards(range(4), shard_size=2)
+        LabelJournal(self.manager.journal_path('alice')).append({0: '[1]', 1: '[0]', 2: '[1]'})
+        LabelJournal(self.manager.journal_path('bob')).append({1: '[0]', 2: '[0]', 3: None})
+
+        data_path = os.path.join(self.task_directory, 'data.csv')
+        pd.DataFrame({'description': list('abcd'), 'label': [None] * 4}).to_csv(data_path, index=False)
+        label_store = LabelStore(pd.read_csv(data_path), 'label')
+        report = self.manager.merge_into_file(label_store, data_path,
+                                              LabelJournal(os.path.join(self.task_directory, 'labels.journal')))
+
+        assert report.merged == 2
+        assert report.double_labelled == 2
+        assert report.agreements == 1
+        assert report.conflicts == [{'index': 2, 'labels': {'alice': '[1]', 'bob': '[0]'}}]
+        saved = pd.read_csv(data_path)['label'].tolist()
+        assert saved[:2] == ['[1]', '[0]']
+        assert pd.isnull(saved[2]) and pd.isnull(saved[3])
+
+    def test_merge_again_keeps_canonical_corrections(self):
+        self.manager.create_shards(range(4), shard_size=2)
+        alice = LabelJournal(self.manager.journal_path('alice'))
+        alice.append({0: '[1]', 1: '[0]'})
+        data_path = os.path.join(self.task_directory, 'data.csv')
+        pd.DataFrame({'description': list('abcd'), 'label': [None] * 4}).to_csv(data_path, index=False)
+        journal = LabelJournal(os.path.join(self.task_directory, 'labels.journal'))
+        label_store = LabelStore(pd.read_csv(data_path), 'label')
+        self.manager.merge_into_file(label_store, data_path, journal)
+
+        # Row 0 is corrected in the task, then alice labels another row
+        journal.append({0: '[0]'})
+        alice.append({2: '[1]'})
+        label_store = LabelStore(pd.read_csv(data_path), 'label')
+        report = self.manager.merge_into_file(label_store, data_path, journal)
+
+        assert report.merged == 1
+        saved = pd.read_csv(data_path)['label'].tolist()
+        assert saved[:3] == ['[0]', '[0]', '[1]']
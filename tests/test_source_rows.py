@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.source_rows import SourceRows, build_row_offsets, open_input_rows
+
+
+class TestSourceRows:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_file(self, tmp_path):
+        self.file_path = tmp_path / 'source.csv'
+        self.df = pd.DataFrame({
+            'id': ['1', '2', '3'],
+            'text': ['plain', 'two\nlines, "quoted"', 'café'],
+            'notes': ['a', '', 'c'],
+        })
+        self.df.to_csv(self.file_path, index=False)
+
+    def test_rows_match_pandas(self):
+        source_rows = SourceRows(str(self.file_path))
+        assert len(source_rows) == len(self.df)
+        assert source_rows.columns == ['id', 'text', 'notes']
+        for position, row in self.df.fillna('').iterrows():
+            assert source_rows.row(position) == row.to_dict()
+
+    def test_row_with_columns(self):
+        source_rows = SourceRows(str(self.file_path))
+        assert source_rows.row(1, ['notes', 'text']) == {'notes': '', 'text': 'two\nlines, "quoted"'}
+        assert source_rows.row(0, ['missing']) == {'missing': ''}
+
+    def test_row_out_of_range(self):
+        with pytest.raises(IndexError):
+            SourceRows(str(self.file_path)).row(3)
+
+    def test_offsets_skip_blank_lines_and_handle_missing_final_newline(self, tmp_path):
+        file_path = tmp_path / 'blank.csv'
+        file_path.write_bytes(b'a,b\r\n1,x\r\n\r\n2,"y\r\nz"')
+        offsets = build_row_offsets(str(file_path))
+        assert offsets.tolist() == [5, 12, 20]
+        assert len(pd.read_csv(file_path)) == 2
+        assert SourceRows(str(file_path)).row(1) == {'a': '2', 'b': 'y\r\nz'}
+
+    def test_byte_order_mark_not_in_first_column(self, tmp_path):
+        file_path = tmp_path / 'bom.csv'
+        file_path.write_bytes(b'\xef\xbb\xbfid,text\n1,caf\xc3\xa9\n2,x\n')
+        source_rows = SourceRows(str(file_path))
+        assert source_rows.columns == ['id', 'text']
+        assert source_rows.offsets.tolist() == [11, 19, 23]
+        assert source_rows.row(0) == {'id': '1', 'text': 'café'}
+        assert source_rows.value(1, 'id') == '2'
+        source_rows.close()
+
+    def test_index_saved_and_reused(self, tmp_path):
+        index_path = str(tmp_path / 'row_offsets.npy')
+        built = SourceRows(str(self.file_path), index_path)
+        assert os.path.exists(index_path)
+        reused = SourceRows(str(self.file_path), index_path)
+        assert isinstance(reused.offsets, np.memmap)
+        assert reused.offsets.dtype == np.uint64
+        assert reused.offsets.tolist() == built.offsets.tolist()
+        assert reused.row(1)['text'] == 'two\nlines, "quoted"'
+        built.close()
+        reused.close()
+
+    def test_index_rebuilt_when_file_changes(self, tmp_path):
+        index_path = str(tmp_path / 'row_offsets.npy')
+        SourceRows(str(self.file_path), index_path).close()
+        with open(self.file_path, 'a') as f:
+            f.write('4,new,d\n')
+        source_rows = SourceRows(str(self.file_path), index_path)
+        assert len(source_rows) == 4
+        assert source_rows.row(3) == {'id': '4', 'text': 'new', 'notes': 'd'}
+        source_rows.close()
+
+    def test_rows_across_inputs(self, tmp_path):
+        appended_path = tmp_path / 'appended.csv'
+        pd.DataFrame({'id': ['4', '5'], 'text': ['four', 'five'], 'notes': ['d', 'e']}).to_csv(appended_path,
+                                                                                              index=False)
+        inputs = [{'path': None, 'first_row': 0, 'rows': 3},
+                  {'path': str(appended_path), 'first_row': 3, 'rows': 2, 'duplicates': 0},
+                  # Rows were skipped as duplicates, they no longer line up with the file
+                  {'path': str(appended_path), 'first_row': 5, 'rows': 1, 'duplicates': 1}]
+        input_rows = open_input_rows(inputs, str(self.file_path))
+        assert len(input_rows) == 6
+        assert input_rows.row(0, ['id']) == {'id': '1'}
+        assert input_rows.row(4, ['text']) == {'text': 'five'}
+        assert input_rows.row(5) is None
+        input_rows.close()
@@ -1,4 +1,6 @@
-from unittest.mock import patch
+import os
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
 
 import pytest
 from PyQt6 import QtCore
@@ -6,7 +8,8 @@ from PyQt6.QtWidgets import QApplication, QMessageBox
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Task, Base
-from screens.start_screen import StartWindow
+from screens import start_screen
+from screens.start_screen import StartWindow, TrashReaperThread
 
 
 class TestStartWindow:
@@ -77,8 +80,8 @@ class TestStartWindow:
         # Check that the task has been removed from the table
         assert self.window.task_table_widget.rowCount() == 0
 
-        # Check that the task has been removed from the database
-        assert self.session.query(Task).count() == 0
+        # Check that the task has been flagged as deleted, its row is removed by the trash reaper
+        assert self.session.query(Task).filter(Task.deleted.isnot(True)).count() == 0
 
     def test_open_button_click(self, qtbot):
         # Add a task to the database
@@ -97,3 +100,86 @@ class TestStartWindow:
             # Check if LabelingProjectWindow was instantiated with the correct arguments
             MockLabelingProjectWindow.assert_called_once_with(self.Session, task.task_uuid)
 
+
+
+    def test_task_not_opened_in_both_modes(self, qtbot):
+        task = SimpleNamespace(task_uuid="uuid1")
+        self.window.grid_windows["uuid1"] = MagicMock(**{'isVisible.return_value': True})
+        with patch('screens.start_screen.LabelingProjectWindow') as MockLabelingProjectWindow, \
+                patch.object(QMessageBox, 'warning') as warning:
+            self.window.on_open_button_clicked(task)
+        MockLabelingProjectWindow.assert_not_called()
+        warning.assert_called_once()
+        assert "uuid1" not in self.window.label_windows
+
+    def test_open_task_not_deleted(self, qtbot):
+        task = SimpleNamespace(task_uuid="uuid1", task_name="Task 1")
+        self.window.label_windows["uuid1"] = MagicMock(**{'isVisible.return_value': True})
+        with patch.object(QMessageBox, 'exec') as confirm, patch.object(QMessageBox, 'warning') as warning, \
+                patch('screens.start_screen.move_to_trash') as move:
+            self.window.on_delete_button_clicked(task)
+        warning.assert_called_once()
+        confirm.assert_not_called()
+        move.assert_not_called()
+
+
+class TestTrashReaperThread:
+
+    def test_removes_deleted_tasks(self, qtbot, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        engine = create_engine(f'sqlite:///{tmp_path}/tasks.db')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        for task_uuid, deleted in [('uuid1', True), ('uuid2', False)]:
+            task_directory = tmp_path / 'tasks' / task_uuid
+            task_directory.mkdir(parents=True)
+            (task_directory / 'data.csv').write_text('field,label\n')
+            session.add(Task(task_name=task_uuid, file_path=str(task_directory / 'data.csv'), labels="a,b",
+                             label_column_name="label", field_to_label="field", single_class=True,
+                             task_uuid=task_uuid, deleted=deleted))
+        session.commit()
+
+        # The directory of a task flagged as deleted but not moved yet is reaped too
+        thread = TrashReaperThread(Session, str(tmp_path / 'tasks' / '.trash'))
+        with qtbot.waitSignal(thread.done):
+            thread.start()
+        thread.wait()
+
+        assert [task.task_uuid for task in session.query(Task).all()] == ['uuid2']
+        assert not (tmp_path / 'tasks' / 'uuid1').exists()
+        assert (tmp_path / 'tasks' / 'uuid2').exists()
+        assert os.listdir(tmp_path / 'tasks' / '.trash') == []
+        session.close()
+
+    def test_task_failing_to_move_left_for_later(self, qtbot, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        engine = create_engine(f'sqlite:///{tmp_path}/tasks.db')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        for task_uuid in ['uuid1', 'uuid2']:
+            task_directory = tmp_path / 'tasks' / task_uuid
+            task_directory.mkdir(parents=True)
+            (task_directory / 'data.csv').write_text('field,label\n')
+            session.add(Task(task_name=task_uuid, file_path=str(task_directory / 'data.csv'), labels="a,b",
+                             label_column_name="label", field_to_label="field", single_class=True,
+                             task_uuid=task_uuid, deleted=True))
+        session.commit()
+
+        def move_to_trash(task_directory, trash_directory):
+            if task_directory.endswith('uuid1'):
+                raise OSError("in use")
+            return real_move_to_trash(task_directory, trash_directory)
+
+        real_move_to_trash = start_screen.move_to_trash
+        monkeypatch.setattr(start_screen, 'move_to_trash', move_to_trash)
+        thread = TrashReaperThread(Session, str(tmp_path / 'tasks' / '.trash'))
+        with qtbot.waitSignal(thread.done):
+            thread.start()
+        thread.wait()
+
+        assert [task.task_uuid for task in session.query(Task).all()] == ['uuid1']
+        assert (tmp_path / 'tasks' / 'uuid1').exists()
+        assert not (tmp_path / 'tasks' / 'uuid2').exists()
+        session.close()
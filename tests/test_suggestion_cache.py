@@ -0,0 +1,58 @@
+import pytest
+
+from core.suggestion_cache import SuggestionCache
+from core.synonym_index import SynonymIndex
+
+
+class TestSuggestionCache:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_cache(self, tmp_path):
+        self.path = str(tmp_path / 'suggestion_cache.sqlite')
+        self.index = SynonymIndex({'fruit': ['apple'], 'vehicle': {'car': ['red car'], 'bike': ['bike']}})
+        self.cache = SuggestionCache(self.path)
+
+        yield
+
+        self.cache.close()
+
+    def test_hit_matches_suggest(self):
+        first = self.cache.suggest(self.index, 'a red car')
+        assert self.cache.hits == 0
+        second = self.cache.suggest(self.index, 'a red car')
+        assert second == first == self.index.suggest('a red car')
+        assert self.cache.stats() == {'lookups': 2, 'hits': 1, 'disk_hits': 0, 'hit_rate': 0.5}
+
+    def test_normalized_text_shares_suggestion(self):
+        self.cache.suggest(self.index, 'An apple')
+        scores, subcategory_scores, matches = self.cache.suggest(self.index, '  an APPLE ')
+        assert self.cache.hits == 1
+        # Matches are shifted to the position of the description
+        assert [(match.start, match.end) for match in matches] == [(5, 10)]
+        assert (scores, subcategory_scores, matches) == self.index.suggest('  an APPLE ')
+
+    def test_shared_across_sessions(self):
+        expected = self.cache.suggest(self.index, 'bike')
+        self.cache.close()
+        self.cache = SuggestionCache(self.path)
+        assert self.cache.suggest(self.index, 'bike') == expected
+        assert self.cache.disk_hits == 1
+
+    def test_synonyms_change_invalidates(self):
+        self.cache.suggest(self.index, 'a pear')
+        self.index.update({'fruit': ['apple', 'pear'], 'vehicle': {'car': ['red car'], 'bike': ['bike']}})
+        scores, _, _ = self.cache.suggest(self.index, 'a pear')
+        assert scores['fruit'] > 0
+        assert self.cache.hits == 0
+
+        self.cache.prune(self.index.fingerprint)
+        count = self.cache.connection.execute('SELECT COUNT(*) FROM suggestions').fetchone()[0]
+        assert count == 1
+
+    def test_lru_is_bounded(self):
+        cache = SuggestionCache(capacity=2)
+        for text in ['apple', 'bike', 'red car']:
+            cache.suggest(self.index, text)
+        assert len(cache.memory) == 2
+        cache.suggest(self.index, 'apple')
+        assert cache.hits == 0
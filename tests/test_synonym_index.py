@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.synonym_index import SynonymIndex, ScoreMatrix, DocumentFrequencies, load_document_frequencies, \
+    index_fingerprint
+
+
+class TestSynonymIndex:
+
+    @pytest.fixture(scope='function', autouse=True)
+    def setup_index(self):
+        self.class_synonyms = {
+            'fruit': ['apple', 'pear'],
+            'vehicle': {'car': ['car', 'sedan'], 'bike': ['bike', 'bicycle']},
+        }
+        self.index = SynonymIndex(self.class_synonyms)
+
+    def test_score(self):
+        scores = self.index.score('a red apple')
+        assert scores['fruit'] > 0
+        assert scores['vehicle'] == 0
+        # A class with subcategories scores its best subcategory
+        assert self.index.score('bike')['vehicle'] == pytest.approx(self.index.score_hierarchy('bike')[1]['vehicle']['bike'])
+
+    def test_score_hierarchy(self):
+        scores, subcategory_scores = self.index.score_hierarchy('a bicycle')
+        assert list(subcategory_scores) == ['vehicle']
+        assert subcategory_scores['vehicle']['bike'] > 0
+        assert subcategory_scores['vehicle']['car'] == 0
+        assert scores['vehicle'] == pytest.approx(subcategory_scores['vehicle']['bike'])
+        assert scores == pytest.approx(self.index.score('a bicycle'))
+
+    def test_score_hierarchy_prunes_unlikely_classes(self):
+        scores, subcategory_scores = self.index.score_hierarchy('an apple')
+        assert subcategory_scores == {}
+        assert scores['vehicle'] == 0
+
+        # The centroid of 'vehicle' averages the bike synonyms with the unrelated car synonyms
+        scores, subcategory_scores = self.index.score_hierarchy('bike', threshold=0.4)
+        assert subcategory_scores == {}
+        assert scores['vehicle'] < 0.4
+
+    def test_subcategory_names(self):
+        assert self.index.subcategory_names('vehicle') == ['car', 'bike']
+        assert self.index.subcategory_names('fruit') == []
+
+    def test_update_rebuilds_only_changed_classes(self):
+        vehicle_entry = self.index.classes['vehicle']
+        changed = self.index.update({**self.class_synonyms, 'fruit': ['apple', 'banana']})
+        assert list(changed) == ['fruit']
+        assert self.index.classes['vehicle'] is vehicle_entry
+        assert self.index.version == 1
+
+    def test_update_reports_removed_classes(self):
+        changed = self.index.update({'fruit': ['apple', 'pear']})
+        assert list(changed) == ['vehicle']
+        assert self.index.class_names == ['fruit']
+
+    def test_unchanged_update(self):
+        assert self.index.update(dict(self.class_synonyms)) == {}
+        assert self.index.version == 0
+
+    def test_update_copy_leaves_original(self):
+        copy = self.index.copy()
+        copy.update({**self.class_synonyms, 'fruit': ['banana']})
+        assert self.index.class_synonyms['fruit'] == ['apple', 'pear']
+        assert self.index.score('banana')['fruit'] == 0
+        assert copy.score('banana')['fruit'] > 0
+        assert copy.classes['vehicle'] is self.index.classes['vehicle']
+        assert copy.fingerprint == index_fingerprint({**self.class_synonyms, 'fruit': ['banana']})
+
+
+class TestDocumentFrequencies:
+
+    def test_update_counts_documents(self):
+        frequencies = DocumentFrequencies(n_features=2 ** 10)
+        frequencies.update(['red apple', 'red red car'])
+        frequencies.update(['green pear'])
+        features = frequencies.vectorizer.transform(['red', 'apple']).indices
+        assert frequencies.n_documents == 3
+        assert sorted(frequencies.counts[features].tolist()) == [1, 2]
+        idf = frequencies.idf()
+        # A word in more documents weighs less
+        red, apple = frequencies.vectorizer.transform(['red']).indices[0], \
+            frequencies.vectorizer.transform(['apple']).indices[0]
+        assert idf[red] < idf[apple]
+
+    def test_idf_lowers_common_words(self):
+        frequencies = DocumentFrequencies()
+        frequencies.update(['product apple', 'product car', 'product pear', 'product bike'])
+        plain = SynonymIndex({'fruit': ['product apple']})
+        weighted = SynonymIndex({'fruit': ['product apple']}, idf=frequencies.idf())
+        assert weighted.score('product')['fruit'] < plain.score('product')['fruit']
+        assert weighted.score('apple')['fruit'] > plain.score('apple')['fruit']
+
+    def test_load_counts_once_and_saves(self, tmp_path):
+        csv_path = tmp_path / 'data.csv'
+        pd.DataFrame({'text': ['red apple', None, 'green pear'], 'other': [1, 2, 3]}).to_csv(csv_path, index=False)
+        path = str(tmp_path / 'document_frequencies.npz')
+        counted = load_document_frequencies(path, csv_path, 'text', chunk_rows=2)
+        assert counted.n_documents == 3
+        csv_path.unlink()
+        loaded = load_document_frequencies(path, csv_path, 'text')
+        assert loaded.n_documents == 3
+        assert np.array_equal(loaded.counts, counted.counts)
+
+
+class TestScoreMatrix:
+
+    def scored_matrix(self, index, texts):
+        matrix = ScoreMatrix(index.class_names)
+        vectors = index.transform(texts)
+        matrix.add(list(range(len(texts))), vectors, index.score_vectors(vectors, index.class_names))
+        return matrix
+
+    def test_apply_update_only_touches_rows_with_changed_features(self):
+        index = SynonymIndex({'fruit': ['apple'], 'vehicle': ['car']})
+        matrix = self.scored_matrix(index, ['apple', 'banana split', 'car'])
+        assert matrix.top_k(1, 1) == []
+
+        changed = index.update({'fruit': ['apple', 'banana'], 'vehicle': ['car']})
+        affected = matrix.apply_update(index, changed, k=1)
+
+        assert affected == [1]
+        assert matrix.row_scores(1)['fruit'] > 0
+        assert matrix.row_scores(2) == {'fruit': 0, 'vehicle': pytest.approx(1)}
+
+    def test_apply_update_matches_full_rescore(self):
+        index = SynonymIndex({'fruit': ['apple pie'], 'vehicle': ['red car']})
+        texts = ['apple pie', 'red apple', 'red car', 'blue car']
+        matrix = self.scored_matrix(index, texts)
+
+        changed = index.update({'fruit': ['apple pie'], 'vehicle': ['blue car'], 'colour': ['red']})
+        matrix.apply_update(index, changed)
+
+        expected = self.scored_matrix(index, texts)
+        assert matrix.class_names == expected.class_names
+        assert (abs(matrix.scores - expected.scores) < 1e-6).all()
@@ -0,0 +1,32 @@
+import os
+
+from core.task_files import directory_size, move_to_trash, empty_trash, format_size
+
+
+class TestTaskFiles:
+
+    def test_directory_size(self, tmp_path):
+        (tmp_path / 'data.csv').write_bytes(b'x' * 100)
+        (tmp_path / 'journals').mkdir()
+        (tmp_path / 'journals' / 'alice.journal').write_bytes(b'x' * 20)
+        assert directory_size(str(tmp_path)) == 120
+        assert directory_size(str(tmp_path / 'missing')) == 0
+
+    def test_move_to_trash_and_empty(self, tmp_path):
+        task_directory = tmp_path / 'uuid1'
+        task_directory.mkdir()
+        (task_directory / 'data.csv').write_bytes(b'x' * 10)
+        trash_directory = str(tmp_path / '.trash')
+
+        trashed = move_to_trash(str(task_directory), trash_directory)
+        assert not task_directory.exists()
+        assert os.path.basename(trashed).startswith('uuid1.')
+        assert move_to_trash(str(task_directory), trash_directory) is None
+
+        assert empty_trash(trash_directory) == 10
+        assert os.listdir(trash_directory) == []
+
+    def test_format_size(self):
+        assert format_size(512) == '512 B'
+        assert format_size(1536) == '1.5 KB'
+        assert format_size(3 * 1024 ** 4) == '3072.0 GB'